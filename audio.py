@@ -0,0 +1,232 @@
+"""
+Persistent audio engine of the plant weight water control system.
+
+The sound prompts are RIFF WAVE files created by `setup.py` with the speech synthesiser `flite`.  They are
+decoded once at startup and kept in memory.  A single worker thread takes the prompts from a priority queue
+and feeds their samples to one long-lived `aplay` process, so playing a prompt neither starts a new process
+nor blocks the caller.
+"""
+
+import glob
+import os.path
+import queue
+import subprocess
+import threading
+import time
+import wave
+
+APLAY = '/usr/bin/aplay'
+
+# prompt priorities, lower values are played first
+URGENT = 0
+NORMAL = 1
+BACKGROUND = 2
+
+# seconds of audio sent to the player in each write
+CHUNK_TIME = 0.05
+# seconds of audio the player may have buffered ahead of the playback, this bounds the delay of a cut off
+LEAD_TIME = 0.1
+
+SAMPLE_FORMATS = {
+    1: 'U8',
+    2: 'S16_LE',
+    4: 'S32_LE',
+}
+
+
+class Clip:
+    """
+    A decoded sound file.
+    """
+    def __init__ (self, filename):
+        reader = wave.open (filename, 'rb')
+        try:
+            self.channels = reader.getnchannels ()
+            self.sample_width = reader.getsampwidth ()
+            self.rate = reader.getframerate ()
+            self.frames = reader.readframes (reader.getnframes ())
+        finally:
+            reader.close ()
+
+    def audio_format (self):
+        return self.channels, self.sample_width, self.rate
+
+    def bytes_per_second (self):
+        return self.channels * self.sample_width * self.rate
+
+
+class AudioEngine:
+    """
+    Play sound prompts from a priority queue in a background thread.
+
+    Prompts are identified by their filename relative to the sound folder.  A prompt played with `interrupt`
+    cuts off the prompt being played, and `cancel` removes a prompt from the queue and stops it if it is
+    being played.
+    """
+    def __init__ (self, folder, player=APLAY, log=None, on_play=None):
+        """
+        :param on_play: function called with the sound and the seconds it waited in the queue when it starts
+        being played.
+        """
+        self.folder = folder
+        self.player = player
+        self.log = log if log is not None else print
+        self.on_play = on_play if on_play is not None else (lambda sound, waited: None)
+        self.clips = {}
+        self.requests = queue.PriorityQueue ()
+        self.sequence = 0
+        self.lock = threading.Lock ()
+        self.cancelled = set ()
+        self.playing = None
+        self.cut = threading.Event ()
+        self.process = None
+        self.process_format = None
+        self.worker = None
+
+    def load (self):
+        """
+        Decode all the sound prompts in the sound folder.
+        """
+        for filename in sorted (glob.glob (os.path.join (self.folder, '*.riff'))):
+            try:
+                self.clips [os.path.basename (filename)] = Clip (filename)
+            except (EOFError, wave.Error) as ex:
+                self.log ('could not decode sound file {}: {}'.format (filename, ex))
+        self.log ('loaded {} sound prompts'.format (len (self.clips)))
+        return None
+
+    def start (self):
+        """
+        Decode the sound prompts and start the audio worker.
+        """
+        self.load ()
+        self.worker = threading.Thread (target=self.run, name='audio')
+        self.worker.daemon = True
+        self.worker.start ()
+        return None
+
+    def play (self, sound, priority=NORMAL, interrupt=False):
+        """
+        Queue a sound to be played.  The function returns immediately.
+
+        :param sound: the sound filename, relative to the sound folder, or the path of a sound file that is
+        decoded now.
+        :param priority: prompts with lower values are played first.
+        :param interrupt: whether to cut off the prompt being played.
+        """
+        # the clips of absolute paths, such as synthesised sentences, are not kept after they are played
+        clip = None
+        if sound not in self.clips:
+            path = sound if os.path.isabs (sound) else os.path.join (self.folder, sound)
+            try:
+                clip = Clip (path)
+            except (IOError, EOFError, wave.Error) as ex:
+                self.log ('could not decode sound file {}: {}'.format (path, ex))
+                return None
+            if not os.path.isabs (sound):
+                self.clips [sound] = clip
+                clip = None
+        with self.lock:
+            self.cancelled.discard (sound)
+            self.sequence += 1
+            self.requests.put ((priority, self.sequence, sound, time.time (), clip))
+            if interrupt and self.playing is not None:
+                self.cut.set ()
+        return None
+
+    def cancel (self, sound):
+        """
+        Remove a sound from the queue and stop it if it is being played.
+        """
+        with self.lock:
+            self.cancelled.add (sound)
+            if self.playing == sound:
+                self.cut.set ()
+        return None
+
+    def wait (self):
+        """
+        Wait until all queued sounds have been played.
+        """
+        self.requests.join ()
+        return None
+
+    def close (self):
+        self.requests.put ((URGENT, 0, None, None, None))
+        if self.worker is not None:
+            self.worker.join ()
+        return None
+
+    def run (self):
+        while True:
+            _, _, sound, queued, clip = self.requests.get ()
+            try:
+                if sound is None:
+                    self.stop_player ()
+                    return
+                with self.lock:
+                    if sound in self.cancelled:
+                        continue
+                    self.playing = sound
+                    self.cut.clear ()
+                self.on_play (sound, time.time () - queued)
+                self.feed (clip if clip is not None else self.clips [sound])
+            except Exception as ex:
+                self.log ('an error occur while playing sound {}: {}'.format (sound, ex))
+                self.stop_player ()
+            finally:
+                with self.lock:
+                    self.playing = None
+                self.requests.task_done ()
+
+    def feed (self, clip):
+        """
+        Send the samples of a clip to the player at playback speed, so that a cut off takes effect at most
+        `LEAD_TIME` seconds later.
+        """
+        player = self.player_for (clip)
+        rate = clip.bytes_per_second ()
+        frame_size = clip.channels * clip.sample_width
+        chunk = max (frame_size, int (rate * CHUNK_TIME) // frame_size * frame_size)
+        start = time.time ()
+        for offset in range (0, len (clip.frames), chunk):
+            if self.cut.is_set ():
+                break
+            ahead = float (offset) / rate - (time.time () - start)
+            if ahead > LEAD_TIME:
+                time.sleep (ahead - LEAD_TIME)
+            player.stdin.write (clip.frames [offset:offset + chunk])
+            player.stdin.flush ()
+        return None
+
+    def player_for (self, clip):
+        """
+        Return the player process, starting a new one if there is none or if the clip has another format.
+        """
+        if self.process is not None and \
+                (self.process.poll () is not None or self.process_format != clip.audio_format ()):
+            self.stop_player ()
+        if self.process is None:
+            command = [
+                self.player,
+                '-q',
+                '-t', 'raw',
+                '-f', SAMPLE_FORMATS [clip.sample_width],
+                '-c', str (clip.channels),
+                '-r', str (clip.rate),
+                '--buffer-time={}'.format (int (LEAD_TIME * 1000000)),
+                '-',
+            ]
+            self.process = subprocess.Popen (command, stdin=subprocess.PIPE)
+            self.process_format = clip.audio_format ()
+        return self.process
+
+    def stop_player (self):
+        if self.process is not None:
+            try:
+                self.process.stdin.close ()
+            except (IOError, OSError):
+                pass
+            self.process.wait ()
+            self.process = None
+        return None
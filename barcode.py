@@ -0,0 +1,168 @@
+"""
+Barcode reader subsystem.
+
+The barcode scanner acts like a USB keyboard.  Its raw HID device returns 8 byte reports: the first byte
+has the modifier keys and the third to the eighth bytes have the keycodes of the pressed keys.  A barcode
+is a sequence of keys terminated by the enter key.
+
+The keycode tables were taken from `https://github.com/rgrokett/TalkingBarcodeReader`.
+"""
+
+import os
+import queue
+import threading
+import time
+
+REPORT_SIZE = 8
+# how many reports are read at once
+BATCH_SIZE = 64
+
+ENTER = 40
+# left and right shift bits of the modifier byte
+SHIFT = 0x22
+
+hid = {
+    4: 'a', 5: 'b', 6: 'c', 7: 'd', 8: 'e', 9: 'f', 10: 'g', 11: 'h', 12: 'i', 13: 'j', 14: 'k', 15: 'l', 16: 'm',
+    17: 'n', 18: 'o', 19: 'p', 20: 'q', 21: 'r', 22: 's', 23: 't', 24: 'u', 25: 'v', 26: 'w', 27: 'x', 28: 'y', 29: 'z',
+    30: '1', 31: '2', 32: '3', 33: '4', 34: '5', 35: '6', 36: '7', 37: '8', 38: '9', 39: '0', 44: ' ', 45: '-', 46: '=',
+    47: '[', 48: ']', 49: '\\', 51: ';', 52: '\'', 53: '~', 54: ',', 55: '.', 56: '/'
+}
+
+hid2 = {
+    4: 'A', 5: 'B', 6: 'C', 7: 'D', 8: 'E', 9: 'F', 10: 'G', 11: 'H', 12: 'I', 13: 'J', 14: 'K', 15: 'L', 16: 'M',
+    17: 'N', 18: 'O', 19: 'P', 20: 'Q', 21: 'R', 22: 'S', 23: 'T', 24: 'U', 25: 'V', 26: 'W', 27: 'X', 28: 'Y', 29: 'Z',
+    30: '!', 31: '@', 32: '#', 33: '$', 34: '%', 35: '^', 36: '&', 37: '*', 38: '(', 39: ')', 44: ' ', 45: '_', 46: '+',
+    47: '{', 48: '}', 49: '|', 51: ':', 52: '"', 53: '~', 54: '<', 55: '>', 56: '?'
+}
+
+# keycode to character tables indexed by the keycode, invalid keycodes map to `None`
+PLAIN_KEYS = tuple (hid.get (keycode) for keycode in range (256))
+SHIFTED_KEYS = tuple (hid2.get (keycode) for keycode in range (256))
+
+
+class BarcodeError (Exception):
+    """
+    The barcode scanner device could not be opened or read, usually because it was disconnected.
+    """
+    pass
+
+
+class HidDecoder:
+    """
+    Decode HID keyboard reports into barcodes.
+
+    Reports can be fed in batches of any size, incomplete reports and barcodes are kept until the next
+    batch.  Keycodes without a character are dropped.
+    """
+    def __init__ (self):
+        self.pending = b''
+        self.characters = []
+        self.dropped = 0
+
+    def feed (self, data):
+        """
+        Decode a batch of reports.
+
+        :return: the list of barcodes terminated in this batch.
+        """
+        data = self.pending + data
+        end = len (data) - len (data) % REPORT_SIZE
+        self.pending = data [end:]
+        result = []
+        characters = self.characters
+        for start in range (0, end, REPORT_SIZE):
+            report = data [start:start + REPORT_SIZE]
+            table = SHIFTED_KEYS if report [0] & SHIFT else PLAIN_KEYS
+            for keycode in report [2:]:
+                if keycode == 0:
+                    break
+                if keycode == ENTER:
+                    result.append (''.join (characters))
+                    del characters [:]
+                    continue
+                character = table [keycode]
+                if character is None:
+                    self.dropped += 1
+                else:
+                    characters.append (character)
+        return result
+
+
+class BarcodeReader:
+    """
+    Keep the barcode scanner device open and decode its reports in a background thread.
+
+    Barcodes scanned while the station is busy are kept in a queue.  If reading the device fails, a
+    `BarcodeError` is raised by the next call to `read`.
+    """
+    def __init__ (self, device, log=None):
+        self.device = device
+        self.log = log if log is not None else print
+        self.codes = queue.Queue ()
+        self.decoder = HidDecoder ()
+        # seconds the last barcode read waited in the queue
+        self.waited = None
+        self.fd = None
+        self.worker = None
+
+    def start (self):
+        """
+        :raise BarcodeError: if the device cannot be opened.
+        """
+        try:
+            self.fd = os.open (self.device, os.O_RDONLY)
+        except OSError as ex:
+            raise BarcodeError ('could not open barcode scanner {}: {}'.format (self.device, ex))
+        self.worker = threading.Thread (target=self.run, name='barcode')
+        self.worker.daemon = True
+        self.worker.start ()
+        return None
+
+    def run (self):
+        try:
+            while True:
+                try:
+                    data = os.read (self.fd, REPORT_SIZE * BATCH_SIZE)
+                except OSError as ex:
+                    raise BarcodeError ('could not read barcode scanner {}: {}'.format (self.device, ex))
+                if not data:
+                    raise EOFError ('barcode scanner {} was closed'.format (self.device))
+                dropped = self.decoder.dropped
+                now = time.time ()
+                for code in self.decoder.feed (data):
+                    self.codes.put ((now, code))
+                if self.decoder.dropped != dropped:
+                    self.log ('dropped {} invalid keycodes from the barcode scanner'.format (
+                        self.decoder.dropped - dropped))
+        except BaseException as ex:
+            self.codes.put (ex)
+
+    def pending (self):
+        """
+        Return how many barcodes are waiting to be read.
+        """
+        return self.codes.qsize ()
+
+    def read (self, timeout=None):
+        """
+        Return the next barcode, or `None` if no barcode was scanned in `timeout` seconds.
+        """
+        try:
+            item = self.codes.get (timeout=timeout)
+        except queue.Empty:
+            return None
+        if isinstance (item, BaseException):
+            raise item
+        decoded, code = item
+        self.waited = time.time () - decoded
+        return code
+
+    def __iter__ (self):
+        while True:
+            yield self.read ()
+
+    def close (self):
+        if self.fd is not None:
+            os.close (self.fd)
+            self.fd = None
+        return None
@@ -0,0 +1,421 @@
+#!/usr/bin/python3
+"""
+Benchmark the plant cycle of a watering station against the simulated devices.
+
+A simulated operator scans, weighs and moves the plants of a generated experiment while a station runs
+in this process.  The stages of the plant cycle are timed:
+
+* `barcode`: from the scan to the barcode being read by `get_plant_code_reading`;
+* `report`: `report_plant_code`, synthesising and queueing the plant description;
+* `scale`: `get_scale_reading`, including the wait for the plant to be placed;
+* `settle`: from the plant being placed on the scale to the settled weight;
+* `pump`: `water_plant` or `water_plant_closed_loop`, the pump commands and the record of the watering;
+* `record`: `record_watering`;
+* `cycle`: from the scan to the record of the watering.
+
+The results, with the plants per hour, the CPU time, the maximum resident memory and the file I/O per
+plant, are appended as a JSON line to the results file, and compared with the previous result.
+
+The station uses the data folder in the environment variable `WATER_WEIGHT_CONTROL_FOLDER`, by default
+a new temporary folder.
+"""
+
+import argparse
+import collections
+import datetime
+import json
+import os
+import resource
+import subprocess
+import tempfile
+import threading
+import time
+import yaml
+
+os.environ.setdefault ('WATER_WEIGHT_CONTROL_FOLDER', tempfile.mkdtemp (prefix='water-weight-control-benchmark-'))
+
+import experiment
+import logger
+import water_plant
+
+from simulator import bench
+
+STAGES = ('barcode', 'report', 'scale', 'settle', 'pump', 'record', 'cycle')
+
+# budget of a raspberry pi station: fraction of one core and maximum resident memory in kilobytes
+CPU_BUDGET = 0.25
+MEMORY_BUDGET = 100 * 1024
+
+
+class StageTimer:
+    """
+    Wrap the stage functions of `water_plant` and collect their latencies.
+    """
+    def __init__ (self, station):
+        self.station = station
+        self.latencies = collections.defaultdict (list)
+        self.lock = threading.Lock ()
+        self.plants = 0
+
+    def add (self, stage, latency):
+        with self.lock:
+            self.latencies [stage].append (latency)
+
+    def last_time (self, events, plant_id):
+        for event_plant_id, event_time in reversed (events):
+            if event_plant_id == plant_id:
+                return event_time
+        return None
+
+    def install (self):
+        get_plant_code_reading = water_plant.get_plant_code_reading
+        report_plant_code = water_plant.report_plant_code
+        get_scale_reading = water_plant.get_scale_reading
+        water_plant_function = water_plant.water_plant
+        water_plant_closed_loop = water_plant.water_plant_closed_loop
+        record_watering = water_plant.record_watering
+
+        def timed_get_plant_code_reading (*args, **kwargs):
+            result = get_plant_code_reading (*args, **kwargs)
+            scanned = self.last_time (self.station.scans, result) if result is not None else None
+            if scanned is not None:
+                self.add ('barcode', time.time () - scanned)
+            return result
+
+        def timed_report_plant_code (*args, **kwargs):
+            start = time.time ()
+            try:
+                return report_plant_code (*args, **kwargs)
+            finally:
+                self.add ('report', time.time () - start)
+
+        def timed_get_scale_reading (*args, **kwargs):
+            start = time.time ()
+            result = get_scale_reading (*args, **kwargs)
+            now = time.time ()
+            self.station.confirm_weighing ()
+            self.add ('scale', now - start)
+            if self.station.placements:
+                self.add ('settle', now - self.station.placements [-1][1])
+            return result
+
+        def timed_water_plant (*args, **kwargs):
+            start = time.time ()
+            try:
+                return water_plant_function (*args, **kwargs)
+            finally:
+                self.add ('pump', time.time () - start)
+
+        def timed_water_plant_closed_loop (*args, **kwargs):
+            start = time.time ()
+            try:
+                return water_plant_closed_loop (*args, **kwargs)
+            finally:
+                self.add ('pump', time.time () - start)
+
+        def timed_record_watering (plant_id, *args, **kwargs):
+            start = time.time ()
+            try:
+                return record_watering (plant_id, *args, **kwargs)
+            finally:
+                now = time.time ()
+                self.add ('record', now - start)
+                scanned = self.last_time (self.station.scans, plant_id)
+                if scanned is not None:
+                    self.add ('cycle', now - scanned)
+                self.plants += 1
+
+        water_plant.get_plant_code_reading = timed_get_plant_code_reading
+        water_plant.report_plant_code = timed_report_plant_code
+        water_plant.get_scale_reading = timed_get_scale_reading
+        water_plant.water_plant = timed_water_plant
+        water_plant.water_plant_closed_loop = timed_water_plant_closed_loop
+        water_plant.record_watering = timed_record_watering
+        return None
+
+
+def percentile (values, fraction):
+    """
+    Return the percentile of the values using the nearest rank.
+    """
+    ordered = sorted (values)
+    index = max (0, int (round (fraction * len (ordered) + 0.5)) - 1)
+    return ordered [min (index, len (ordered) - 1)]
+
+
+def read_io ():
+    """
+    Return the I/O counters of this process, or an empty dictionary if they are not available.
+    """
+    result = {}
+    try:
+        with open ('/proc/self/io', 'r') as fd:
+            for line in fd:
+                name, value = line.split (':')
+                result [name.strip ()] = int (value)
+    except (IOError, ValueError):
+        pass
+    return result
+
+
+def version ():
+    try:
+        return subprocess.check_output (
+            ['git', 'describe', '--always', '--dirty'],
+            cwd=os.path.dirname (os.path.abspath (__file__)),
+            stderr=subprocess.DEVNULL,
+        ).decode ('ascii').strip ()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def create_experiment (folder, plants):
+    """
+    Write an experiment data file with generated plants and return the plants.
+    """
+    with open (water_plant.EXPERIMENT_DATA_FILENAME, 'wt') as fd:
+        fd.write ('"id","weight","description"\n')
+        for index in range (plants):
+            fd.write ('"{}",{},"benchmark plant {}"\n'.format (100001 + index, 300 + index % 50, index + 1))
+    return experiment.parse (water_plant.EXPERIMENT_DATA_FILENAME) [0]
+
+
+def run (args):
+    folder = water_plant.DATA_FOLDER
+    os.makedirs (folder, exist_ok=True)
+    water_plant.LOG = logger.Logger (os.path.join (folder, 'benchmark.log'), echo=args.verbose)
+    plants = create_experiment (folder, args.plants)
+    with open (water_plant.PUMP_DATA_FILENAME, 'wt') as fd:
+        yaml.safe_dump ({
+            'motor_speed': args.motor_speed,
+            'water_per_1_revolution': args.water_per_1_revolution,
+            'closed_loop': args.closed_loop,
+        }, fd, default_flow_style=False)
+    water_plant.PUMP_PLACEMENT_DELAY = args.placement_delay
+    station = bench.SimulatedStation (
+        os.path.join (folder, 'devices'),
+        plants,
+        settling_time=args.settling_time,
+        water_per_1_revolution=args.water_per_1_revolution,
+        closed_loop=args.closed_loop,
+    )
+    station.start ()
+    water_plant.start_device_monitor ()
+    water_plant.start_audio ()
+    water_plant.start_speech_cache ()
+    water_plant.open_watering_store ()
+    water_plant.recover_watering ()
+    water_plant.setup_pump ()
+    registry = water_plant.read_experiment_data_file ()
+    water_plant.SPEECH.prefetch (water_plant.plant_code_text (code, plant) for code, plant in registry.items ())
+    timer = StageTimer (station)
+    timer.install ()
+    scanner = water_plant.detect_barcode_scanner (station.devices ['scanner'])
+    station_pump = water_plant.detect_pump (station.devices ['pump'])
+    plant_scale = water_plant.detect_scale (station.devices ['scale'])
+    codes = list (plants) * args.cycles
+    operator = threading.Thread (
+        target=station.operate,
+        args=(codes,),
+        kwargs={
+            'scan_time': args.scan_time,
+            'hold_time': args.hold_time,
+            'interval': args.interval,
+            'stop_code': water_plant.STOP_CODE,
+            'tray': (water_plant.TRAY_START_CODE, water_plant.TRAY_END_CODE) if args.tray else None,
+            'confirmed': True,
+        },
+        name='operator',
+    )
+    io_start = read_io ()
+    usage_start = resource.getrusage (resource.RUSAGE_SELF)
+    start = time.time ()
+    operator.start ()
+    water_plant.Station (scanner, plant_scale, station_pump, registry, 'benchmark').run ()
+    station_pump.wait_halted (timeout=water_plant.PUMP_RUN_TIMEOUT)
+    elapsed = time.time () - start
+    usage_end = resource.getrusage (resource.RUSAGE_SELF)
+    io_end = read_io ()
+    operator.join ()
+    station_pump.cancel ()
+    water_plant.LOG.flush ()
+    cpu = (usage_end.ru_utime - usage_start.ru_utime) + (usage_end.ru_stime - usage_start.ru_stime)
+    watered = max (1, timer.plants)
+    result = {
+        'time': datetime.datetime.now ().isoformat (),
+        'version': version (),
+        'plants': timer.plants,
+        'closed_loop': args.closed_loop,
+        'tray': args.tray,
+        'elapsed': elapsed,
+        'plants_per_hour': timer.plants * 3600.0 / elapsed,
+        'cpu_seconds': cpu,
+        'cpu_fraction': cpu / elapsed,
+        'max_rss_kb': usage_end.ru_maxrss,
+        'io_per_plant': {
+            name: (io_end [name] - io_start [name]) / float (watered)
+            for name in io_end
+            if name in io_start
+        },
+        'stages': {
+            stage: {
+                'count': len (timer.latencies [stage]),
+                'p50': percentile (timer.latencies [stage], 0.50),
+                'p95': percentile (timer.latencies [stage], 0.95),
+            }
+            for stage in STAGES
+            if timer.latencies [stage]
+        },
+    }
+    return result
+
+
+def report (result, previous):
+    def compare (value, old_value):
+        if old_value is None or not old_value:
+            return ''
+        return ' ({:+.1f}%)'.format ((value - old_value) * 100.0 / old_value)
+
+    def old (*keys):
+        value = previous
+        for key in keys:
+            if not isinstance (value, dict) or key not in value:
+                return None
+            value = value [key]
+        return value
+
+    print ('{} plants in {:.1f}s, {:.1f} plants/hour{}'.format (
+        result ['plants'], result ['elapsed'], result ['plants_per_hour'],
+        compare (result ['plants_per_hour'], old ('plants_per_hour'))))
+    print ('{:10} {:>6} {:>10} {:>10}'.format ('stage', 'count', 'p50 (ms)', 'p95 (ms)'))
+    for stage, values in sorted (result ['stages'].items (), key=lambda item: STAGES.index (item [0])):
+        print ('{:10} {:6d} {:10.1f} {:10.1f}{}'.format (
+            stage, values ['count'], values ['p50'] * 1000, values ['p95'] * 1000,
+            compare (values ['p95'], old ('stages', stage, 'p95'))))
+    print ('CPU {:.2f}s, {:.1%} of one core{}{}'.format (
+        result ['cpu_seconds'], result ['cpu_fraction'],
+        compare (result ['cpu_fraction'], old ('cpu_fraction')),
+        ', over the budget of {:.0%}'.format (CPU_BUDGET) if result ['cpu_fraction'] > CPU_BUDGET else ''))
+    print ('maximum resident memory {:.1f}MB{}{}'.format (
+        result ['max_rss_kb'] / 1024.0,
+        compare (result ['max_rss_kb'], old ('max_rss_kb')),
+        ', over the budget of {:.0f}MB'.format (MEMORY_BUDGET / 1024.0) if result ['max_rss_kb'] > MEMORY_BUDGET else ''))
+    io = result ['io_per_plant']
+    if io:
+        print ('per plant: {:.0f} bytes written to disk, {:.0f} bytes written, {:.1f} write calls{}'.format (
+            io.get ('write_bytes', 0), io.get ('wchar', 0), io.get ('syscw', 0),
+            compare (io.get ('wchar', 0), old ('io_per_plant', 'wchar'))))
+    return None
+
+
+def main ():
+    args = process_arguments ()
+    previous = None
+    if os.path.exists (args.output):
+        with open (args.output, 'r') as fd:
+            lines = [line for line in fd if line.strip ()]
+        if lines:
+            previous = json.loads (lines [-1])
+    result = run (args)
+    report (result, previous)
+    with open (args.output, 'a') as fd:
+        fd.write (json.dumps (result, sort_keys=True) + '\n')
+    print ('results appended to {}'.format (args.output))
+    return None
+
+
+def process_arguments ():
+    parser = argparse.ArgumentParser (
+        description='Benchmark the plant cycle of a watering station with simulated devices'
+    )
+    parser.add_argument (
+        '--plants',
+        type=int,
+        default=20,
+        help='number of plants in the experiment',
+        metavar='N'
+        )
+    parser.add_argument (
+        '--cycles',
+        type=int,
+        default=1,
+        help='how many times each plant is scanned',
+        metavar='N'
+        )
+    parser.add_argument (
+        '--output',
+        type=str,
+        default='benchmark-results.jsonl',
+        help='file where the results are appended',
+        metavar='FILE'
+        )
+    parser.add_argument (
+        '--closed-loop',
+        action='store_true',
+        help='water the plants on the scale'
+        )
+    parser.add_argument (
+        '--tray',
+        action='store_true',
+        help='scan all the plants as a tray before weighing them'
+        )
+    parser.add_argument (
+        '--motor-speed',
+        type=float,
+        default=water_plant.MOTOR_SPEED,
+        help='motor speed of the pump',
+        metavar='RPM'
+        )
+    parser.add_argument (
+        '--water-per-1-revolution',
+        type=float,
+        default=water_plant.WATER_PER_1_REVOLUTION,
+        help='grams of water of one revolution of the simulated pump',
+        metavar='GRAMS'
+        )
+    parser.add_argument (
+        '--placement-delay',
+        type=float,
+        default=water_plant.PUMP_PLACEMENT_DELAY,
+        help='seconds the operator has to move the plant to the pump',
+        metavar='SECONDS'
+        )
+    parser.add_argument (
+        '--settling-time',
+        type=float,
+        default=1.0,
+        help='seconds for the simulated scale to settle',
+        metavar='SECONDS'
+        )
+    parser.add_argument (
+        '--scan-time',
+        type=float,
+        default=0.5,
+        help='seconds between scanning a plant and placing it on the scale',
+        metavar='SECONDS'
+        )
+    parser.add_argument (
+        '--hold-time',
+        type=float,
+        default=2.0,
+        help='minimum seconds a plant stays on the scale, the operator also waits for the weighing',
+        metavar='SECONDS'
+        )
+    parser.add_argument (
+        '--interval',
+        type=float,
+        default=0.5,
+        help='seconds between removing a plant from the scale and scanning the next one',
+        metavar='SECONDS'
+        )
+    parser.add_argument (
+        '-v',
+        '--verbose',
+        action='store_true',
+        help='print the log messages'
+        )
+    return parser.parse_args ()
+
+
+if __name__ == '__main__':
+    main ()
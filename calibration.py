@@ -0,0 +1,68 @@
+"""
+Running estimate of the water weight delivered by one pump revolution.
+
+The estimate starts at the value in the pump data file and is updated after every closed-loop watering
+with the weight gain measured by the scale.  It is saved to a YAML file so that it survives restarts.  If
+the value in the pump data file changes, the estimate starts again from the new value.
+
+The stations of a controller share one estimate, so it is updated and saved under a lock.
+"""
+
+import os
+import threading
+import yaml
+
+# weight of a new measurement in the running estimate
+SMOOTHING = 0.2
+# runs with fewer revolutions are too imprecise to update the estimate
+MIN_REVOLUTIONS = 1.0
+
+
+class Calibration:
+    def __init__ (self, filename, water_per_1_revolution):
+        """
+        :param filename: the file where the estimate is saved.
+        :param water_per_1_revolution: the value in the pump data file.
+        """
+        self.filename = filename
+        self.base = water_per_1_revolution
+        self.estimate = water_per_1_revolution
+        self.runs = 0
+        self.lock = threading.Lock ()
+        if os.path.exists (filename):
+            with open (filename, 'r') as fd:
+                data = yaml.safe_load (fd) or {}
+            if data.get ('base') == water_per_1_revolution:
+                self.estimate = data ['water_per_1_revolution']
+                self.runs = data ['runs']
+
+    def update (self, water, revolutions):
+        """
+        Update the estimate with a watering run.
+
+        :param water: the weight gain measured by the scale.
+        :param revolutions: the pump revolutions of the run.
+        :return: `True` if the run was used.
+        """
+        if revolutions < MIN_REVOLUTIONS or water <= 0:
+            return False
+        with self.lock:
+            self.estimate += SMOOTHING * (water / revolutions - self.estimate)
+            self.runs += 1
+            self.save ()
+        return True
+
+    def save (self):
+        """
+        Save the estimate.  Must be called with the lock held.
+        """
+        data = {
+            'base': self.base,
+            'water_per_1_revolution': self.estimate,
+            'runs': self.runs,
+        }
+        temporary = self.filename + '.tmp'
+        with open (temporary, 'wt') as fd:
+            yaml.safe_dump (data, fd)
+        os.rename (temporary, self.filename)
+        return None
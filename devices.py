@@ -0,0 +1,251 @@
+"""
+Discovery of the devices of the watering stations.
+
+A station is a barcode scanner, a scale and a pump.  The stations are listed in the `stations` section of
+the configuration file, each with a name and the devices:
+
+    stations:
+      - name: bench-1
+        scanner: usb:1-1.2.1
+        scale: /dev/serial/by-id/usb-FTDI_FT232R_USB_UART_A10KZ3Q1-if00-port0
+        pump: /dev/serial/by-path/platform-3f980000.usb-usb-0:1.2.3:1.0-port0
+
+A device is given either by a file name, preferably one of the stable links in `/dev/serial/by-id` or
+`/dev/serial/by-path`, or by the USB port it is plugged in, as `usb:` followed by the port path shown in
+`/sys/bus/usb/devices`.  The USB port is how the scanners are found, as there are no stable links to the
+`hidraw` devices.  Without a `stations` section there is one station with the historical device names.
+
+The `DeviceMonitor` watches `/dev` with inotify, so that a device is used as soon as it is connected.  If
+inotify is not available the monitor polls the device files.
+"""
+
+import ctypes
+import ctypes.util
+import os
+import threading
+import time
+
+SYS_CLASS = '/sys/class'
+USB_PREFIX = 'usb:'
+
+DEFAULT_STATION = {
+    'name': 'station',
+    'scanner': '/dev/hidraw0',
+    'scale': '/dev/ttyUSB1',
+    'pump': '/dev/ttyUSB0',
+}
+
+# the sysfs class of the device files of each kind of device
+DEVICE_CLASSES = {
+    'scanner': 'hidraw',
+    'scale': 'tty',
+    'pump': 'tty',
+}
+
+STABLE_FOLDERS = ('/dev/serial/by-id', '/dev/serial/by-path')
+# folders watched by the device monitor
+WATCHED_FOLDERS = ('/dev', '/dev/serial') + STABLE_FOLDERS
+
+IN_ATTRIB = 0x00000004
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_ATTRIB | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+# seconds between two checks of the device files when inotify is not available
+POLL_PERIOD = 1.0
+# seconds between two checks of the device files when inotify is available, in case an event is missed
+CHECK_PERIOD = 5.0
+
+
+class StationDevices:
+    __slots__ = ('name', 'scanner', 'scale', 'pump')
+
+    def __init__ (self, name, scanner, scale, pump):
+        """
+        :param scanner: the device of the barcode scanner as given in the configuration file.
+        """
+        self.name = name
+        self.scanner = scanner
+        self.scale = scale
+        self.pump = pump
+
+    def devices (self):
+        return [('scanner', self.scanner), ('scale', self.scale), ('pump', self.pump)]
+
+
+class DeviceConfigError (Exception):
+    pass
+
+
+def station_devices (config):
+    """
+    Return the list of `StationDevices` in the configuration.
+
+    :raise DeviceConfigError: if a station has no devices or a device is used by two stations.
+    """
+    stations = config.get ('stations') if config else None
+    if not stations:
+        stations = [DEFAULT_STATION]
+    result = []
+    used = {}
+    for index, station in enumerate (stations):
+        name = str (station.get ('name', 'station-{}'.format (index + 1)))
+        values = {}
+        for kind in DEVICE_CLASSES:
+            device = station.get (kind)
+            if not device:
+                raise DeviceConfigError ('station {} has no {}'.format (name, kind))
+            if device in used:
+                raise DeviceConfigError ('{} {} of station {} is also used by station {}'.format (
+                    kind, device, name, used [device]))
+            used [device] = name
+            values [kind] = str (device)
+        result.append (StationDevices (name, **values))
+    return result
+
+
+def usb_port (sys_device):
+    """
+    Return the USB port path of a device in sysfs, such as `1-1.2`, or `None` if it is not a USB device.
+    """
+    path = os.path.realpath (sys_device)
+    result = None
+    for part in path.split (os.sep):
+        # the interfaces below a port are named port:configuration.interface, such as 1-1.2:1.0
+        if ':' in part:
+            if result is not None:
+                break
+        elif '-' in part and part.split ('-') [0].isdigit ():
+            result = part
+    return result
+
+
+def resolve (device, kind):
+    """
+    Return the device file of a device in the configuration, or `None` if it is not connected.
+    """
+    if not device.startswith (USB_PREFIX):
+        return device if os.path.exists (device) else None
+    port = device [len (USB_PREFIX):]
+    folder = os.path.join (SYS_CLASS, DEVICE_CLASSES [kind])
+    try:
+        names = sorted (os.listdir (folder))
+    except OSError:
+        return None
+    for name in names:
+        if usb_port (os.path.join (folder, name, 'device')) == port:
+            return os.path.join ('/dev', name)
+    return None
+
+
+def connected_devices ():
+    """
+    Return the list of pairs of stable name and device file of the connected devices.
+
+    The stable names are the links in `/dev/serial/by-id` and `/dev/serial/by-path`, and the USB port of
+    the `hidraw` devices.
+    """
+    result = []
+    for folder in STABLE_FOLDERS:
+        try:
+            names = sorted (os.listdir (folder))
+        except OSError:
+            continue
+        result.extend (
+            (os.path.join (folder, name), os.path.realpath (os.path.join (folder, name)))
+            for name in names
+        )
+    folder = os.path.join (SYS_CLASS, 'hidraw')
+    try:
+        names = sorted (os.listdir (folder))
+    except OSError:
+        names = []
+    for name in names:
+        port = usb_port (os.path.join (folder, name, 'device'))
+        if port is not None:
+            result.append ((USB_PREFIX + port, os.path.join ('/dev', name)))
+    return result
+
+
+class DeviceMonitor:
+    """
+    Wait for device files to appear or disappear.
+
+    A background thread reads the inotify events of the folders in `WATCHED_FOLDERS` and wakes up the
+    threads waiting for a device.  Folders that are created later, such as `/dev/serial/by-id` when the
+    first serial device is connected, are watched when they appear.
+    """
+    def __init__ (self, log=None):
+        self.log = log if log is not None else print
+        self.condition = threading.Condition ()
+        self.changes = 0
+        self.fd = None
+        self.libc = None
+        self.worker = None
+
+    def start (self):
+        try:
+            self.libc = ctypes.CDLL (ctypes.util.find_library ('c') or 'libc.so.6', use_errno=True)
+            fd = self.libc.inotify_init1 (IN_CLOEXEC)
+            if fd < 0:
+                raise OSError (ctypes.get_errno (), os.strerror (ctypes.get_errno ()))
+        except (OSError, AttributeError) as ex:
+            self.log ('inotify is not available, polling the device files: {}'.format (ex))
+            return None
+        self.fd = fd
+        self.add_watches ()
+        self.worker = threading.Thread (target=self.run, name='device-monitor')
+        self.worker.daemon = True
+        self.worker.start ()
+        return None
+
+    def add_watches (self):
+        for folder in WATCHED_FOLDERS:
+            if os.path.isdir (folder):
+                self.libc.inotify_add_watch (self.fd, folder.encode (), WATCH_MASK)
+        return None
+
+    def run (self):
+        try:
+            while True:
+                # the events are not decoded, any change wakes up the waiting threads
+                os.read (self.fd, 4096)
+                self.add_watches ()
+                with self.condition:
+                    self.changes += 1
+                    self.condition.notify_all ()
+        except OSError as ex:
+            self.log ('device monitor stopped, polling the device files: {}'.format (ex))
+            with self.condition:
+                self.fd = None
+                self.condition.notify_all ()
+
+    def wait_until (self, predicate, timeout=None):
+        """
+        Wait until the predicate is true, checking it whenever the device files change.
+
+        :return: the value of the predicate, false on timeout.
+        """
+        deadline = None if timeout is None else time.time () + timeout
+        with self.condition:
+            while True:
+                result = predicate ()
+                if result:
+                    return result
+                period = CHECK_PERIOD if self.fd is not None else POLL_PERIOD
+                if deadline is not None:
+                    remaining = deadline - time.time ()
+                    if remaining <= 0:
+                        return result
+                    period = min (period, remaining)
+                self.condition.wait (period)
+
+    def wait_for (self, device, kind, timeout=None):
+        """
+        Wait for a device in the configuration to be connected.
+
+        :return: the device file, or `None` on timeout.
+        """
+        return self.wait_until (lambda: resolve (device, kind), timeout)
@@ -0,0 +1,255 @@
+"""
+Loader of the experiment data file.
+
+The experiment data file is a CSV file with the columns `id`, `weight` and `description`.  The delimiter
+is either a comma or a semicolon and fields may be quoted.  The file is parsed in a single pass, and the
+parsed plants are saved in a compiled cache keyed on the hash of the file, so that an unchanged file is
+not parsed again.
+
+Plants are kept in a `PlantRegistry`, a read-only mapping from plant ids to plants that stores the
+weights and descriptions in columns instead of one object per plant.
+"""
+
+import array
+import bisect
+import collections.abc
+import csv
+import hashlib
+import os
+import pickle
+
+CACHE_VERSION = 2
+COLUMNS = ('id', 'weight', 'description')
+
+
+class Plant:
+    __slots__ = ('id', 'weight', 'description')
+
+    def __init__ (self, plant_id, weight, description):
+        self.id = plant_id
+        self.weight = weight
+        self.description = description
+
+
+class PlantRegistry (collections.abc.Mapping):
+    """
+    Mapping from plant ids to plants with a columnar layout.
+
+    Each plant has a position in the columns.  The weights are kept in an array of doubles, and each
+    description is stored once and referenced by its index from an array of unsigned integers.  A
+    `Plant` is created when a plant is looked up.
+    """
+    def __init__ (self):
+        self.positions = {}
+        self.ids = []
+        self.weights = array.array ('d')
+        self.description_indexes = array.array ('I')
+        self.descriptions = []
+        self.description_index = {}
+        # lazily built, see `group`
+        self.sorted_descriptions = None
+        self.description_positions = None
+
+    def add (self, plant_id, weight, description):
+        """
+        Add a plant, replacing the plant with the same id.
+        """
+        index = self.description_index.get (description)
+        if index is None:
+            index = len (self.descriptions)
+            self.descriptions.append (description)
+            self.description_index [description] = index
+        position = self.positions.get (plant_id)
+        if position is None:
+            self.positions [plant_id] = len (self.ids)
+            self.ids.append (plant_id)
+            self.weights.append (weight)
+            self.description_indexes.append (index)
+        else:
+            self.weights [position] = weight
+            self.description_indexes [position] = index
+        self.sorted_descriptions = None
+        self.description_positions = None
+        return None
+
+    def plant (self, position):
+        return Plant (
+            self.ids [position],
+            self.weights [position],
+            self.descriptions [self.description_indexes [position]],
+        )
+
+    def __getitem__ (self, plant_id):
+        return self.plant (self.positions [plant_id])
+
+    def __contains__ (self, plant_id):
+        return plant_id in self.positions
+
+    def __iter__ (self):
+        return iter (self.ids)
+
+    def __len__ (self):
+        return len (self.ids)
+
+    def group (self, prefix):
+        """
+        Return a view with the plants whose description starts with the given prefix.
+        """
+        if self.sorted_descriptions is None:
+            self.sorted_descriptions = sorted (self.descriptions)
+            self.description_positions = collections.defaultdict (lambda: array.array ('I'))
+            for position, index in enumerate (self.description_indexes):
+                self.description_positions [self.descriptions [index]].append (position)
+        start = bisect.bisect_left (self.sorted_descriptions, prefix)
+        end = bisect.bisect_left (self.sorted_descriptions, prefix + '\U0010ffff')
+        positions = array.array ('I')
+        for description in self.sorted_descriptions [start:end]:
+            positions.extend (self.description_positions [description])
+        return PlantGroup (self, sorted (positions))
+
+    def columns (self):
+        """
+        Return the columns of the registry in a form that can be pickled.
+        """
+        return (self.ids, self.weights.tobytes (), self.description_indexes.tobytes (), self.descriptions)
+
+    @classmethod
+    def from_columns (cls, columns):
+        ids, weights, description_indexes, descriptions = columns
+        result = cls ()
+        result.ids = ids
+        result.positions = {plant_id: position for position, plant_id in enumerate (ids)}
+        result.weights.frombytes (weights)
+        result.description_indexes.frombytes (description_indexes)
+        result.descriptions = descriptions
+        result.description_index = {description: index for index, description in enumerate (descriptions)}
+        return result
+
+
+class PlantGroup (collections.abc.Mapping):
+    """
+    Read-only view of some plants of a registry.
+    """
+    def __init__ (self, registry, positions):
+        self.registry = registry
+        self.positions = positions
+
+    def __getitem__ (self, plant_id):
+        if plant_id not in self:
+            raise KeyError (plant_id)
+        return self.registry [plant_id]
+
+    def __contains__ (self, plant_id):
+        position = self.registry.positions.get (plant_id)
+        if position is None:
+            return False
+        index = bisect.bisect_left (self.positions, position)
+        return index < len (self.positions) and self.positions [index] == position
+
+    def __iter__ (self):
+        return (self.registry.ids [position] for position in self.positions)
+
+    def __len__ (self):
+        return len (self.positions)
+
+
+class ExperimentDataError (Exception):
+    pass
+
+
+def file_hash (filename):
+    result = hashlib.sha1 ()
+    with open (filename, 'rb') as fd:
+        for block in iter (lambda: fd.read (1024 * 1024), b''):
+            result.update (block)
+    return result.hexdigest ()
+
+
+def load (filename, cache_filename, log=None):
+    """
+    Load the plants in the experiment data file.
+
+    :param cache_filename: the file with the compiled cache.
+    :return: a `PlantRegistry` with the plants.
+    :raise ExperimentDataError: if the file has no header with the required columns.
+    """
+    log = log if log is not None else print
+    key = file_hash (filename)
+    result = read_cache (cache_filename, key)
+    if result is None:
+        result, malformed = parse (filename)
+        for line, reason in malformed:
+            log ('malformed row in line {} of the experiment data file: {}'.format (line, reason))
+        log ('parsed {} plants from the experiment data file, {} malformed rows'.format (len (result), len (malformed)))
+        write_cache (cache_filename, key, result)
+    else:
+        log ('loaded {} plants from the experiment data cache'.format (len (result)))
+    return result
+
+
+def parse (filename):
+    """
+    Parse the experiment data file.
+
+    The delimiter is detected in the header line.
+
+    :return: a pair with the `PlantRegistry` and the list of (line number, reason) pairs of the malformed
+    rows.
+    """
+    registry = PlantRegistry ()
+    malformed = []
+    with open (filename, 'r', newline='', encoding='utf-8-sig') as fd:
+        header_line = fd.readline ()
+        delimiter = ';' if header_line.count (';') > header_line.count (',') else ','
+        header = [name.strip () for name in next (csv.reader ([header_line], delimiter=delimiter), [])]
+        missing = [name for name in COLUMNS if name not in header]
+        if missing:
+            raise ExperimentDataError ('missing columns {} in the header'.format (', '.join (missing)))
+        id_index, weight_index, description_index = [header.index (name) for name in COLUMNS]
+        width = max (id_index, weight_index, description_index) + 1
+        reader = csv.reader (fd, delimiter=delimiter)
+        for row in reader:
+            line = reader.line_num + 1
+            if not row:
+                continue
+            if len (row) < width:
+                malformed.append ((line, 'expected at least {} fields, found {}'.format (width, len (row))))
+                continue
+            plant_id = row [id_index].strip ()
+            if not plant_id:
+                malformed.append ((line, 'empty plant id'))
+                continue
+            try:
+                weight = float (row [weight_index].strip ().replace (',', '.'))
+            except ValueError:
+                malformed.append ((line, 'invalid weight [{}]'.format (row [weight_index])))
+                continue
+            registry.add (plant_id, weight, row [description_index])
+    return registry, malformed
+
+
+def read_cache (cache_filename, key):
+    """
+    Return the registry in the cache if it was compiled from a file with the given hash, `None` otherwise.
+    """
+    try:
+        with open (cache_filename, 'rb') as fd:
+            data = pickle.load (fd)
+    except (IOError, EOFError, pickle.UnpicklingError):
+        return None
+    if data.get ('version') != CACHE_VERSION or data.get ('hash') != key:
+        return None
+    return PlantRegistry.from_columns (data ['columns'])
+
+
+def write_cache (cache_filename, key, registry):
+    data = {
+        'version': CACHE_VERSION,
+        'hash': key,
+        'columns': registry.columns (),
+    }
+    temporary = cache_filename + '.tmp'
+    with open (temporary, 'wb') as fd:
+        pickle.dump (data, fd, pickle.HIGHEST_PROTOCOL)
+    os.rename (temporary, cache_filename)
+    return None
@@ -0,0 +1,185 @@
+"""
+Write-ahead journal of the pump runs.
+
+Before the pump is started, an intent record with the watering data is appended to the journal, and after
+the watering has been recorded a completion record is appended.  After a power cut, the intents without a
+completion are the pump runs that may have been interrupted.
+
+Records are JSON objects, one per line.  They are written by a background thread that writes all the
+pending records at once and calls `fsync` once for the group.  After a write fails, every intent raises
+`JournalError`, so the pump is not started without its intent on disk.
+"""
+
+import json
+import os
+import queue
+import threading
+import time
+
+INTENT = 'intent'
+DONE = 'done'
+
+# journal size in bytes above which it is truncated when there are no open intents
+MAX_SIZE = 1024 * 1024
+# seconds to wait for an intent record to be on disk
+WRITE_TIMEOUT = 30
+
+
+class JournalError (Exception):
+    pass
+
+
+class Journal:
+    def __init__ (self, filename, log=None):
+        self.filename = filename
+        self.log = log if log is not None else print
+        self.records = queue.Queue ()
+        self.sequence = 0
+        self.open_intents = set ()
+        self.lock = threading.Lock ()
+        self.fd = None
+        self.worker = None
+        # the error that stopped the background thread writing
+        self.error = None
+
+    def recover (self):
+        """
+        Read the journal and return the intent records without a completion record.
+
+        A torn last line is ignored.  The journal must be recovered before it is started.
+        """
+        intents = {}
+        if os.path.exists (self.filename):
+            with open (self.filename, 'rb') as fd:
+                for line in fd:
+                    try:
+                        record = json.loads (line.decode ('utf-8'))
+                    except ValueError:
+                        self.log ('ignoring torn journal record [{}]'.format (line))
+                        continue
+                    self.sequence = max (self.sequence, record ['seq'])
+                    if record ['kind'] == INTENT:
+                        intents [record ['seq']] = record
+                    elif record ['kind'] == DONE:
+                        intents.pop (record ['intent'], None)
+        return [intents [seq] for seq in sorted (intents)]
+
+    def start (self):
+        """
+        Start a new journal, the records of the previous one must have been recovered.
+        """
+        temporary = self.filename + '.tmp'
+        with open (temporary, 'wb') as fd:
+            os.fsync (fd.fileno ())
+        os.rename (temporary, self.filename)
+        self.fsync_folder ()
+        self.fd = open (self.filename, 'ab')
+        self.worker = threading.Thread (target=self.run, name='journal')
+        self.worker.daemon = True
+        self.worker.start ()
+        return None
+
+    def begin (self, plant_id, **data):
+        """
+        Append an intent record and wait until it is on disk.
+
+        :return: the sequence number of the intent.
+        :raise JournalError: if the record could not be written, or was not written in `WRITE_TIMEOUT` seconds.
+        """
+        with self.lock:
+            self.sequence += 1
+            seq = self.sequence
+            self.open_intents.add (seq)
+        record = {
+            'seq': seq,
+            'kind': INTENT,
+            'time': time.time (),
+            'plant': plant_id,
+        }
+        record.update (data)
+        written = self.append (record).wait (WRITE_TIMEOUT)
+        if written and self.error is None:
+            return seq
+        # the pump is not started, so the intent is closed in case it reaches the disk later
+        self.commit (seq)
+        if not written:
+            raise JournalError ('the intent of plant {} was not written in {} seconds'.format (plant_id, WRITE_TIMEOUT))
+        raise JournalError ('the intent of plant {} was not written [{}]'.format (plant_id, self.error))
+
+    def commit (self, intent):
+        """
+        Append the completion record of an intent.  The function returns before the record is on disk.
+        """
+        with self.lock:
+            self.sequence += 1
+            seq = self.sequence
+            self.open_intents.discard (intent)
+        self.append ({
+            'seq': seq,
+            'kind': DONE,
+            'time': time.time (),
+            'intent': intent,
+        })
+        return None
+
+    def append (self, record):
+        written = threading.Event ()
+        self.records.put ((record, written))
+        return written
+
+    def close (self):
+        if self.worker is not None:
+            self.records.put (None)
+            self.worker.join ()
+            self.worker = None
+            self.fd.close ()
+        return None
+
+    def run (self):
+        while True:
+            batch = [self.records.get ()]
+            while True:
+                try:
+                    batch.append (self.records.get_nowait ())
+                except queue.Empty:
+                    break
+            items = [item for item in batch if item is not None]
+            # after an error the records are still written, so the intents of the pump runs not started are
+            # closed if the disk recovers
+            try:
+                self.write (record for record, _ in items)
+            except Exception as ex:
+                if self.error is None:
+                    self.log ('an error occur while writing the journal, no pump run will be started {}'.format (ex))
+                    self.error = ex
+            for _, written in items:
+                written.set ()
+            if None in batch:
+                return
+
+    def write (self, records):
+        """
+        Write records and wait until they are on disk.  The journal is truncated if it is too big and there
+        are no open intents.
+        """
+        self.fd.write (b''.join (
+            json.dumps (record, sort_keys=True).encode ('utf-8') + b'\n'
+            for record in records
+        ))
+        self.fd.flush ()
+        os.fsync (self.fd.fileno ())
+        with self.lock:
+            idle = not self.open_intents
+        if idle and self.fd.tell () > MAX_SIZE:
+            self.fd.truncate (0)
+            self.fd.seek (0)
+            os.fsync (self.fd.fileno ())
+        return None
+
+    def fsync_folder (self):
+        fd = os.open (os.path.dirname (os.path.abspath (self.filename)), os.O_RDONLY)
+        try:
+            os.fsync (fd)
+        finally:
+            os.close (fd)
+        return None
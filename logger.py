@@ -0,0 +1,166 @@
+"""
+Buffered logger of the plant weight water control system.
+
+Messages are put in a queue and written by a background thread, which writes all the queued messages at
+once and keeps the log file open.  Each line has the timestamp, the level, the message and optional
+structured fields:
+
+    2024-03-01T10:00:00.000000: INFO read plant code 4012700301178 | plant=4012700301178 stage=barcode
+
+When the log file exceeds the maximum size it is renamed with the suffix `.1`, older files are shifted
+to `.2`, `.3` and so on.
+"""
+
+import atexit
+import datetime
+import os
+import queue
+import sys
+import threading
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+
+LEVEL_NAMES = {
+    DEBUG: 'DEBUG',
+    INFO: 'INFO',
+    WARNING: 'WARNING',
+    ERROR: 'ERROR',
+}
+
+# maximum number of messages written at once
+BATCH_SIZE = 256
+
+
+def format_line (timestamp, level, message, fields):
+    result = '{}: {} {}'.format (timestamp.isoformat (), LEVEL_NAMES.get (level, level), message)
+    if fields:
+        result += ' |' + ''.join (
+            ' {}={}'.format (key, value)
+            for key, value in sorted (fields.items ())
+        )
+    return result + '\n'
+
+
+class Logger:
+    """
+    Log messages from a background thread.
+
+    The thread is started by the first message.  `flush` waits until the queued messages are written, and
+    `close` is called at exit.
+    """
+    def __init__ (self, filename, level=INFO, max_size=10 * 1024 * 1024, backups=5, echo=True):
+        """
+        :param level: messages with a lower level are discarded.
+        :param max_size: the size in bytes above which the log file is rotated.
+        :param backups: how many rotated files are kept.
+        :param echo: whether messages are also printed to the standard output.
+        """
+        self.filename = filename
+        self.level = level
+        self.max_size = max_size
+        self.backups = backups
+        self.echo = echo
+        self.messages = queue.Queue ()
+        self.lock = threading.Lock ()
+        self.worker = None
+        self.fd = None
+        self.failed = False
+
+    def log (self, level, message, **fields):
+        if level < self.level:
+            return None
+        if self.worker is None:
+            self.start ()
+        self.messages.put ((datetime.datetime.now (), level, message, fields))
+        return None
+
+    def debug (self, message, **fields):
+        self.log (DEBUG, message, **fields)
+
+    def info (self, message, **fields):
+        self.log (INFO, message, **fields)
+
+    def warning (self, message, **fields):
+        self.log (WARNING, message, **fields)
+
+    def error (self, message, **fields):
+        self.log (ERROR, message, **fields)
+
+    def start (self):
+        with self.lock:
+            if self.worker is None:
+                self.worker = threading.Thread (target=self.run, name='logger')
+                self.worker.daemon = True
+                self.worker.start ()
+                atexit.register (self.close)
+        return None
+
+    def flush (self):
+        """
+        Wait until all the queued messages have been written to the log file.
+        """
+        if self.worker is not None:
+            self.messages.join ()
+        return None
+
+    def close (self):
+        if self.worker is not None:
+            self.messages.put (None)
+            self.worker.join ()
+            self.worker = None
+        return None
+
+    def run (self):
+        while True:
+            batch = [self.messages.get ()]
+            while len (batch) < BATCH_SIZE:
+                try:
+                    batch.append (self.messages.get_nowait ())
+                except queue.Empty:
+                    break
+            stop = None in batch
+            lines = [format_line (*item) for item in batch if item is not None]
+            try:
+                self.write (''.join (lines))
+            finally:
+                for _ in batch:
+                    self.messages.task_done ()
+            if stop:
+                if self.fd is not None:
+                    self.fd.close ()
+                    self.fd = None
+                return
+
+    def write (self, text):
+        if self.echo:
+            sys.stdout.write (text)
+            sys.stdout.flush ()
+        try:
+            if self.fd is None:
+                self.fd = open (self.filename, 'at')
+            self.fd.write (text)
+            self.fd.flush ()
+            if self.fd.tell () > self.max_size:
+                self.rotate ()
+        except (IOError, OSError) as ex:
+            if not self.failed:
+                sys.stderr.write ('could not write to log file {}: {}\n'.format (self.filename, ex))
+            self.failed = True
+            self.fd = None
+        return None
+
+    def rotate (self):
+        self.fd.close ()
+        self.fd = None
+        for index in range (self.backups - 1, 0, -1):
+            source = '{}.{}'.format (self.filename, index)
+            if os.path.exists (source):
+                os.rename (source, '{}.{}'.format (self.filename, index + 1))
+        if self.backups > 0:
+            os.rename (self.filename, self.filename + '.1')
+        else:
+            os.remove (self.filename)
+        return None
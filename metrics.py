@@ -0,0 +1,276 @@
+"""
+Performance metrics of the plant weight water control system.
+
+Counters, gauges and latency histograms are kept in a registry and rendered in the Prometheus text
+format.  They are served by a small HTTP server and written periodically to a text file, which can be
+collected by the textfile collector of the node exporter:
+
+    water_station_scale_settle_seconds_bucket{station="station",le="2.5"} 14
+    water_station_scale_settle_seconds_sum{station="station"} 27.318
+    water_station_scale_settle_seconds_count{station="station"} 15
+
+Updating a metric takes a lock and a few additions, so it can be done in the stages of the plant cycle.
+"""
+
+import bisect
+import http.server
+import os
+import threading
+import time
+
+# upper bounds of the latency histogram buckets, in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def format_labels (labels):
+    if not labels:
+        return ''
+    return '{' + ','.join (
+        '{}="{}"'.format (name, str (value).replace ('\\', '\\\\').replace ('"', '\\"').replace ('\n', '\\n'))
+        for name, value in labels
+    ) + '}'
+
+
+def format_value (value):
+    if value == float ('inf'):
+        return '+Inf'
+    return repr (float (value))
+
+
+class Metric:
+    """
+    A metric with a value for each combination of labels.
+    """
+    kind = None
+
+    def __init__ (self, name, help):
+        self.name = name
+        self.help = help
+        self.lock = threading.Lock ()
+        self.values = {}
+
+    def key (self, labels):
+        return tuple (sorted (labels.items ()))
+
+    def render (self):
+        lines = [
+            '# HELP {} {}\n'.format (self.name, self.help),
+            '# TYPE {} {}\n'.format (self.name, self.kind),
+        ]
+        with self.lock:
+            items = sorted (self.values.items ())
+        for labels, value in items:
+            lines.extend (self.render_value (labels, value))
+        return ''.join (lines)
+
+    def render_value (self, labels, value):
+        return ['{}{} {}\n'.format (self.name, format_labels (labels), format_value (value))]
+
+
+class Counter (Metric):
+    kind = 'counter'
+
+    def inc (self, amount=1, **labels):
+        key = self.key (labels)
+        with self.lock:
+            self.values [key] = self.values.get (key, 0) + amount
+        return None
+
+
+class Gauge (Metric):
+    """
+    A value that goes up and down.  The value can be given by a function called when the metric is rendered.
+    """
+    kind = 'gauge'
+
+    def set (self, value, **labels):
+        with self.lock:
+            self.values [self.key (labels)] = value
+        return None
+
+    def set_function (self, function, **labels):
+        """
+        :param function: function without arguments that returns the value, or `None` if there is no value.
+        """
+        return self.set (function, **labels)
+
+    def render_value (self, labels, value):
+        if callable (value):
+            value = value ()
+            if value is None:
+                return []
+        return Metric.render_value (self, labels, value)
+
+
+class Histogram (Metric):
+    kind = 'histogram'
+
+    def __init__ (self, name, help, buckets=DEFAULT_BUCKETS):
+        Metric.__init__ (self, name, help)
+        self.buckets = tuple (sorted (buckets))
+
+    def observe (self, value, **labels):
+        key = self.key (labels)
+        index = bisect.bisect_left (self.buckets, value)
+        with self.lock:
+            counts = self.values.get (key)
+            if counts is None:
+                # one count per bucket, the count above the last bucket and the sum
+                counts = self.values [key] = [0] * (len (self.buckets) + 1) + [0.0]
+            counts [index] += 1
+            counts [-1] += value
+        return None
+
+    def time (self, **labels):
+        """
+        Return a context manager that observes the seconds spent in its block.
+        """
+        return Timer (self, labels)
+
+    def render_value (self, labels, value):
+        result = []
+        cumulative = 0
+        for bound, count in zip (self.buckets + (float ('inf'),), value [:-1]):
+            cumulative += count
+            result.append ('{}_bucket{} {}\n'.format (
+                self.name, format_labels (labels + (('le', format_value (bound)),)), cumulative))
+        result.append ('{}_sum{} {}\n'.format (self.name, format_labels (labels), format_value (value [-1])))
+        result.append ('{}_count{} {}\n'.format (self.name, format_labels (labels), cumulative))
+        return result
+
+
+class Timer:
+    def __init__ (self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+        self.start = None
+
+    def __enter__ (self):
+        self.start = time.time ()
+        return self
+
+    def __exit__ (self, kind, value, traceback):
+        self.histogram.observe (time.time () - self.start, **self.labels)
+        return False
+
+
+class Registry:
+    """
+    The metrics of the application, rendered in the order they were created.
+    """
+    def __init__ (self, prefix=''):
+        self.prefix = prefix
+        self.metrics = []
+        self.lock = threading.Lock ()
+
+    def add (self, metric):
+        with self.lock:
+            self.metrics.append (metric)
+        return metric
+
+    def counter (self, name, help):
+        return self.add (Counter (self.prefix + name, help))
+
+    def gauge (self, name, help):
+        return self.add (Gauge (self.prefix + name, help))
+
+    def histogram (self, name, help, buckets=DEFAULT_BUCKETS):
+        return self.add (Histogram (self.prefix + name, help, buckets))
+
+    def render (self):
+        with self.lock:
+            metrics = list (self.metrics)
+        return ''.join (metric.render () for metric in metrics)
+
+
+class MetricsHandler (http.server.BaseHTTPRequestHandler):
+    def do_GET (self):
+        if self.path.split ('?') [0] not in ('/', '/metrics'):
+            self.send_error (404)
+            return
+        body = self.server.registry.render ().encode ('utf-8')
+        self.send_response (200)
+        self.send_header ('Content-Type', CONTENT_TYPE)
+        self.send_header ('Content-Length', str (len (body)))
+        self.end_headers ()
+        self.wfile.write (body)
+
+    def log_message (self, format, *args):
+        # the requests are not logged
+        pass
+
+
+class MetricsServer:
+    """
+    Serve the metrics of a registry in the Prometheus text format from a background thread.
+    """
+    def __init__ (self, registry, address):
+        """
+        :param address: pair of host and port, an empty host listens on all the interfaces.
+        :raise OSError: if the port cannot be opened.
+        """
+        self.server = http.server.ThreadingHTTPServer (address, MetricsHandler)
+        self.server.daemon_threads = True
+        self.server.registry = registry
+        self.worker = None
+
+    def start (self):
+        self.worker = threading.Thread (target=self.server.serve_forever, name='metrics-server')
+        self.worker.daemon = True
+        self.worker.start ()
+        return None
+
+    def close (self):
+        self.server.shutdown ()
+        self.server.server_close ()
+        return None
+
+
+class TextfileWriter:
+    """
+    Write the metrics of a registry to a file every `period` seconds.
+
+    The metrics are written to a temporary file that is renamed, so that a partially written file is never
+    collected.
+    """
+    def __init__ (self, registry, filename, period, log=None):
+        self.registry = registry
+        self.filename = filename
+        self.period = period
+        self.log = log if log is not None else print
+        self.stopped = threading.Event ()
+        self.worker = None
+
+    def start (self):
+        self.worker = threading.Thread (target=self.run, name='metrics-textfile')
+        self.worker.daemon = True
+        self.worker.start ()
+        return None
+
+    def run (self):
+        while not self.stopped.wait (self.period):
+            try:
+                self.write ()
+            except (IOError, OSError) as ex:
+                self.log ('an error occur while writing the metrics file {}: {}'.format (self.filename, ex))
+        return None
+
+    def write (self):
+        temporary = self.filename + '.tmp'
+        with open (temporary, 'wt') as fd:
+            fd.write (self.registry.render ())
+        os.rename (temporary, self.filename)
+        return None
+
+    def stop (self):
+        """
+        Stop the writer and write the metrics a last time.
+        """
+        self.stopped.set ()
+        if self.worker is not None:
+            self.worker.join ()
+            self.worker = None
+        self.write ()
+        return None
@@ -1,6 +1,4 @@
-#!/usr/bin/python
-
-from __future__ import print_function
+#!/usr/bin/python3
 
 import csv
 import os
@@ -8,6 +6,10 @@ import sys
 import serial
 import time
 
+import logger
+
+LOG = logger.Logger ('/var/log/interpheno/controlo-peso-planta.log', echo=False)
+
 
 def ler_codigo_planta ():
     """
@@ -43,9 +45,9 @@ def ler_peso_vaso ():
     return result
 
 
-STX = '\x02'
-ENQ = '\x05'
-CR = '\x0D'
+STX = b'\x02'
+ENQ = b'\x05'
+CR = b'\x0D'
 
 def controlar_bomba ():
     bomba = serial.Serial (
@@ -59,7 +61,7 @@ def controlar_bomba ():
     # enviar o comando ENQ
     if True:
         comando = ENQ
-        bomba.write (bytearray ([bytes (c) for c in comando]))
+        bomba.write (comando)
         bomba.flush ()
         print ('A espera da resposta do comando ')
         print_serial (comando)
@@ -67,8 +69,8 @@ def controlar_bomba ():
         print ('Resposta e')
         print_serial (resposta)
     if True:
-        comando = STX + 'P99I' + CR
-        bomba.write (bytearray ([bytes (c) for c in comando]))
+        comando = STX + b'P99I' + CR
+        bomba.write (comando)
         bomba.flush ()
         print ('A espera da resposta do comando ')
         print_serial (comando)
@@ -76,7 +78,7 @@ def controlar_bomba ():
         print ('Resposta e')
         print_serial (resposta)
 
-    comando = chr (2) + 'P' + '02' + 'R' + chr (13)
+    comando = STX + b'P' + b'02' + b'R' + CR
     bomba.write (comando)
     bomba.flush ()
     print ('A espera da resposta do comando ')
@@ -85,16 +87,16 @@ def controlar_bomba ():
     # print_serial (resposta)
 
     print ('Ligar bomba')
-    comando = chr (2) + 'P' + '02' + 'S' + '+0001' + chr (13)
+    comando = STX + b'P' + b'02' + b'S' + b'+0001' + CR
     bomba.write (comando)
     bomba.flush ()
 
     print ('Desligar bomba')
     input ('Carregue em ENTER')
-    comando = chr (2) + 'P' + '01' + 'H' + chr (13)
+    comando = STX + b'P' + b'01' + b'H' + CR
     bomba.write (comando)
     bomba.flush ()
-    serial.close ()
+    bomba.close ()
     print ('Fim do controlo da bomba')
 
 
@@ -112,22 +114,18 @@ def receive_frame (serial):
 
 def print_serial (chars):
     for c in chars:
-        print (' {:3}'.format (ord (c)), end='')
+        print (' {:3}'.format (c), end='')
     print ()
     for c in chars:
-        if ord (c) < 32:
+        if c < 32:
             print ('    ', end='')
         else:
-            print ('   {}'.format (c), end='')
+            print ('   {}'.format (chr (c)), end='')
     print ()
 
 
 def write_to_log (message):
-    with open ('/var/log/interpheno/controlo-peso-planta.log', 'at') as fd:
-        fd.write ('{}: {}'.format (
-            datetime.now ().isoformat (),
-            message
-            )
+    LOG.info (message)
 
 #ler_codigo_planta ()
 #print ('O peso do vaso e {}'.format (ler_peso_vaso ()))
@@ -0,0 +1,319 @@
+"""
+Masterflex pump driver.
+
+Commands are frames with the characters STX, `P`, the two digit pump number, the command and CR.  The pump
+answers a command with ACK, or NAK if the command was rejected, and a request with a data frame
+delimited by STX and CR.  When the pump is powered on it waits for an ENQ, answers with a data frame, and
+is then assigned its pump number.
+
+The replies are read by a background thread that parses frames from the buffered stream and matches them
+to the commands in the order they were sent.  Several commands can be sent in a single write, so that
+setting the speed and the revolutions and starting the pump takes one round trip.
+"""
+
+import collections
+import serial
+import threading
+import time
+
+STX = b'\x02'
+ENQ = b'\x05'
+ACK = b'\x06'
+NAK = b'\x15'
+CR = b'\r'
+
+# seconds to wait for the reply of a command
+TIMEOUT = 1.0
+# seconds a reply is still expected after its command timed out, so a late reply is not matched to the
+# next command
+LATE_REPLY = 2.0
+# maximum number of bytes kept while waiting for the end of a frame
+MAX_FRAME_SIZE = 256
+# seconds between two status requests while the pump is running
+POLL_PERIOD = 0.5
+# number of consecutive status requests that fail before the pump connection is considered failed
+MAX_POLL_FAILURES = 3
+
+
+class PumpError (Exception):
+    pass
+
+
+class Command:
+    __slots__ = ('frame', 'expires', 'reply', 'done')
+
+    def __init__ (self, frame, timeout):
+        self.frame = frame
+        self.expires = time.time () + timeout + LATE_REPLY
+        self.reply = None
+        self.done = threading.Event ()
+
+
+class PumpStatus:
+    __slots__ = ('time', 'running', 'remaining')
+
+    def __init__ (self, time, running, remaining):
+        """
+        :param running: whether the pump was started and has revolutions remaining.
+        :param remaining: the revolutions remaining of the last run.
+        """
+        self.time = time
+        self.running = running
+        self.remaining = remaining
+
+
+class Pump:
+    """
+    Drive a Masterflex pump connected to a serial port.
+
+    The methods `setMotorSpeed`, `setRevolutions`, `go`, `halt` and `cancel` have the same meaning as in
+    `masterflex.MasterflexSerial`.
+    """
+    def __init__ (self, port, number=1, log=None):
+        """
+        :param port: the serial port of the pump, opened at 4800 baud with odd parity, seven data bits and a
+        read timeout.
+        """
+        self.port = port
+        self.number = number
+        self.log = log if log is not None else print
+        self.pending = collections.deque ()
+        self.write_lock = threading.Lock ()
+        self.condition = threading.Condition ()
+        self.status = None
+        self.error = None
+        self.closed = False
+        self.worker = None
+        self.poller = None
+
+    def start (self):
+        """
+        Start reading the serial port and assign the pump number.
+        """
+        self.worker = threading.Thread (target=self.run, name='pump')
+        self.worker.daemon = True
+        self.worker.start ()
+        reply = self.send_frames ([ENQ]) [0]
+        self.log ('pump answered [{}]'.format (reply.decode ('ascii', 'replace')))
+        self.send_frames ([self.frame ('')])
+        return None
+
+    def frame (self, command):
+        return STX + 'P{:02d}{}'.format (self.number, command).encode ('ascii') + CR
+
+    def send (self, *commands, timeout=TIMEOUT):
+        """
+        Send several commands in one write and wait for all the replies.
+
+        :param timeout: seconds to wait for the replies.
+        :return: the list of replies, `None` for an ACK and the frame content for a data frame.
+        :raise PumpError: if a command is rejected or its reply does not arrive in time.
+        """
+        return self.send_frames ([self.frame (command) for command in commands], timeout)
+
+    def send_frames (self, frames, timeout=TIMEOUT):
+        commands = [Command (frame, timeout) for frame in frames]
+        with self.write_lock:
+            with self.condition:
+                if self.error is not None:
+                    raise PumpError ('pump connection failed: {}'.format (self.error))
+                self.pending.extend (commands)
+            self.port.write (b''.join (frames))
+            self.port.flush ()
+        deadline = time.time () + timeout
+        result = []
+        for command in commands:
+            if not command.done.wait (max (0, deadline - time.time ())):
+                raise PumpError ('no reply to pump command [{}]'.format (command.frame.strip ().decode ('ascii')))
+            if command.reply == NAK:
+                raise PumpError ('pump rejected command [{}]'.format (command.frame.strip ().decode ('ascii')))
+            if isinstance (command.reply, BaseException):
+                raise PumpError ('pump connection failed: {}'.format (command.reply))
+            result.append (command.reply)
+        return result
+
+    def run (self):
+        buffer = bytearray ()
+        try:
+            while not self.closed:
+                data = self.port.read (max (1, self.port.in_waiting))
+                if data:
+                    buffer.extend (data)
+                    for reply in self.parse (buffer):
+                        self.reply (reply)
+                if len (buffer) > MAX_FRAME_SIZE:
+                    del buffer [:-MAX_FRAME_SIZE]
+        except BaseException as ex:
+            with self.condition:
+                self.error = ex
+                while self.pending:
+                    command = self.pending.popleft ()
+                    command.reply = ex
+                    command.done.set ()
+                self.condition.notify_all ()
+
+    def parse (self, buffer):
+        """
+        Remove the complete replies from the start of the buffer and return them.
+        """
+        result = []
+        while buffer:
+            first = buffer [0:1]
+            if first in (ACK, NAK):
+                result.append (bytes (first))
+                del buffer [0]
+            elif first == STX:
+                end = buffer.find (CR)
+                if end < 0:
+                    break
+                result.append (bytes (buffer [1:end]))
+                del buffer [:end + 1]
+            else:
+                del buffer [0]
+        return result
+
+    def reply (self, reply):
+        now = time.time ()
+        with self.condition:
+            while self.pending and self.pending [0].expires < now:
+                self.pending.popleft ()
+            if not self.pending:
+                self.log ('unexpected pump reply [{}]'.format (reply))
+                return None
+            command = self.pending.popleft ()
+        command.reply = None if reply == ACK else reply
+        command.done.set ()
+        return None
+
+    def setMotorSpeed (self, speed):
+        self.send ('S{:+07.1f}'.format (float (speed)))
+
+    def setRevolutions (self, revolutions):
+        self.send ('V{:08.2f}'.format (float (revolutions)))
+
+    def go (self):
+        self.send ('G')
+        self.set_status (True, None)
+        self.start_polling ()
+
+    def halt (self):
+        """
+        Halt the pump and request the revolutions remaining in the same round trip.
+        """
+        reply = self.send ('H', 'E') [1]
+        self.set_status (False, self.parse_remaining (reply))
+
+    def run_revolutions (self, speed, revolutions):
+        """
+        Set the motor speed and the revolutions and start the pump in one round trip.
+        """
+        self.send (
+            'S{:+07.1f}'.format (float (speed)),
+            'V{:08.2f}'.format (float (revolutions)),
+            'G',
+        )
+        self.set_status (True, float (revolutions))
+        self.start_polling ()
+        return None
+
+    def remaining (self):
+        """
+        Request the revolutions remaining of the last run.
+        """
+        result = self.parse_remaining (self.send ('E') [0])
+        if result is None:
+            raise PumpError ('invalid revolutions remaining reply')
+        return result
+
+    def parse_remaining (self, reply):
+        """
+        Return the revolutions in a reply `PnnEddddd.dd` or `None` if the reply is malformed.
+        """
+        try:
+            return float (reply.decode ('ascii') [4:])
+        except (AttributeError, ValueError):
+            return None
+
+    def set_status (self, running, remaining):
+        with self.condition:
+            if remaining is None and self.status is not None:
+                remaining = self.status.remaining
+            self.status = PumpStatus (time.time (), running, remaining)
+            self.condition.notify_all ()
+        return None
+
+    def start_polling (self):
+        if self.poller is None or not self.poller.is_alive ():
+            self.poller = threading.Thread (target=self.poll, name='pump-status')
+            self.poller.daemon = True
+            self.poller.start ()
+        return None
+
+    def poll (self):
+        """
+        Request the revolutions remaining while the pump is running.
+
+        A failed request is retried, after `MAX_POLL_FAILURES` consecutive failures the connection is
+        considered failed and the threads waiting for the pump to halt are woken up.
+        """
+        failures = 0
+        while not self.closed:
+            with self.condition:
+                if self.status is None or not self.status.running:
+                    return
+            try:
+                remaining = self.remaining ()
+            except (PumpError, serial.SerialException) as ex:
+                if self.closed:
+                    return
+                failures += 1
+                self.log ('could not read the pump status: {}'.format (ex))
+                if failures >= MAX_POLL_FAILURES:
+                    with self.condition:
+                        if self.error is None:
+                            self.error = PumpError ('no pump status after {} requests'.format (failures))
+                        self.condition.notify_all ()
+                    return
+                # a late reply to the failed request would be taken as the reply to the next one
+                time.sleep (LATE_REPLY)
+                continue
+            failures = 0
+            with self.condition:
+                if self.status.running:
+                    self.set_status (remaining > 0, remaining)
+            time.sleep (POLL_PERIOD)
+
+    def wait_halted (self, timeout=None):
+        """
+        Wait until the pump has no revolutions remaining or was halted.
+
+        :return: the `PumpStatus`, without revolutions remaining if the pump has not run yet, or `None` on
+        timeout.
+        :raise PumpError: if the connection to the pump failed.
+        """
+        deadline = None if timeout is None else time.time () + timeout
+        with self.condition:
+            while self.status is not None and self.status.running:
+                if self.error is not None:
+                    raise PumpError ('pump connection failed: {}'.format (self.error))
+                if deadline is None:
+                    self.condition.wait ()
+                else:
+                    remaining = deadline - time.time ()
+                    if remaining <= 0:
+                        return None
+                    self.condition.wait (remaining)
+            if self.status is None:
+                return PumpStatus (time.time (), False, None)
+            return self.status
+
+    def cancel (self):
+        """
+        Stop reading the serial port and close it.
+        """
+        self.closed = True
+        if self.worker is not None:
+            self.worker.join ()
+            self.worker = None
+        self.port.close ()
+        return None
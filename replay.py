@@ -0,0 +1,686 @@
+#!/usr/bin/python3
+"""
+Replay a session of a watering station from its log file.
+
+The barcodes read and the weights returned by the scale are taken from the log file, and fed to a
+station running in this process with the simulated devices: the scanner scans the recorded barcodes and
+the scale shows the recorded weights, at the recorded pace or faster.  The watering decisions of the
+station are compared with the recorded ones, plant by plant, and the timing of the replay is compared
+with the timing of the recorded session.
+
+Both formats of the log file are read, the old one without level:
+
+    2024-03-01T10:00:00.000000: read plant code 4012700301178
+
+and the current one with the level and the structured fields:
+
+    2024-03-01T10:00:00.000000: INFO read plant code 4012700301178 | plant=4012700301178 stage=barcode
+
+The log file must be the log of a single station.  The desired weights of the plants are computed from
+the recorded decisions, unless an experiment data file is given.  The pump parameters are taken from the
+log file, the water per one revolution of the old format is estimated from the first watering.  The
+station is replayed in open loop, so a closed-loop session is compared on its first pump run of each
+plant.
+
+Gaps longer than `--max-gap` seconds, such as the station being off, are shortened.  When the station
+is slower than the recorded pace the simulated operator waits for it, and the delay is reported.
+
+The station uses the data folder in the environment variable `WATER_WEIGHT_CONTROL_FOLDER`, by default
+a new temporary folder.  The exit status is 1 if a decision differs.
+"""
+
+import argparse
+import ast
+import collections
+import datetime
+import json
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+import yaml
+
+os.environ.setdefault ('WATER_WEIGHT_CONTROL_FOLDER', tempfile.mkdtemp (prefix='water-weight-control-replay-'))
+
+import benchmark
+import experiment
+import logger
+import water_plant
+
+from simulator import bench
+
+# a log line: the timestamp, the level in the current format and the message with its fields
+LINE = re.compile (r'^(\d{4}-\d\d-\d\dT[0-9:.]+): (?:(DEBUG|INFO|WARNING|ERROR) )?(.*)$')
+# separator of the structured fields
+FIELD = re.compile (r' (?=\w+=)')
+
+READ_CODE = re.compile (r'^read plant code (\S+)$')
+UNKNOWN_CODE = re.compile (r'^non existing plant code (\S+)$')
+SCALE_WEIGHT = re.compile (r'^scale returned the weight (\S+) after')
+SCALE_READING = re.compile (r'^scale returned the reading \[(.*)\]$')
+NEEDS_WATER = re.compile (r'^plant id (\S+) needs (\S+)g of water$')
+EXCESS_WATER = re.compile (r'^plant id (\S+) has excess water, (\S+)g$')
+PUMP_SETTING = re.compile (r'^set the pump speed to (\S+) and pump revolutions to (\S+)$')
+
+# stages timed both in the recorded session and in the replay
+RECORDED_STAGES = ('scale', 'settle', 'cycle')
+
+# seconds the operator waits for the station to weigh a plant
+WEIGHING_TIMEOUT = 60
+
+
+class Event:
+    """
+    A barcode scanned or a plant placed on the scale.
+    """
+    def __init__ (self, kind, timestamp, value):
+        self.kind = kind
+        self.timestamp = timestamp
+        self.value = value
+        # the plant id of a weighing and the scan of the plant
+        self.plant_id = None
+        self.scan = None
+        # the motor speed and water per one revolution set before a scan, if they changed
+        self.pump = None
+
+
+class Decision:
+    """
+    The watering decision of a plant: whether it was watered and how many revolutions.
+    """
+    def __init__ (self, plant_id, timestamp, weight, desired, watered, revolutions=None):
+        self.plant_id = plant_id
+        self.timestamp = timestamp
+        self.weight = weight
+        self.desired = desired
+        self.watered = watered
+        self.revolutions = revolutions
+        self.weighing = None
+
+    def describe (self):
+        if not self.watered:
+            return 'not watered'
+        if self.revolutions is None:
+            return 'watered'
+        return 'watered {:.2f} revolutions'.format (self.revolutions)
+
+
+class Session:
+    """
+    The events and decisions of a recorded session.
+    """
+    def __init__ (self):
+        self.events = []
+        self.decisions = []
+        # desired weight of each plant
+        self.plants = collections.OrderedDict ()
+        # motor speed and water per one revolution of the first watering
+        self.pump = None
+        self.latencies = collections.defaultdict (list)
+
+    def duration (self):
+        if not self.events:
+            return 0.0
+        end = max ([self.events [-1].timestamp] + [decision.timestamp for decision in self.decisions])
+        return (end - self.events [0].timestamp).total_seconds ()
+
+
+def read_lines (filenames):
+    """
+    Return an iterator over the timestamp, the message and the fields of the lines of the log files.
+    Lines that are not log lines are skipped.
+    """
+    for filename in filenames:
+        with open (filename, 'r', errors='replace') as fd:
+            for line in fd:
+                match = LINE.match (line.rstrip ('\n'))
+                if match is None:
+                    continue
+                try:
+                    timestamp = datetime.datetime.fromisoformat (match.group (1))
+                except ValueError:
+                    continue
+                message = match.group (3)
+                fields = {}
+                if match.group (2) is not None and ' | ' in message:
+                    message, _, text = message.rpartition (' | ')
+                    for item in FIELD.split (' ' + text):
+                        if '=' in item:
+                            name, _, value = item.partition ('=')
+                            fields [name] = value
+                yield timestamp, message, fields
+
+
+def parse_weight (message):
+    """
+    Return the weight of a scale reading message, or `None` if the message is not a scale reading.
+    """
+    match = SCALE_WEIGHT.match (message)
+    if match is not None:
+        text = match.group (1)
+    else:
+        match = SCALE_READING.match (message)
+        if match is None:
+            return None
+        # the old format logged the frame of the scale, which may be the representation of bytes
+        text = match.group (1)
+        if text [:2] in ("b'", 'b"'):
+            try:
+                text = ast.literal_eval (text).decode ('ascii', 'replace')
+            except (ValueError, SyntaxError):
+                return None
+        text = text [1:9]
+    try:
+        return float (text)
+    except ValueError:
+        return None
+
+
+def parse_log (filenames, since=None, until=None, max_invalid_weight=water_plant.MAX_INVALID_WEIGHT):
+    """
+    Read the events and the watering decisions of a station from its log files.
+
+    The weights are assigned to the plants in the order they were scanned, as the station does, and the
+    decisions to the weighings in the order the plants were weighed.  The decisions are logged by the pump
+    thread, after the next plant may have been weighed.  Invalid weights, such as the empty scale, are not
+    replayed, the station reads them again from the simulated scale.
+
+    :param since: the time of the first line read, by default the start of the log.
+    :param until: the time of the last line read, by default the end of the log.
+    :return: a `Session`.
+    """
+    session = Session ()
+    # scans of the plants waiting to be weighed, and the scans of the tray being scanned
+    expected = collections.deque ()
+    tray = None
+    # weighings of each plant waiting for their decision
+    weighed = collections.defaultdict (collections.deque)
+    # decisions waiting for their pump setting
+    pending = {}
+    last_watered = None
+    pump = None
+    for timestamp, message, fields in read_lines (filenames):
+        if (since is not None and timestamp < since) or (until is not None and timestamp > until):
+            continue
+        match = READ_CODE.match (message)
+        if match is not None:
+            code = match.group (1)
+            if code == water_plant.STOP_CODE:
+                # the replay is stopped after the last event
+                if tray:
+                    expected.extend (tray)
+                tray = None
+                continue
+            event = Event ('scan', timestamp, code)
+            session.events.append (event)
+            if code == water_plant.TRAY_START_CODE:
+                tray = []
+            elif code == water_plant.TRAY_END_CODE:
+                if tray:
+                    expected.extend (tray)
+                tray = None
+            elif code == water_plant.RESET_WATERING_CODE:
+                pass
+            elif tray is not None:
+                tray.append (event)
+            else:
+                expected.append (event)
+            continue
+        match = UNKNOWN_CODE.match (message)
+        if match is not None:
+            for scans in (tray, expected):
+                if scans:
+                    for scan in reversed (scans):
+                        if scan.value == match.group (1):
+                            scans.remove (scan)
+                            break
+            continue
+        weight = parse_weight (message)
+        if weight is not None:
+            if weight > max_invalid_weight and expected:
+                scan = expected.popleft ()
+                event = Event ('weight', timestamp, weight)
+                event.plant_id = scan.value
+                event.scan = scan
+                session.events.append (event)
+                weighed [scan.value].append (event)
+                session.latencies ['scale'].append ((timestamp - scan.timestamp).total_seconds ())
+                if 'duration' in fields:
+                    session.latencies ['settle'].append (float (fields ['duration']))
+            continue
+        match = NEEDS_WATER.match (message) or EXCESS_WATER.match (message)
+        if match is not None:
+            plant_id = match.group (1)
+            if not weighed [plant_id]:
+                continue
+            weighing = weighed [plant_id].popleft ()
+            watered = message.endswith ('of water')
+            amount = float (match.group (2))
+            desired = round (weighing.value + (amount if watered else -amount), 2)
+            decision = Decision (plant_id, timestamp, weighing.value, desired, watered)
+            decision.weighing = weighing
+            session.decisions.append (decision)
+            session.plants.setdefault (plant_id, desired)
+            if watered:
+                pending [plant_id] = decision
+                last_watered = plant_id
+            else:
+                session.latencies ['cycle'].append ((timestamp - weighing.scan.timestamp).total_seconds ())
+            continue
+        match = PUMP_SETTING.match (message)
+        if match is not None:
+            # the top-ups of the closed loop have no pending decision
+            decision = pending.pop (fields.get ('plant', last_watered), None)
+            if decision is None:
+                continue
+            decision.revolutions = float (match.group (2))
+            session.latencies ['cycle'].append ((timestamp - decision.weighing.scan.timestamp).total_seconds ())
+            water = fields.get ('water_per_1_revolution')
+            setting = (float (match.group (1)), float (water) if water is not None else None)
+            if session.pump is None:
+                session.pump = setting
+            if setting != pump:
+                decision.weighing.scan.pump = setting
+                pump = setting
+    return session
+
+
+class Replay:
+    """
+    The simulated operator of a replay, and the decisions of the replayed station.
+    """
+    def __init__ (self, station, session, registry, pump_data, speed, max_gap):
+        """
+        :param pump_data: the pump parameters of the start of the replay.
+        :param speed: how many times faster than recorded the events are replayed.
+        :param max_gap: the longest gap in seconds between two recorded events.
+        """
+        self.station = station
+        self.session = session
+        self.registry = registry
+        self.pump_data = dict (pump_data)
+        self.speed = speed
+        self.max_gap = max_gap
+        self.lock = threading.Lock ()
+        self.decisions = []
+        # seconds the operator was behind the recorded pace
+        self.lag = 0.0
+
+    def install (self):
+        """
+        Wrap the functions of `water_plant` that record the decisions.
+        """
+        record_watering = water_plant.record_watering
+        record_weight = water_plant.record_weight
+
+        def replayed_record_watering (plant_id, plant_current_weight, plant_desired_weight, motor_speed, revolutions,
+                                      *args, **kwargs):
+            self.add (Decision (
+                plant_id, datetime.datetime.now (), plant_current_weight, plant_desired_weight, True,
+                float (revolutions)))
+            return record_watering (
+                plant_id, plant_current_weight, plant_desired_weight, motor_speed, revolutions, *args, **kwargs)
+
+        def replayed_record_weight (plant_id, plant_current_weight, plant_desired_weight):
+            self.add (Decision (
+                plant_id, datetime.datetime.now (), plant_current_weight, plant_desired_weight, False))
+            return record_weight (plant_id, plant_current_weight, plant_desired_weight)
+
+        water_plant.record_watering = replayed_record_watering
+        water_plant.record_weight = replayed_record_weight
+        return None
+
+    def add (self, decision):
+        with self.lock:
+            self.decisions.append (decision)
+        return None
+
+    def operate (self):
+        """
+        Scan the recorded barcodes and place the recorded weights on the scale at the recorded pace, then
+        scan the stop code.
+        """
+        start = time.time ()
+        offset = 0.0
+        previous = None
+        for event in self.session.events:
+            if previous is not None:
+                offset += min ((event.timestamp - previous).total_seconds (), self.max_gap) / self.speed
+            previous = event.timestamp
+            delay = start + offset - time.time ()
+            if delay > 0:
+                time.sleep (delay)
+            else:
+                self.lag = max (self.lag, -delay)
+            if event.kind == 'scan':
+                self.set_pump (event.pump)
+                self.station.scans.append ((event.value, time.time ()))
+                self.station.scanner.scan (event.value)
+            elif event.plant_id in self.registry:
+                self.station.placements.append ((event.plant_id, time.time ()))
+                self.station.scale.place (event.value)
+                self.station.weighings.acquire (timeout=WEIGHING_TIMEOUT)
+                self.station.scale.remove ()
+        self.station.scanner.scan (water_plant.STOP_CODE)
+        return None
+
+    def set_pump (self, setting):
+        """
+        Stage the recorded pump parameters that changed, they are applied when the station reads the barcode.
+        """
+        if setting is None:
+            return None
+        motor_speed, water_per_1_revolution = setting
+        data = dict (self.pump_data)
+        if motor_speed is not None:
+            data ['motor_speed'] = motor_speed
+        if water_per_1_revolution is not None:
+            data ['water_per_1_revolution'] = water_per_1_revolution
+        if data != self.pump_data:
+            self.pump_data = data
+            water_plant.stage_config ('pump data', data)
+        return None
+
+
+def compare (recorded, replayed, tolerance):
+    """
+    Compare the decisions of each plant in the order they were made.
+
+    :param tolerance: the largest difference of revolutions of matching decisions.
+    :return: the number of matching decisions and the list of differences, pairs of recorded and replayed
+    decisions where one of them may be `None`.
+    """
+    def by_plant (decisions):
+        result = collections.OrderedDict ()
+        for decision in decisions:
+            result.setdefault (decision.plant_id, []).append (decision)
+        return result
+
+    recorded_plants = by_plant (recorded)
+    replayed_plants = by_plant (replayed)
+    matching = 0
+    differences = []
+    for plant_id in list (recorded_plants) + [plant_id for plant_id in replayed_plants if plant_id not in recorded_plants]:
+        old = recorded_plants.get (plant_id, [])
+        new = replayed_plants.get (plant_id, [])
+        for index in range (max (len (old), len (new))):
+            old_decision = old [index] if index < len (old) else None
+            new_decision = new [index] if index < len (new) else None
+            if old_decision is not None and new_decision is not None and \
+                    old_decision.watered == new_decision.watered and \
+                    (not old_decision.watered or old_decision.revolutions is None or
+                     abs (old_decision.revolutions - new_decision.revolutions) <= tolerance):
+                matching += 1
+            else:
+                differences.append ((old_decision, new_decision))
+    return matching, differences
+
+
+def write_experiment (session, filename):
+    """
+    Write an experiment data file with the desired weights of the recorded decisions.
+    """
+    with open (filename, 'wt') as fd:
+        fd.write ('"id","weight","description"\n')
+        for plant_id, desired in session.plants.items ():
+            fd.write ('"{}",{},"replayed plant {}"\n'.format (plant_id, desired, plant_id))
+    return None
+
+
+def initial_pump_data (session, args):
+    """
+    Return the pump parameters of the start of the replay.  The options override the recorded values.
+    """
+    motor_speed, water_per_1_revolution = session.pump if session.pump is not None else (None, None)
+    if water_per_1_revolution is None:
+        for decision in session.decisions:
+            if decision.watered and decision.revolutions:
+                water_per_1_revolution = round ((decision.desired - decision.weight) / decision.revolutions, 3)
+                break
+    if args.motor_speed is not None:
+        motor_speed = args.motor_speed
+    if args.water_per_1_revolution is not None:
+        water_per_1_revolution = args.water_per_1_revolution
+    return {
+        'motor_speed': motor_speed if motor_speed is not None else water_plant.MOTOR_SPEED,
+        'water_per_1_revolution':
+            water_per_1_revolution if water_per_1_revolution is not None else water_plant.WATER_PER_1_REVOLUTION,
+        'closed_loop': False,
+    }
+
+
+def run (args, session):
+    folder = water_plant.DATA_FOLDER
+    os.makedirs (folder, exist_ok=True)
+    water_plant.LOG = logger.Logger (os.path.join (folder, 'replay.log'), echo=args.verbose)
+    if args.experiment_data is not None:
+        with open (args.experiment_data, 'rb') as source, open (water_plant.EXPERIMENT_DATA_FILENAME, 'wb') as fd:
+            fd.write (source.read ())
+    else:
+        write_experiment (session, water_plant.EXPERIMENT_DATA_FILENAME)
+    plants = experiment.parse (water_plant.EXPERIMENT_DATA_FILENAME) [0]
+    pump_data = initial_pump_data (session, args)
+    if args.motor_speed is not None or args.water_per_1_revolution is not None:
+        for event in session.events:
+            event.pump = None
+    with open (water_plant.PUMP_DATA_FILENAME, 'wt') as fd:
+        yaml.safe_dump (pump_data, fd, default_flow_style=False)
+    water_plant.PUMP_PLACEMENT_DELAY /= args.speed
+    water_plant.TRAY_PLACEMENT_DELAY /= args.speed
+    station = bench.SimulatedStation (
+        os.path.join (folder, 'devices'),
+        plants,
+        noise=0.0,
+        settling_time=0.0,
+        water_per_1_revolution=pump_data ['water_per_1_revolution'],
+        speedup=args.speed,
+    )
+    station.start ()
+    water_plant.start_device_monitor ()
+    water_plant.start_audio ()
+    water_plant.start_speech_cache ()
+    water_plant.open_watering_store ()
+    water_plant.recover_watering ()
+    water_plant.setup_pump ()
+    registry = water_plant.read_experiment_data_file ()
+    water_plant.SPEECH.prefetch (water_plant.plant_code_text (code, plant) for code, plant in registry.items ())
+    timer = benchmark.StageTimer (station)
+    timer.install ()
+    replay = Replay (station, session, registry, water_plant.load_pump_data (), args.speed, args.max_gap)
+    replay.install ()
+    scanner = water_plant.detect_barcode_scanner (station.devices ['scanner'])
+    station_pump = water_plant.detect_pump (station.devices ['pump'])
+    plant_scale = water_plant.detect_scale (station.devices ['scale'])
+    operator = threading.Thread (target=replay.operate, name='operator')
+    start = time.time ()
+    operator.start ()
+    water_plant.Station (scanner, plant_scale, station_pump, registry, 'replay').run ()
+    station_pump.wait_halted (timeout=water_plant.PUMP_RUN_TIMEOUT)
+    elapsed = time.time () - start
+    operator.join ()
+    station_pump.cancel ()
+    water_plant.LOG.flush ()
+    matching, differences = compare (session.decisions, replay.decisions, args.tolerance)
+    recorded_duration = session.duration ()
+    result = {
+        'time': datetime.datetime.now ().isoformat (),
+        'version': benchmark.version (),
+        'logs': args.logs,
+        'speed': args.speed,
+        'decisions': {
+            'recorded': len (session.decisions),
+            'replayed': len (replay.decisions),
+            'matching': matching,
+            'different': len (differences),
+        },
+        'recorded': {
+            'plants': len (session.decisions),
+            'elapsed': recorded_duration,
+            'plants_per_hour': len (session.decisions) * 3600.0 / recorded_duration if recorded_duration else 0.0,
+            'stages': summarise (session.latencies, RECORDED_STAGES),
+        },
+        'replayed': {
+            'plants': len (replay.decisions),
+            'elapsed': elapsed,
+            'plants_per_hour': len (replay.decisions) * 3600.0 / elapsed,
+            'lag': replay.lag,
+            'stages': summarise (timer.latencies, benchmark.STAGES),
+        },
+    }
+    return result, differences
+
+
+def summarise (latencies, stages):
+    return {
+        stage: {
+            'count': len (latencies [stage]),
+            'p50': benchmark.percentile (latencies [stage], 0.50),
+            'p95': benchmark.percentile (latencies [stage], 0.95),
+        }
+        for stage in stages
+        if latencies.get (stage)
+    }
+
+
+def report (result, differences):
+    recorded = result ['recorded']
+    replayed = result ['replayed']
+    print ('recorded: {} plants in {:.1f}s, {:.1f} plants/hour'.format (
+        recorded ['plants'], recorded ['elapsed'], recorded ['plants_per_hour']))
+    print ('replayed: {} plants in {:.1f}s at {:g}x, {:.1f} plants/hour, at most {:.1f}s behind the recorded pace'.format (
+        replayed ['plants'], replayed ['elapsed'], result ['speed'], replayed ['plants_per_hour'], replayed ['lag']))
+    print ('{:10} {:^28} {:^28}'.format ('', 'recorded', 'replayed'))
+    print ('{:10} {:>6} {:>10} {:>10} {:>6} {:>10} {:>10}'.format (
+        'stage', 'count', 'p50 (ms)', 'p95 (ms)', 'count', 'p50 (ms)', 'p95 (ms)'))
+    for stage in benchmark.STAGES:
+        columns = []
+        for values in (recorded ['stages'].get (stage), replayed ['stages'].get (stage)):
+            if values is None:
+                columns.append ('{:>6} {:>10} {:>10}'.format ('-', '-', '-'))
+            else:
+                columns.append ('{:6d} {:10.1f} {:10.1f}'.format (values ['count'], values ['p50'] * 1000, values ['p95'] * 1000))
+        if recorded ['stages'].get (stage) or replayed ['stages'].get (stage):
+            print ('{:10} {} {}'.format (stage, *columns))
+    decisions = result ['decisions']
+    print ('decisions: {} recorded, {} replayed, {} matching, {} different'.format (
+        decisions ['recorded'], decisions ['replayed'], decisions ['matching'], decisions ['different']))
+    for old, new in differences:
+        decision = old if old is not None else new
+        print ('plant {} weighing {:.2f}g{}: recorded {}, replayed {}'.format (
+            decision.plant_id,
+            decision.weight,
+            ' at {}'.format (old.timestamp.isoformat (sep=' ', timespec='seconds')) if old is not None else '',
+            old.describe () if old is not None else 'nothing',
+            new.describe () if new is not None else 'nothing',
+        ))
+    return None
+
+
+def main ():
+    args = process_arguments ()
+    session = parse_log (args.logs, args.since, args.until)
+    if not session.events:
+        print ('no barcodes nor weights in {}'.format (', '.join (args.logs)))
+        sys.exit (1)
+    result, differences = run (args, session)
+    report (result, differences)
+    if args.output is not None:
+        with open (args.output, 'a') as fd:
+            fd.write (json.dumps (result, sort_keys=True) + '\n')
+        print ('results appended to {}'.format (args.output))
+    if differences:
+        sys.exit (1)
+    return None
+
+
+def process_arguments ():
+    parser = argparse.ArgumentParser (
+        description='Replay the barcodes and weights of a station log file and compare the watering decisions'
+    )
+    parser.add_argument (
+        'logs',
+        type=str,
+        nargs='*',
+        default=[water_plant.LOG_FILENAME],
+        help='log files in chronological order, by default the log file of the station',
+        metavar='LOG'
+        )
+    parser.add_argument (
+        '--speed',
+        type=float,
+        default=1.0,
+        help='how many times faster than recorded the session is replayed',
+        metavar='FACTOR'
+        )
+    parser.add_argument (
+        '--max-gap',
+        type=float,
+        default=60.0,
+        help='longest recorded gap between two events, longer gaps are shortened',
+        metavar='SECONDS'
+        )
+    parser.add_argument (
+        '--since',
+        type=datetime.datetime.fromisoformat,
+        default=None,
+        help='replay the events logged from this time',
+        metavar='TIME'
+        )
+    parser.add_argument (
+        '--until',
+        type=datetime.datetime.fromisoformat,
+        default=None,
+        help='replay the events logged up to this time',
+        metavar='TIME'
+        )
+    parser.add_argument (
+        '--experiment-data',
+        type=str,
+        default=None,
+        help='experiment data file with the desired weights, by default they are computed from the log',
+        metavar='FILE'
+        )
+    parser.add_argument (
+        '--motor-speed',
+        type=float,
+        default=None,
+        help='motor speed of the pump, by default the recorded one',
+        metavar='RPM'
+        )
+    parser.add_argument (
+        '--water-per-1-revolution',
+        type=float,
+        default=None,
+        help='grams of water of one revolution, by default the recorded one',
+        metavar='GRAMS'
+        )
+    parser.add_argument (
+        '--tolerance',
+        type=float,
+        default=0.01,
+        help='largest difference of revolutions between matching decisions',
+        metavar='REVOLUTIONS'
+        )
+    parser.add_argument (
+        '--output',
+        type=str,
+        default=None,
+        help='file where the results are appended as a JSON line',
+        metavar='FILE'
+        )
+    parser.add_argument (
+        '-v',
+        '--verbose',
+        action='store_true',
+        help='print the log messages of the replayed station'
+        )
+    result = parser.parse_args ()
+    if result.speed <= 0:
+        parser.error ('the speed must be positive')
+    return result
+
+
+if __name__ == '__main__':
+    main ()
@@ -0,0 +1,147 @@
+"""
+Scale driver.
+
+The scale sends frames terminated by a new line.  The first character of a frame is the sign, a space or
+`+` for positive weights, and the next eight characters are the weight in grams.  The driver reads the
+serial port continuously in a background thread and keeps the last readings in a ring buffer, so a
+settled weight is available as soon as the scale sends it.
+"""
+
+import collections
+import threading
+import time
+
+# maximum number of bytes kept while waiting for the end of a frame
+MAX_FRAME_SIZE = 256
+# number of readings kept in the ring buffer
+HISTORY = 64
+
+
+def parse_frame (frame):
+    """
+    Return the weight in a scale frame or `None` if the frame is malformed.
+    """
+    try:
+        result = float (frame [1:9])
+    except ValueError:
+        return None
+    if frame [0:1] == b'-':
+        result = -result
+    return result
+
+
+class ScaleReader:
+    """
+    Read the scale serial port continuously and detect when the weight has settled.
+
+    The readings are kept in a ring buffer as pairs of arrival time and weight.
+    """
+    def __init__ (self, port, log=None):
+        """
+        :param port: the serial port of the scale, it should be opened with a read timeout.
+        """
+        self.port = port
+        self.log = log if log is not None else print
+        self.readings = collections.deque (maxlen=HISTORY)
+        self.malformed = 0
+        self.condition = threading.Condition ()
+        self.error = None
+        self.worker = None
+
+    def start (self):
+        self.worker = threading.Thread (target=self.run, name='scale')
+        self.worker.daemon = True
+        self.worker.start ()
+        return None
+
+    def run (self):
+        buffer = bytearray ()
+        try:
+            while True:
+                data = self.port.read (max (1, self.port.in_waiting))
+                if not data:
+                    continue
+                now = time.time ()
+                buffer.extend (data)
+                frames = buffer.split (b'\n')
+                buffer = frames.pop ()
+                if len (buffer) > MAX_FRAME_SIZE:
+                    del buffer [:-MAX_FRAME_SIZE]
+                weights = []
+                for frame in frames:
+                    weight = parse_frame (bytes (frame.rstrip ()))
+                    if weight is None:
+                        self.malformed += 1
+                    else:
+                        weights.append (weight)
+                if weights:
+                    with self.condition:
+                        self.readings.extend ((now, weight) for weight in weights)
+                        self.condition.notify_all ()
+        except BaseException as ex:
+            with self.condition:
+                self.error = ex
+                self.condition.notify_all ()
+
+    def latest (self):
+        """
+        Return the last reading as a pair of arrival time and weight, or `None` if there is none.
+        """
+        with self.condition:
+            if self.readings:
+                return self.readings [-1]
+            return None
+
+    def wait_reading (self, since, timeout=None):
+        """
+        Wait for a reading that arrived after time `since`.
+
+        :return: the pair of arrival time and weight of the last reading, or `None` on timeout.
+        """
+        deadline = None if timeout is None else time.time () + timeout
+        with self.condition:
+            while not self.readings or self.readings [-1][0] <= since:
+                if not self.wait (deadline):
+                    return None
+            return self.readings [-1]
+
+    def settled_weight (self, count, tolerance, since=0, timeout=None):
+        """
+        Wait until the last `count` readings agree within `tolerance` grams.
+
+        :param since: only readings that arrived after this time are considered.
+        :param timeout: how many seconds to wait, by default wait forever.
+        :return: the mean of the readings, or `None` on timeout.
+        """
+        deadline = None if timeout is None else time.time () + timeout
+        with self.condition:
+            while True:
+                if len (self.readings) >= count and self.readings [-count][0] > since:
+                    weights = [weight for _, weight in list (self.readings) [-count:]]
+                    if max (weights) - min (weights) <= tolerance:
+                        return sum (weights) / len (weights)
+                if not self.wait (deadline):
+                    return None
+
+    def wait (self, deadline):
+        """
+        Wait for a new reading.  Must be called with the condition held.
+
+        :return: `False` if the deadline has passed.
+        """
+        if self.error is not None:
+            raise self.error
+        if deadline is None:
+            self.condition.wait ()
+        else:
+            remaining = deadline - time.time ()
+            if remaining <= 0:
+                return False
+            self.condition.wait (remaining)
+        if self.error is not None:
+            raise self.error
+        return True
+
+    def close (self):
+        self.port.close ()
+        return None
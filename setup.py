@@ -1,17 +1,22 @@
-#!/usr/bin/python
+#!/usr/bin/python3
 """
 Setups the environment for the plant weight water control system.
 
 There is folder where sound files, data and configuration files are placed.
-Sound files are created using the speech synthesiser `flite`.
+Sound files are created using the speech synthesiser `flite`, several at once, and only when their text
+changed.  The plant descriptions can be synthesised to the speech cache of the station.
 """
 
 import argparse
-import dropbox
+import concurrent.futures
+import hashlib
 import os
 import subprocess
 import yaml
 
+import experiment
+import storage
+import tts
 import water_plant
 
 
@@ -19,28 +24,20 @@ def main ():
     args = process_arguments ()
     if not os.path.exists (water_plant.DATA_FOLDER):
         os.makedirs (water_plant.DATA_FOLDER)
-    cfg = {
-        'token': args.token,
-    }
+    cfg = {}
+    if args.token is not None:
+        cfg ['token'] = args.token
+    if args.storage_folder is not None:
+        cfg ['storage'] = {
+            'type': 'local',
+            'folder': args.storage_folder,
+        }
     with open (water_plant.CONFIG_FILENAME, 'wt') as fd:
         yaml.safe_dump (cfg, fd)
-    create_sound_file ('Welcome to the plant weight water control system.', 'welcome-message.riff')
-    create_sound_file ('Uploaded file with plant weight and watering.', 'upload-watering.riff')
-    create_sound_file ('Attention! Could not upload file with plant weight and watering.', 'no-uploading-watering.riff')
-    create_sound_file ('Attention! Could not download pump data file.', 'no-download-pump-data.riff')
-    create_sound_file ('Downloaded file with experiment data', 'download-experiment-data.riff')
-    create_sound_file ('Attention! Could not download experiment data file.', 'no-download-experiment-data.riff')
-    create_sound_file ('Attention! Error parsing experiment data file.', 'error-parsing-experiment-data.riff')
-    create_sound_file ('Connect barcode scanner.', 'connect-barcode-scanner.riff')
-    create_sound_file ('Connect water pump.', 'connect-water-pump.riff')
-    create_sound_file ('Connect plant scale.', 'connect-plant-scale.riff')
-    create_sound_file ('Waiting for plant barcode...', 'waiting-barcode.riff')
-    create_sound_file ('Waiting for plant weight...', 'waiting-weight.riff')
-    create_sound_file ('Reseting watering file.', 'reset-watering.riff')
-    create_sound_file ('Invalid weight, please send a new weight.', 'invalid-weight.riff')
+    create_sound_files (water_plant.SOUND_PROMPTS, args.jobs, args.force)
     try:
-        dbx = dropbox.Dropbox (args.token)
-        dbx.files_download_to_file (water_plant.EXPERIMENT_DATA_FILENAME, '/experiment-data.csv')
+        remote = storage.open_storage (cfg)
+        remote.download (water_plant.REMOTE_EXPERIMENT_DATA_PATH, water_plant.EXPERIMENT_DATA_FILENAME)
     except BaseException as ex:
         print (ex)
     if os.path.exists (water_plant.WATERING_FILENAME):
@@ -51,19 +48,82 @@ def main ():
     if ok:
         with open (water_plant.WATERING_FILENAME, 'wt') as fd:
             fd.write ('"timestamp","plant id","plant current weight","plant desired weight","watered","motor speed","revolutions","water per 1 revolution"\n')
+    if args.plants:
+        create_plant_sound_files (args.jobs)
+
+
+def create_sound_files (prompts, jobs, force=False):
+    """
+    Create the sound files of the prompts whose text changed since they were last created.
+
+    The hash of the text of each sound file is kept in `SOUND_PROMPTS_FILENAME`.
+
+    :param prompts: list of (text, filename) pairs.
+    :param jobs: how many synthesisers run at once.
+    :param force: whether all the sound files are created.
+    """
+    hashes = {}
+    if os.path.exists (water_plant.SOUND_PROMPTS_FILENAME) and not force:
+        with open (water_plant.SOUND_PROMPTS_FILENAME, 'r') as fd:
+            hashes = yaml.safe_load (fd) or {}
+    missing = [
+        (text, filename)
+        for text, filename in prompts
+        if hashes.get (filename) != text_hash (text)
+        or not os.path.exists (os.path.join (water_plant.DATA_FOLDER, filename))
+    ]
+    print ('creating {} of {} sound files'.format (len (missing), len (prompts)))
+    with concurrent.futures.ThreadPoolExecutor (max_workers=jobs) as executor:
+        futures = [executor.submit (create_sound_file, text, filename) for text, filename in missing]
+        for (text, filename), future in zip (missing, futures):
+            if future.result ():
+                hashes [filename] = text_hash (text)
+            else:
+                print ('could not create sound file {}'.format (filename))
+    with open (water_plant.SOUND_PROMPTS_FILENAME, 'wt') as fd:
+        yaml.safe_dump (hashes, fd, default_flow_style=False)
+    return None
 
 
 def create_sound_file (text, filename):
+    """
+    :return: whether the synthesiser succeeded.
+    """
     command = [
         '/usr/bin/flite',
-        '-voice', 'slt',
+        '-voice', water_plant.VOICE,
         '-t', text,
         os.path.join (water_plant.DATA_FOLDER, filename)
     ]
     process = subprocess.Popen (
         command
     )
-    process.wait ()
+    return process.wait () == 0
+
+
+def text_hash (text):
+    digest = hashlib.sha1 ()
+    digest.update (water_plant.VOICE.encode ('utf-8'))
+    digest.update (b'\0')
+    digest.update (text.encode ('utf-8'))
+    return digest.hexdigest ()
+
+
+def create_plant_sound_files (jobs):
+    """
+    Synthesise the plant descriptions of the experiment data file to the speech cache, so that the station
+    does not synthesise them.
+    """
+    try:
+        plants = experiment.parse (water_plant.EXPERIMENT_DATA_FILENAME) [0]
+    except (IOError, experiment.ExperimentDataError) as ex:
+        print ('could not read the experiment data file: {}'.format (ex))
+        return None
+    cache = tts.SpeechCache (water_plant.SPEECH_CACHE_FOLDER, water_plant.SPEECH_CACHE_SIZE, voice=water_plant.VOICE)
+    cache.synthesise_all (
+        [water_plant.plant_code_text (code, plant) for code, plant in plants.items ()],
+        workers=jobs,
+    )
     return None
 
 
@@ -73,11 +133,42 @@ def process_arguments ():
         '-t',
         '--token',
         type=str,
-        required=True,
+        default=None,
         help='Dropbox token used to download plant barcodes and upload plant weight readings',
         metavar='N'
         )
-    return parser.parse_args ()
+    parser.add_argument (
+        '-s',
+        '--storage-folder',
+        type=str,
+        default=None,
+        help='folder, such as a network file system mount, used instead of dropbox to download plant barcodes and upload plant weight readings',
+        metavar='FOLDER'
+        )
+    parser.add_argument (
+        '-j',
+        '--jobs',
+        type=int,
+        default=os.cpu_count () or 1,
+        help='how many sound files are synthesised at once, by default the number of processors',
+        metavar='N'
+        )
+    parser.add_argument (
+        '-f',
+        '--force',
+        action='store_true',
+        help='create all the sound files, even those whose text did not change'
+        )
+    parser.add_argument (
+        '-p',
+        '--plants',
+        action='store_true',
+        help='synthesise the plant descriptions of the experiment data file to the speech cache'
+        )
+    result = parser.parse_args ()
+    if result.token is None and result.storage_folder is None:
+        parser.error ('either a dropbox token or a storage folder is required')
+    return result
 
 
 if __name__ == '__main__':
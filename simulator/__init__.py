@@ -0,0 +1,12 @@
+"""
+Simulator of the devices of a watering station.
+
+The simulator creates a scale and a Masterflex pump on pseudo terminals and a barcode scanner on a named
+pipe, and links them in a folder:
+
+    python -m simulator --folder /tmp/bench --config /tmp/bench/config.txt
+
+The `stations` section of the configuration file is set to the simulated devices, so that `water_plant`
+runs against them.  A simulated operator scans the plants, places them on the scale and moves them to
+the pump.  The water given by the pump is added to the weight of the plant.
+"""
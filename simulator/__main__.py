@@ -0,0 +1,175 @@
+"""
+Run a simulated watering station.
+"""
+
+import argparse
+import os
+import time
+import yaml
+
+import experiment
+import water_plant
+
+from simulator import bench
+
+
+def main ():
+    args = process_arguments ()
+    plants = experiment.parse (args.experiment_data) [0]
+    station = bench.SimulatedStation (
+        args.folder,
+        plants,
+        deficit=args.deficit,
+        noise=args.noise,
+        settling_time=args.settling_time,
+        water_per_1_revolution=args.water_per_1_revolution,
+        closed_loop=args.closed_loop,
+    )
+    if args.config is not None:
+        update_config (args.config, station.devices)
+    station.start ()
+    print ('simulated devices are in {}'.format (args.folder))
+    time.sleep (args.start_delay)
+    station.operate (
+        args.codes if args.codes else list (plants) * args.cycles,
+        scan_time=args.scan_time,
+        hold_time=args.hold_time,
+        interval=args.interval,
+        stop_code=water_plant.STOP_CODE if args.stop else None,
+        tray=(water_plant.TRAY_START_CODE, water_plant.TRAY_END_CODE) if args.tray else None,
+    )
+    for plant_id in sorted (station.weights):
+        print ('plant {} weighs {:.2f}g, desired weight {:.2f}g'.format (
+            plant_id, station.weights [plant_id], plants [plant_id].weight))
+    print ('the pump answered {} commands'.format (station.pump.commands))
+    return None
+
+
+def update_config (filename, station):
+    """
+    Set the stations in the configuration file to the simulated station.
+    """
+    config = {}
+    if os.path.exists (filename):
+        with open (filename, 'r') as fd:
+            config = yaml.safe_load (fd) or {}
+    config ['stations'] = [station]
+    with open (filename, 'wt') as fd:
+        yaml.safe_dump (config, fd, default_flow_style=False)
+    return None
+
+
+def process_arguments ():
+    parser = argparse.ArgumentParser (
+        description='Simulate the scale, pump and barcode scanner of a watering station'
+    )
+    parser.add_argument (
+        'codes',
+        nargs='*',
+        help='plant codes scanned by the operator, by default all the plants in the experiment data file',
+        metavar='CODE'
+        )
+    parser.add_argument (
+        '--folder',
+        type=str,
+        default='/tmp/water-weight-control-simulator',
+        help='folder where the simulated devices are created',
+        metavar='FOLDER'
+        )
+    parser.add_argument (
+        '--config',
+        type=str,
+        default=None,
+        help='configuration file whose stations are set to the simulated devices',
+        metavar='FILE'
+        )
+    parser.add_argument (
+        '--experiment-data',
+        type=str,
+        default=water_plant.EXPERIMENT_DATA_FILENAME,
+        help='experiment data file with the plants',
+        metavar='FILE'
+        )
+    parser.add_argument (
+        '--cycles',
+        type=int,
+        default=1,
+        help='how many times each plant is scanned',
+        metavar='N'
+        )
+    parser.add_argument (
+        '--deficit',
+        type=float,
+        default=50.0,
+        help='maximum grams of water missing from a plant at the start',
+        metavar='GRAMS'
+        )
+    parser.add_argument (
+        '--noise',
+        type=float,
+        default=0.1,
+        help='standard deviation of the scale readings in grams',
+        metavar='GRAMS'
+        )
+    parser.add_argument (
+        '--settling-time',
+        type=float,
+        default=1.0,
+        help='seconds for the scale reading to settle after a plant is placed',
+        metavar='SECONDS'
+        )
+    parser.add_argument (
+        '--water-per-1-revolution',
+        type=float,
+        default=water_plant.WATER_PER_1_REVOLUTION,
+        help='grams of water of one revolution of the simulated pump',
+        metavar='GRAMS'
+        )
+    parser.add_argument (
+        '--start-delay',
+        type=float,
+        default=5.0,
+        help='seconds before the first plant is scanned',
+        metavar='SECONDS'
+        )
+    parser.add_argument (
+        '--scan-time',
+        type=float,
+        default=1.0,
+        help='seconds between scanning a plant and placing it on the scale',
+        metavar='SECONDS'
+        )
+    parser.add_argument (
+        '--hold-time',
+        type=float,
+        default=3.0,
+        help='seconds a plant stays on the scale',
+        metavar='SECONDS'
+        )
+    parser.add_argument (
+        '--interval',
+        type=float,
+        default=1.0,
+        help='seconds between removing a plant from the scale and scanning the next one',
+        metavar='SECONDS'
+        )
+    parser.add_argument (
+        '--closed-loop',
+        action='store_true',
+        help='the plants are watered on the scale'
+        )
+    parser.add_argument (
+        '--tray',
+        action='store_true',
+        help='scan all the plants as a tray before placing them on the scale'
+        )
+    parser.add_argument (
+        '--stop',
+        action='store_true',
+        help='scan the stop code after the last plant'
+        )
+    return parser.parse_args ()
+
+
+if __name__ == '__main__':
+    main ()
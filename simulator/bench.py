@@ -0,0 +1,202 @@
+"""
+Simulated station bench: the devices, the plants and the operator.
+"""
+
+import collections
+import os
+import random
+import threading
+import time
+import tty
+
+from simulator import pump
+from simulator import scale
+from simulator import scanner
+
+
+class Bench:
+    """
+    The plants of the simulated station: the one on the scale, the ones waiting to be watered and the one
+    being watered.
+    """
+    def __init__ (self, plant_scale, weights, closed_loop):
+        self.scale = plant_scale
+        self.weights = weights
+        self.closed_loop = closed_loop
+        self.lock = threading.Lock ()
+        self.on_scale = None
+        self.waiting = collections.deque ()
+        self.watering = None
+        # number of pump runs started
+        self.runs = 0
+
+    def place (self, plant_id):
+        with self.lock:
+            self.on_scale = plant_id
+            self.scale.place (self.weights [plant_id])
+        return None
+
+    def remove (self):
+        with self.lock:
+            if not self.closed_loop:
+                self.waiting.append (self.on_scale)
+            self.on_scale = None
+            self.scale.remove ()
+        return None
+
+    def start_pump (self):
+        """
+        Called when the pump is started, the plant on the scale or the next plant waiting is watered.
+        """
+        with self.lock:
+            self.runs += 1
+            if self.closed_loop:
+                self.watering = self.on_scale
+            elif self.waiting:
+                self.watering = self.waiting.popleft ()
+        return None
+
+    def water (self, weight):
+        with self.lock:
+            if self.watering is None:
+                return None
+            self.weights [self.watering] += weight
+            if self.watering == self.on_scale:
+                self.scale.add (weight)
+        return None
+
+
+class SimulatedStation:
+    """
+    Create the simulated devices of a station in a folder.
+
+    The scale and the pump are pseudo terminals linked as `scale` and `pump`, and the scanner is the named
+    pipe `scanner`.
+    """
+    def __init__ (self, folder, plants, deficit=50.0, noise=0.1, settling_time=1.0, water_per_1_revolution=0.85,
+                  closed_loop=False, speedup=1.0):
+        """
+        :param plants: mapping from plant ids to plants with the desired weight.
+        :param deficit: maximum grams of water missing from a plant at the start.
+        :param speedup: how many times faster than the motor speed the pump turns.
+        """
+        os.makedirs (folder, exist_ok=True)
+        self.devices = {
+            'name': 'simulator',
+            'scanner': os.path.join (folder, 'scanner'),
+            'scale': os.path.join (folder, 'scale'),
+            'pump': os.path.join (folder, 'pump'),
+        }
+        scale_master = open_pty (self.devices ['scale'])
+        pump_master = open_pty (self.devices ['pump'])
+        os.set_blocking (pump_master, True)
+        self.scanner = scanner.ScannerSimulator (self.devices ['scanner'])
+        self.plants = plants
+        self.weights = {
+            plant_id: plants [plant_id].weight - random.uniform (0, deficit)
+            for plant_id in plants
+        }
+        self.scale = scale.ScaleSimulator (scale_master, noise=noise, settling_time=settling_time)
+        self.bench = Bench (self.scale, self.weights, closed_loop)
+        self.pump = pump.PumpSimulator (
+            pump_master, water_per_1_revolution, on_start=self.bench.start_pump, on_water=self.bench.water,
+            speedup=speedup)
+        # time when each plant was scanned and placed on the scale, in order
+        self.scans = []
+        self.placements = []
+        # released by `confirm_weighing`
+        self.weighings = threading.Semaphore (0)
+
+    def start (self):
+        self.scale.start ()
+        self.pump.start ()
+        return None
+
+    def confirm_weighing (self):
+        """
+        Tell the operator that the plant on the scale has been weighed.
+        """
+        self.weighings.release ()
+        return None
+
+    def operate (self, codes, scan_time=1.0, hold_time=3.0, interval=1.0, stop_code=None, tray=None,
+                 confirmed=False):
+        """
+        Scan the plants, place them on the scale and move them to the pump.
+
+        In closed loop, a plant stays on the scale until the pump has watered it, and `hold_time` seconds
+        more for the weight to settle.
+
+        :param stop_code: scanned after the last plant, and then the function waits for the plants to be
+        watered.
+        :param tray: pair of tray start and end codes.  If given, all the plants are scanned first, between
+        these codes, and then they are placed on the scale in order.
+        :param confirmed: whether a plant stays on the scale until `confirm_weighing` is called, as an
+        operator waiting for the station.
+        """
+        if tray is not None:
+            self.scanner.scan (tray [0])
+            for plant_id in codes:
+                time.sleep (scan_time)
+                self.scans.append ((plant_id, time.time ()))
+                self.scanner.scan (plant_id)
+            time.sleep (scan_time)
+            self.scanner.scan (tray [1])
+        for plant_id in codes:
+            if tray is None:
+                self.scans.append ((plant_id, time.time ()))
+                self.scanner.scan (plant_id)
+            if plant_id in self.weights:
+                time.sleep (scan_time)
+                self.placements.append ((plant_id, time.time ()))
+                runs = self.bench.runs
+                self.bench.place (plant_id)
+                time.sleep (hold_time)
+                if confirmed:
+                    self.weighings.acquire (timeout=60)
+                if self.bench.closed_loop:
+                    self.wait_watered (runs)
+                self.bench.remove ()
+            time.sleep (interval)
+        if stop_code is not None:
+            self.scanner.scan (stop_code)
+            # wait for the last plants to be watered
+            deadline = time.time () + 60
+            time.sleep (1)
+            while (self.bench.waiting or self.pump.running) and time.time () < deadline:
+                time.sleep (0.1)
+        return None
+
+    def wait_watered (self, runs, timeout=60):
+        """
+        Wait until a pump run after the first `runs` has finished, and the weight has settled.
+        """
+        deadline = time.time () + timeout
+        while (self.bench.runs == runs or self.pump.running) and time.time () < deadline:
+            time.sleep (0.1)
+        if self.bench.runs > runs:
+            time.sleep (self.scale.settling_time + 1)
+        return None
+
+    def close (self):
+        self.scale.close ()
+        self.pump.close ()
+        self.scanner.close ()
+        return None
+
+
+def open_pty (link):
+    """
+    Open a pseudo terminal in raw mode and link its slave side.
+
+    The slave side is kept open, so that the master side does not fail when the station closes the device.
+
+    :return: the master file descriptor.
+    """
+    master, slave = os.openpty ()
+    tty.setraw (slave)
+    os.set_blocking (master, False)
+    if os.path.lexists (link):
+        os.remove (link)
+    os.symlink (os.ttyname (slave), link)
+    return master
@@ -0,0 +1,127 @@
+"""
+Simulated Masterflex pump.
+
+The pump answers the commands of the serial protocol used by the `pump` module: ENQ, the pump number
+assignment, `S` (speed), `V` (revolutions), `G` (go), `H` (halt) and `E` (revolutions remaining).  While
+it runs, the water pumped is reported to a callback.
+"""
+
+import errno
+import os
+import select
+import threading
+import time
+
+import pump
+
+# seconds between two updates of the revolutions while the pump runs
+PERIOD = 0.1
+
+
+class PumpSimulator:
+    def __init__ (self, fd, water_per_1_revolution, on_start=None, on_water=None, latency=0.01, speedup=1.0):
+        """
+        :param fd: the master side of the pseudo terminal of the pump.
+        :param on_start: function called when the pump is started.
+        :param on_water: function called with the grams of water pumped.
+        :param latency: seconds the pump takes to answer a command.
+        :param speedup: how many times faster than the motor speed the pump turns.
+        """
+        self.fd = fd
+        self.water_per_1_revolution = water_per_1_revolution
+        self.on_start = on_start if on_start is not None else (lambda: None)
+        self.on_water = on_water if on_water is not None else (lambda water: None)
+        self.latency = latency
+        self.speedup = speedup
+        self.speed = 0.0
+        self.revolutions = 0.0
+        self.remaining = 0.0
+        self.running = False
+        self.commands = 0
+        self.closed = False
+        self.worker = None
+
+    def start (self):
+        self.worker = threading.Thread (target=self.run, name='pump-simulator')
+        self.worker.daemon = True
+        self.worker.start ()
+        return None
+
+    def run (self):
+        buffer = bytearray ()
+        last = time.time ()
+        while not self.closed:
+            ready, _, _ = select.select ([self.fd], [], [], PERIOD)
+            now = time.time ()
+            self.turn (now - last)
+            last = now
+            if not ready:
+                continue
+            try:
+                data = os.read (self.fd, 1024)
+            except OSError as ex:
+                # the pump serial port is not open
+                if ex.errno != errno.EIO:
+                    raise
+                time.sleep (PERIOD)
+                continue
+            buffer.extend (data)
+            replies = []
+            while buffer:
+                if buffer [0:1] == pump.ENQ:
+                    del buffer [0]
+                    replies.append (pump.STX + b'P?' + pump.CR)
+                elif buffer [0:1] == pump.STX:
+                    end = buffer.find (pump.CR)
+                    if end < 0:
+                        break
+                    replies.append (self.execute (bytes (buffer [1:end]).decode ('ascii')))
+                    del buffer [:end + 1]
+                else:
+                    del buffer [0]
+            if replies:
+                time.sleep (self.latency)
+                os.write (self.fd, b''.join (replies))
+
+    def turn (self, elapsed):
+        if not self.running:
+            return None
+        revolutions = min (self.remaining, self.speed * self.speedup * elapsed / 60.0)
+        self.remaining -= revolutions
+        if self.remaining <= 0:
+            self.remaining = 0.0
+            self.running = False
+        if revolutions > 0:
+            self.on_water (revolutions * self.water_per_1_revolution)
+        return None
+
+    def execute (self, frame):
+        """
+        Execute a command frame `Pnn<command>` and return the reply.
+        """
+        self.commands += 1
+        command = frame [3:]
+        try:
+            if command == '':
+                pass
+            elif command.startswith ('S'):
+                self.speed = abs (float (command [1:]))
+            elif command.startswith ('V'):
+                self.revolutions = float (command [1:])
+            elif command == 'G':
+                self.remaining = self.revolutions
+                self.running = True
+                self.on_start ()
+            elif command == 'H':
+                self.running = False
+            elif command == 'E':
+                return pump.STX + '{}E{:08.2f}'.format (frame [:3], self.remaining).encode ('ascii') + pump.CR
+            else:
+                return pump.NAK
+        except ValueError:
+            return pump.NAK
+        return pump.ACK
+
+    def close (self):
+        self.closed = True
+        return None
@@ -0,0 +1,73 @@
+"""
+Simulated scale.
+
+The scale sends a frame with the weight every `PERIOD` seconds.  When a pot is placed or removed the
+weight approaches the new value exponentially, and gaussian noise is added to every reading.
+"""
+
+import errno
+import math
+import os
+import random
+import threading
+import time
+
+# seconds between two frames
+PERIOD = 0.1
+
+
+class ScaleSimulator:
+    def __init__ (self, fd, noise=0.1, settling_time=1.0):
+        """
+        :param fd: the master side of the pseudo terminal of the scale.
+        :param noise: the standard deviation of the readings in grams.
+        :param settling_time: seconds until the weight is within 2% of a new value.
+        """
+        self.fd = fd
+        self.noise = noise
+        self.settling_time = settling_time
+        self.lock = threading.Lock ()
+        self.weight = 0.0
+        self.target = 0.0
+        self.closed = False
+        self.worker = None
+
+    def start (self):
+        self.worker = threading.Thread (target=self.run, name='scale-simulator')
+        self.worker.daemon = True
+        self.worker.start ()
+        return None
+
+    def place (self, weight):
+        with self.lock:
+            self.target = weight
+        return None
+
+    def remove (self):
+        self.place (0.0)
+        return None
+
+    def add (self, weight):
+        with self.lock:
+            self.target += weight
+        return None
+
+    def run (self):
+        # four time constants bring the weight within 2% of the target
+        decay = math.exp (-4.0 * PERIOD / self.settling_time) if self.settling_time > 0 else 0.0
+        while not self.closed:
+            with self.lock:
+                self.weight = self.target + (self.weight - self.target) * decay
+                reading = self.weight + random.gauss (0, self.noise)
+            frame = '{}{:8.2f} g\r\n'.format ('-' if reading < 0 else ' ', abs (reading))
+            try:
+                os.write (self.fd, frame.encode ('ascii'))
+            except OSError as ex:
+                # nobody is reading the scale
+                if ex.errno not in (errno.EAGAIN, errno.EIO):
+                    raise
+            time.sleep (PERIOD)
+
+    def close (self):
+        self.closed = True
+        return None
@@ -0,0 +1,43 @@
+"""
+Simulated barcode scanner.
+
+A scanned barcode is written to a named pipe as the HID keyboard reports of the scanner: one report per
+pressed key, followed by a report with no keys, and the enter key at the end.
+"""
+
+import os
+
+import barcode
+
+REPORT_SIZE = barcode.REPORT_SIZE
+
+
+def key_report (character):
+    if character in barcode.PLAIN_KEYS:
+        return bytes ([0, 0, barcode.PLAIN_KEYS.index (character), 0, 0, 0, 0, 0])
+    if character in barcode.SHIFTED_KEYS:
+        return bytes ([0x02, 0, barcode.SHIFTED_KEYS.index (character), 0, 0, 0, 0, 0])
+    raise ValueError ('character [{}] has no key'.format (character))
+
+
+class ScannerSimulator:
+    def __init__ (self, filename):
+        """
+        :param filename: the named pipe read by the barcode reader, it is created if it does not exist.
+        """
+        if not os.path.exists (filename):
+            os.mkfifo (filename)
+        self.filename = filename
+        # opened for reading and writing, so that opening does not wait for the reader
+        self.fd = os.open (filename, os.O_RDWR)
+
+    def scan (self, code):
+        release = bytes (REPORT_SIZE)
+        reports = [key_report (character) + release for character in code]
+        reports.append (bytes ([0, 0, barcode.ENTER, 0, 0, 0, 0, 0]) + release)
+        os.write (self.fd, b''.join (reports))
+        return None
+
+    def close (self):
+        os.close (self.fd)
+        return None
@@ -0,0 +1,280 @@
+"""
+Remote storage of the data files.
+
+The experiment data and pump data files are downloaded from, and the watering file uploaded to, a remote
+storage.  Two backends are available, selected by the `storage` section of the configuration file:
+
+    storage:
+      type: local
+      folder: /mnt/greenhouse/water-weight-control
+
+* `dropbox`, the default, uses the dropbox account of the `token` in the configuration file, and needs
+  the dropbox package;
+* `local` keeps the files in a folder, such as an NFS mount on the local network or a plain folder to
+  test the station without a network connection.
+
+Files are read and written as streams of chunks, so large files are never held in memory at once.  The
+backends keep their connection for all the transfers, and report the duration and size of every transfer
+to a callback.
+"""
+
+import hashlib
+import os
+import os.path
+import time
+
+# size of the chunks read and written, and of the chunks sent in a dropbox upload session
+CHUNK_SIZE = 4 * 1024 * 1024
+# size of the blocks of the dropbox content hash
+HASH_BLOCK_SIZE = 4 * 1024 * 1024
+
+
+class StorageError (Exception):
+    pass
+
+
+def content_hash (filename):
+    """
+    Compute the dropbox content hash of a local file.
+
+    The hash is the SHA-256 of the concatenation of the SHA-256 of each 4 MB block of the file.  The local
+    backend uses the same hash, so files are compared the same way with both backends.
+    """
+    result = hashlib.sha256 ()
+    with open (filename, 'rb') as fd:
+        while True:
+            block = fd.read (HASH_BLOCK_SIZE)
+            if not block:
+                break
+            result.update (hashlib.sha256 (block).digest ())
+    return result.hexdigest ()
+
+
+def open_storage (cfg, log=None, on_transfer=None):
+    """
+    Return the storage backend given in the configuration.
+
+    :param cfg: the configuration file contents.
+    :param on_transfer: see `Storage`.
+    :raise StorageError: if the storage section is invalid.
+    """
+    section = cfg.get ('storage') or {}
+    kind = section.get ('type', 'dropbox')
+    if kind == 'dropbox':
+        if not cfg.get ('token'):
+            raise StorageError ('the dropbox storage needs a token')
+        return DropboxStorage (cfg ['token'], log=log, on_transfer=on_transfer)
+    if kind == 'local':
+        if not section.get ('folder'):
+            raise StorageError ('the local storage needs a folder')
+        return LocalStorage (section ['folder'], log=log, on_transfer=on_transfer)
+    raise StorageError ('unknown storage type [{}]'.format (kind))
+
+
+class Storage:
+    """
+    A remote storage.  Paths are absolute, as `/watering/0001/000000000000.csv`.
+
+    Backends implement `read_chunks`, `write_chunks` and `remote_hash`.
+    """
+    kind = None
+
+    def __init__ (self, log=None, on_transfer=None):
+        """
+        :param on_transfer: function called after each transfer with the operation (`read`, `write` or
+        `hash`), the path, the number of bytes and the seconds it took.
+        """
+        self.log = log if log is not None else print
+        self.on_transfer = on_transfer if on_transfer is not None else (lambda operation, path, size, seconds: None)
+
+    def read (self, path):
+        """
+        Return an iterator over the chunks of a remote file.
+        """
+        start = time.time ()
+        size = 0
+        for chunk in self.read_chunks (path):
+            size += len (chunk)
+            yield chunk
+        self.on_transfer ('read', path, size, time.time () - start)
+
+    def write (self, path, content):
+        """
+        Write a remote file, replacing it if it exists.
+
+        :param content: the bytes of the file or an iterable over its chunks.
+        :return: the number of bytes written.
+        """
+        if isinstance (content, (bytes, bytearray)):
+            content = [content]
+        counted = Counted (content)
+        start = time.time ()
+        self.write_chunks (path, counted)
+        self.on_transfer ('write', path, counted.size, time.time () - start)
+        return counted.size
+
+    def content_hash (self, path):
+        """
+        Return the dropbox content hash of a remote file.
+        """
+        start = time.time ()
+        result = self.remote_hash (path)
+        self.on_transfer ('hash', path, 0, time.time () - start)
+        return result
+
+    def download (self, path, filename):
+        """
+        Download a remote file to a local file.  The file is written to a temporary file that is renamed,
+        so that a partially downloaded file is never seen.
+
+        :return: the number of bytes downloaded.
+        """
+        temporary = filename + '.download'
+        size = 0
+        try:
+            with open (temporary, 'wb') as fd:
+                for chunk in self.read (path):
+                    fd.write (chunk)
+                    size += len (chunk)
+            os.rename (temporary, filename)
+        finally:
+            if os.path.exists (temporary):
+                os.remove (temporary)
+        return size
+
+    def upload (self, filename, path):
+        """
+        Upload a local file.
+
+        :return: the number of bytes uploaded.
+        """
+        with open (filename, 'rb') as fd:
+            return self.write (path, iter (lambda: fd.read (CHUNK_SIZE), b''))
+
+
+class Counted:
+    """
+    Iterate over chunks counting their bytes.
+    """
+    def __init__ (self, chunks):
+        self.chunks = chunks
+        self.size = 0
+
+    def __iter__ (self):
+        for chunk in self.chunks:
+            self.size += len (chunk)
+            yield chunk
+
+
+class DropboxStorage (Storage):
+    """
+    Files in a dropbox account.  One client is used for all the transfers, so its connections are reused.
+    """
+    kind = 'dropbox'
+
+    def __init__ (self, token, log=None, on_transfer=None):
+        # only this backend needs the dropbox package
+        import dropbox
+        Storage.__init__ (self, log=log, on_transfer=on_transfer)
+        self.dropbox = dropbox
+        self.client = dropbox.Dropbox (token)
+
+    def read_chunks (self, path):
+        _, response = self.client.files_download (path)
+        try:
+            for chunk in response.iter_content (CHUNK_SIZE):
+                yield chunk
+        finally:
+            response.close ()
+
+    def write_chunks (self, path, chunks):
+        """
+        Files up to `CHUNK_SIZE` bytes are sent in one request, larger files in an upload session.
+
+        The chunks are cut into blocks through a `memoryview`, so each byte is copied once into its block
+        whatever the size of the chunks.
+        """
+        mode = self.dropbox.files.WriteMode.overwrite
+        block = bytearray ()
+        cursor = None
+        for chunk in chunks:
+            view = memoryview (chunk)
+            offset = 0
+            while offset < len (view):
+                # a full block is only sent once more data follows, the last block finishes the upload
+                if len (block) == CHUNK_SIZE:
+                    cursor = self.append_block (bytes (block), cursor)
+                    block = bytearray ()
+                size = min (CHUNK_SIZE - len (block), len (view) - offset)
+                block += view [offset:offset + size]
+                offset += size
+        if cursor is None:
+            self.client.files_upload (bytes (block), path, mode=mode)
+        else:
+            self.client.files_upload_session_finish (
+                bytes (block), cursor, self.dropbox.files.CommitInfo (path, mode=mode))
+        return None
+
+    def append_block (self, block, cursor):
+        """
+        Send a block of an upload session, starting the session with the first block.
+
+        :return: the cursor of the session after the block.
+        """
+        if cursor is None:
+            session = self.client.files_upload_session_start (block)
+            cursor = self.dropbox.files.UploadSessionCursor (session.session_id, 0)
+        else:
+            self.client.files_upload_session_append_v2 (block, cursor)
+        cursor.offset += len (block)
+        return cursor
+
+    def remote_hash (self, path):
+        return self.client.files_get_metadata (path).content_hash
+
+
+class LocalStorage (Storage):
+    """
+    Files in a local folder, which may be a network file system mount.
+    """
+    kind = 'local'
+
+    def __init__ (self, folder, log=None, on_transfer=None):
+        Storage.__init__ (self, log=log, on_transfer=on_transfer)
+        self.folder = folder
+
+    def local_path (self, path):
+        return os.path.join (self.folder, path.lstrip ('/'))
+
+    def read_chunks (self, path):
+        with open (self.local_path (path), 'rb') as fd:
+            while True:
+                chunk = fd.read (CHUNK_SIZE)
+                if not chunk:
+                    return
+                yield chunk
+
+    def write_chunks (self, path, chunks):
+        """
+        The file is written to a temporary file that is renamed, so that readers of the folder never see a
+        partially written file.
+        """
+        filename = self.local_path (path)
+        folder = os.path.dirname (filename)
+        if not os.path.exists (folder):
+            os.makedirs (folder)
+        temporary = filename + '.tmp'
+        try:
+            with open (temporary, 'wb') as fd:
+                for chunk in chunks:
+                    fd.write (chunk)
+                fd.flush ()
+                os.fsync (fd.fileno ())
+            os.rename (temporary, filename)
+        finally:
+            if os.path.exists (temporary):
+                os.remove (temporary)
+        return None
+
+    def remote_hash (self, path):
+        return content_hash (self.local_path (path))
@@ -0,0 +1,141 @@
+"""
+Indexed local store of the plant weights and waterings.
+
+The events are kept in a SQLite database next to the watering file.  Besides the event table, indexed by
+plant, a summary table has the last weight and the total water of each plant in the current session, so
+they can be queried in constant time when a plant is scanned.  Resetting the store starts a new session
+instead of deleting the events.
+"""
+
+import sqlite3
+import threading
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS session (
+    id INTEGER PRIMARY KEY,
+    started TEXT NOT NULL,
+    archive TEXT
+);
+CREATE TABLE IF NOT EXISTS event (
+    id INTEGER PRIMARY KEY,
+    session INTEGER NOT NULL,
+    timestamp TEXT NOT NULL,
+    plant TEXT NOT NULL,
+    current_weight REAL NOT NULL,
+    desired_weight REAL NOT NULL,
+    watered INTEGER NOT NULL,
+    motor_speed REAL,
+    revolutions REAL,
+    water_per_1_revolution REAL
+);
+CREATE INDEX IF NOT EXISTS event_plant ON event (plant, id);
+CREATE TABLE IF NOT EXISTS plant (
+    plant TEXT PRIMARY KEY,
+    last_timestamp TEXT NOT NULL,
+    last_weight REAL NOT NULL,
+    total_water REAL NOT NULL,
+    waterings INTEGER NOT NULL
+);
+"""
+
+CSV_HEADER = '"timestamp","plant id","plant current weight","plant desired weight","watered","motor speed",' \
+             '"revolutions","water per 1 revolution"\n'
+
+
+class PlantHistory:
+    __slots__ = ('last_timestamp', 'last_weight', 'total_water', 'waterings')
+
+    def __init__ (self, last_timestamp, last_weight, total_water, waterings):
+        self.last_timestamp = last_timestamp
+        self.last_weight = last_weight
+        self.total_water = total_water
+        self.waterings = waterings
+
+
+class WateringStore:
+    def __init__ (self, filename):
+        self.lock = threading.Lock ()
+        self.connection = sqlite3.connect (filename, check_same_thread=False)
+        self.connection.execute ('PRAGMA journal_mode=WAL')
+        self.connection.execute ('PRAGMA synchronous=FULL')
+        with self.connection:
+            self.connection.executescript (SCHEMA)
+            self.session = self.connection.execute ('SELECT MAX (id) FROM session').fetchone () [0]
+        if self.session is None:
+            self.new_session (None, None)
+
+    def new_session (self, timestamp, archive):
+        """
+        Start a new session, the plant summaries are cleared.
+
+        :param archive: the name of the file where the watering file of the previous session was archived.
+        """
+        with self.lock, self.connection:
+            cursor = self.connection.execute ('INSERT INTO session (started) VALUES (?)', (timestamp or '',))
+            if self.session is not None:
+                self.connection.execute ('UPDATE session SET archive = ? WHERE id = ?', (archive, self.session))
+            self.connection.execute ('DELETE FROM plant')
+            self.session = cursor.lastrowid
+        return None
+
+    def record (self, timestamp, plant_id, current_weight, desired_weight, motor_speed=None, revolutions=None,
+                water_per_1_revolution=None):
+        """
+        Record a plant weight and, if `revolutions` is given, a watering.
+        """
+        watered = revolutions is not None
+        water = float (revolutions) * water_per_1_revolution if watered else 0.0
+        with self.lock, self.connection:
+            self.connection.execute (
+                'INSERT INTO event (session, timestamp, plant, current_weight, desired_weight, watered,'
+                ' motor_speed, revolutions, water_per_1_revolution) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (self.session, timestamp, plant_id, current_weight, desired_weight, int (watered),
+                 motor_speed, None if revolutions is None else float (revolutions), water_per_1_revolution))
+            self.connection.execute (
+                'INSERT OR IGNORE INTO plant VALUES (?, ?, ?, 0, 0)',
+                (plant_id, timestamp, current_weight))
+            self.connection.execute (
+                'UPDATE plant SET last_timestamp = ?, last_weight = ?, total_water = total_water + ?,'
+                ' waterings = waterings + ? WHERE plant = ?',
+                (timestamp, current_weight, water, int (watered), plant_id))
+        return None
+
+    def history (self, plant_id):
+        """
+        Return the `PlantHistory` of a plant in the current session or `None` if it was not weighed.
+        """
+        with self.lock:
+            row = self.connection.execute (
+                'SELECT last_timestamp, last_weight, total_water, waterings FROM plant WHERE plant = ?',
+                (plant_id,)).fetchone ()
+        return None if row is None else PlantHistory (*row)
+
+    def events (self, plant_id):
+        """
+        Return the events of a plant in all sessions, as tuples with the watering file columns.
+        """
+        with self.lock:
+            return self.connection.execute (
+                'SELECT timestamp, plant, current_weight, desired_weight, watered, motor_speed, revolutions,'
+                ' water_per_1_revolution FROM event WHERE plant = ? ORDER BY id',
+                (plant_id,)).fetchall ()
+
+    def export_csv (self, filename, session=None):
+        """
+        Write the events of a session, by default the current one, in the watering file format.
+        """
+        with self.lock:
+            rows = self.connection.execute (
+                'SELECT timestamp, plant, current_weight, desired_weight, watered, motor_speed, revolutions,'
+                ' water_per_1_revolution FROM event WHERE session = ? ORDER BY id',
+                (self.session if session is None else session,)).fetchall ()
+        with open (filename, 'wt') as fd:
+            fd.write (CSV_HEADER)
+            for row in rows:
+                fd.write ('"{}",{}\n'.format (row [0], ','.join ('' if value is None else str (value) for value in row [1:])))
+        return None
+
+    def close (self):
+        with self.lock:
+            self.connection.close ()
+        return None
@@ -0,0 +1,153 @@
+"""
+Synchronisation of the data files with the remote storage.
+
+Files are downloaded only if the content hash in the remote metadata differs from the hash of the local
+copy.
+
+The watering file only grows, so instead of uploading the whole file, the rows added since the last upload
+are sent as a new segment file.  The segments of a watering file are placed in a remote folder and named
+after the byte offset of their first row, so concatenating them in name order gives the watering file.
+
+The number of bytes already uploaded and the last uploaded bytes are kept in a YAML state file.  If the
+watering file no longer has these bytes at that offset, it was reset, and a new generation of segments is
+started in another remote folder.
+"""
+
+import os
+import os.path
+import threading
+import yaml
+
+import storage
+
+# maximum size of a segment
+MAX_SEGMENT_SIZE = 64 * 1024 * 1024
+# number of uploaded bytes compared to detect a reset of the watering file
+TAIL_SIZE = 64
+# seconds between uploads
+PERIOD = 60
+# seconds to wait after the first failure, doubled after each consecutive failure up to `MAX_BACKOFF`
+BACKOFF = 5
+MAX_BACKOFF = 600
+
+
+def download_if_changed (remote, filename, path):
+    """
+    Download a remote file unless the local copy has the same content.
+
+    :param remote: a `storage.Storage`.
+    :param filename: the local filename.
+    :param path: the remote path.
+    :return: `True` if the file was downloaded.
+    """
+    if os.path.exists (filename) and storage.content_hash (filename) == remote.content_hash (path):
+        return False
+    remote.download (path, filename)
+    return True
+
+
+class WateringSync:
+    """
+    Upload the new rows of the watering file in a background thread.
+
+    :param remote: the `storage.Storage` the segments are written to.
+    """
+    def __init__ (self, remote, filename, state_filename, remote_folder, log=None):
+        self.remote = remote
+        self.filename = filename
+        self.state_filename = state_filename
+        self.remote_folder = remote_folder
+        self.log = log if log is not None else print
+        self.lock = threading.Lock ()
+        self.wake = threading.Event ()
+        self.stopping = False
+        self.failures = 0
+        self.worker = None
+        self.state = {
+            'generation': 0,
+            'offset': 0,
+            'tail': b'',
+        }
+        if os.path.exists (state_filename):
+            with open (state_filename, 'r') as fd:
+                self.state.update (yaml.safe_load (fd) or {})
+
+    def start (self):
+        self.worker = threading.Thread (target=self.run, name='watering-sync')
+        self.worker.daemon = True
+        self.worker.start ()
+        return None
+
+    def stop (self):
+        """
+        Stop the background thread after a last upload.
+        """
+        self.stopping = True
+        self.wake.set ()
+        if self.worker is not None:
+            self.worker.join ()
+        return None
+
+    def notify (self):
+        """
+        Ask for an upload now instead of at the end of the period.
+        """
+        self.wake.set ()
+        return None
+
+    def run (self):
+        while True:
+            try:
+                self.sync ()
+                self.failures = 0
+                delay = PERIOD
+            except BaseException as ex:
+                self.failures += 1
+                delay = min (MAX_BACKOFF, BACKOFF * 2 ** (self.failures - 1))
+                self.log ('an error occur while uploading watering file, retrying in {} seconds {}'.format (delay, ex))
+            if self.stopping:
+                return
+            self.wake.wait (delay)
+            self.wake.clear ()
+
+    def sync (self):
+        """
+        Upload the complete rows added since the last upload.
+
+        :return: the number of bytes uploaded.
+        """
+        with self.lock:
+            result = 0
+            if not os.path.exists (self.filename):
+                return result
+            with open (self.filename, 'rb') as fd:
+                tail = self.state ['tail']
+                fd.seek (max (0, self.state ['offset'] - len (tail)))
+                if fd.read (len (tail)) != tail:
+                    self.state ['generation'] += 1
+                    self.state ['offset'] = 0
+                    self.state ['tail'] = b''
+                    self.save_state ()
+                    self.log ('watering file was reset, starting generation {}'.format (self.state ['generation']))
+                while True:
+                    fd.seek (self.state ['offset'])
+                    content = fd.read (MAX_SEGMENT_SIZE)
+                    # only upload complete rows
+                    content = content [:content.rfind (b'\n') + 1]
+                    if not content:
+                        return result
+                    self.remote.write (self.segment_path (self.state ['offset']), content)
+                    self.state ['offset'] += len (content)
+                    self.state ['tail'] = content [-TAIL_SIZE:]
+                    self.save_state ()
+                    result += len (content)
+
+    def segment_path (self, offset):
+        return '{}/{:04d}/{:012d}.csv'.format (self.remote_folder, self.state ['generation'], offset)
+
+    def save_state (self):
+        temporary = self.state_filename + '.tmp'
+        with open (temporary, 'wt') as fd:
+            yaml.safe_dump (self.state, fd)
+        os.rename (temporary, self.state_filename)
+        return None
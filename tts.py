@@ -0,0 +1,171 @@
+"""
+Disk-backed cache of the sentences synthesised by the speech synthesiser `flite`.
+
+Each sentence is synthesised once to a RIFF WAVE file whose name is the hash of the voice and the text.
+The cache has a size limit, when it is exceeded the least recently used files are removed.
+"""
+
+import collections
+import concurrent.futures
+import hashlib
+import os
+import os.path
+import subprocess
+import tempfile
+import threading
+
+FLITE = '/usr/bin/flite'
+
+
+class SpeechCache:
+    """
+    Synthesise sentences to sound files kept in a folder.
+
+    The modification time of the cached files records when they were last used, so the least recently
+    used order survives restarts.
+    """
+    def __init__ (self, folder, max_size, voice='slt', synthesiser=FLITE, log=None):
+        self.folder = folder
+        self.max_size = max_size
+        self.voice = voice
+        self.synthesiser = synthesiser
+        self.log = log if log is not None else print
+        self.lock = threading.Lock ()
+        # least recently used first
+        self.files = collections.OrderedDict ()
+        self.size = 0
+        if not os.path.exists (folder):
+            os.makedirs (folder)
+        entries = []
+        for name in os.listdir (folder):
+            if name.endswith ('.riff'):
+                stat = os.stat (os.path.join (folder, name))
+                entries.append ((stat.st_mtime, name, stat.st_size))
+        for _, name, size in sorted (entries):
+            self.files [name] = size
+            self.size += size
+
+    def key (self, text):
+        digest = hashlib.sha1 ()
+        digest.update (self.voice.encode ('utf-8'))
+        digest.update (b'\0')
+        digest.update (text.encode ('utf-8'))
+        return digest.hexdigest () + '.riff'
+
+    def contains (self, text):
+        with self.lock:
+            return self.key (text) in self.files
+
+    def get (self, text):
+        """
+        Return the filename of the sound file with the given text, synthesising it if is not in the cache.
+        """
+        name = self.key (text)
+        filename = os.path.join (self.folder, name)
+        with self.lock:
+            hit = name in self.files
+            if hit:
+                self.files.move_to_end (name)
+        if hit:
+            try:
+                os.utime (filename, None)
+                return filename
+            except OSError:
+                # the file was removed behind our back
+                with self.lock:
+                    self.size -= self.files.pop (name, 0)
+        self.synthesise (text, filename)
+        with self.lock:
+            size = os.path.getsize (filename)
+            self.size += size - self.files.pop (name, 0)
+            self.files [name] = size
+            self.evict (keep=name)
+        return filename
+
+    def prefetch (self, texts):
+        """
+        Synthesise in a background thread the given sentences that are not in the cache.
+
+        :return: the thread doing the synthesis.
+        """
+        worker = threading.Thread (target=self.synthesise_all, args=(list (texts),), name='tts-prefetch')
+        worker.daemon = True
+        worker.start ()
+        return worker
+
+    def synthesise_all (self, texts, workers=1):
+        """
+        Synthesise the given sentences that are not in the cache, running up to `workers` synthesisers at
+        once.  It stops at the first error, or when the given sentences fill the cache, as the next ones
+        would evict them.
+
+        :return: the number of sentences synthesised.
+        """
+        with self.lock:
+            # the bytes of the cache not used by the given sentences, and the size of a sentence estimated by
+            # the average size of the cached ones
+            room = self.max_size - sum (self.files.get (self.key (text), 0) for text in texts)
+            size = self.size / len (self.files) if self.files else 0
+        missing = [text for text in texts if not self.contains (text)]
+        if size > 0:
+            missing = missing [:max (0, int (room // size))]
+        count = 0
+        with concurrent.futures.ThreadPoolExecutor (max_workers=workers) as executor:
+            futures = [executor.submit (self.get, text) for text in missing]
+            for text, future in zip (missing, futures):
+                try:
+                    size = os.path.getsize (future.result ())
+                    room -= size
+                    count += 1
+                except (IOError, OSError) as ex:
+                    self.log ('an error occur while synthesising [{}]: {}'.format (text, ex))
+                    room = 0
+                if room < size or room <= 0:
+                    for pending in futures:
+                        pending.cancel ()
+                    break
+        self.log ('synthesised {} sentences ahead of time'.format (count))
+        return count
+
+    def synthesise (self, text, filename):
+        """
+        Synthesise the text to a temporary file that is renamed to the given filename, so that a partially
+        written file is never seen in the cache.
+        """
+        fd, temporary = tempfile.mkstemp (suffix='.tmp', dir=self.folder)
+        os.close (fd)
+        try:
+            command = [
+                self.synthesiser,
+                '-voice', self.voice,
+                '-t', text,
+                temporary
+            ]
+            process = subprocess.Popen (
+                command
+            )
+            if process.wait () != 0:
+                raise OSError ('{} exited with code {}'.format (self.synthesiser, process.returncode))
+            os.rename (temporary, filename)
+        finally:
+            if os.path.exists (temporary):
+                os.remove (temporary)
+        return None
+
+    def evict (self, keep):
+        """
+        Remove the least recently used files until the cache size is below the limit.  Must be called with
+        the lock held.
+        """
+        while self.size > self.max_size and len (self.files) > 1:
+            name, size = next (iter (self.files.items ()))
+            if name == keep:
+                self.files.move_to_end (name)
+                continue
+            del self.files [name]
+            self.size -= size
+            try:
+                os.remove (os.path.join (self.folder, name))
+            except OSError:
+                pass
+        return None
@@ -0,0 +1,120 @@
+"""
+Watch configuration files for changes.
+
+A background thread reads the inotify events of the folders of the watched files.  When a watched file
+has been written or replaced, and no other change arrived for `SETTLE_TIME` seconds, the callback is
+called with its filename.  Editors and downloads that write a file in several steps, or that write a
+temporary file and rename it, thus produce one call.  If inotify is not available the modification times
+of the files are polled.
+"""
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import threading
+import time
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO
+
+# the fixed part of an inotify event: watch descriptor, mask, cookie and length of the name
+EVENT_HEADER = struct.Struct ('iIII')
+
+# seconds without changes before a changed file is reported
+SETTLE_TIME = 1.0
+# seconds between two checks of the files when inotify is not available
+POLL_PERIOD = 5.0
+
+
+class FileWatcher:
+    def __init__ (self, filenames, callback, log=None):
+        """
+        :param filenames: the files to watch, they do not need to exist.
+        :param callback: function called with the filename of a changed file, in the watcher thread.
+        """
+        self.filenames = [os.path.abspath (filename) for filename in filenames]
+        self.callback = callback
+        self.log = log if log is not None else print
+        self.libc = None
+        self.fd = None
+        self.folders = {}
+        self.signatures = {filename: self.signature (filename) for filename in self.filenames}
+        self.worker = None
+
+    def start (self):
+        try:
+            self.libc = ctypes.CDLL (ctypes.util.find_library ('c') or 'libc.so.6', use_errno=True)
+            fd = self.libc.inotify_init1 (IN_CLOEXEC)
+            if fd < 0:
+                raise OSError (ctypes.get_errno (), os.strerror (ctypes.get_errno ()))
+            for folder in sorted (set (os.path.dirname (filename) for filename in self.filenames)):
+                wd = self.libc.inotify_add_watch (fd, folder.encode (), WATCH_MASK)
+                if wd < 0:
+                    raise OSError (ctypes.get_errno (), '{}: {}'.format (folder, os.strerror (ctypes.get_errno ())))
+                self.folders [wd] = folder
+            self.fd = fd
+        except (OSError, AttributeError) as ex:
+            self.log ('inotify is not available, polling the configuration files: {}'.format (ex))
+        self.worker = threading.Thread (target=self.run, name='file-watcher')
+        self.worker.daemon = True
+        self.worker.start ()
+        return None
+
+    def signature (self, filename):
+        try:
+            stat = os.stat (filename)
+        except OSError:
+            return None
+        return stat.st_mtime, stat.st_size, stat.st_ino
+
+    def run (self):
+        # changed files and the time of their last change
+        changed = {}
+        while True:
+            if changed:
+                timeout = max (0.0, min (changed.values ()) + SETTLE_TIME - time.time ())
+            else:
+                timeout = None if self.fd is not None else POLL_PERIOD
+            if self.fd is not None:
+                ready, _, _ = select.select ([self.fd], [], [], timeout)
+                if ready:
+                    now = time.time ()
+                    for filename in self.read_events ():
+                        changed [filename] = now
+            else:
+                time.sleep (timeout)
+                now = time.time ()
+                for filename in self.filenames:
+                    signature = self.signature (filename)
+                    if signature != self.signatures [filename]:
+                        self.signatures [filename] = signature
+                        changed [filename] = now
+            now = time.time ()
+            for filename, last in sorted (changed.items ()):
+                if now - last >= SETTLE_TIME:
+                    del changed [filename]
+                    try:
+                        self.callback (filename)
+                    except BaseException as ex:
+                        self.log ('an error occur while reloading {}: {}'.format (filename, ex))
+
+    def read_events (self):
+        """
+        Read the pending inotify events and return the watched files they concern.
+        """
+        data = os.read (self.fd, 64 * 1024)
+        result = set ()
+        offset = 0
+        while offset + EVENT_HEADER.size <= len (data):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from (data, offset)
+            offset += EVENT_HEADER.size
+            name = data [offset:offset + length].rstrip (b'\0').decode ('utf-8', 'replace')
+            offset += length
+            filename = os.path.join (self.folders.get (wd, ''), name)
+            if filename in self.filenames:
+                result.add (filename)
+        return result
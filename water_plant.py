@@ -1,25 +1,77 @@
-#!/usr/bin/python
+#!/usr/bin/python3
 
-from __future__ import print_function
-
-import csv
+import concurrent.futures
 import datetime
-import dropbox
 import os
 import os.path
+import queue
 import sys
 import serial
 import subprocess
+import threading
 import time
 import yaml
 
-import masterflex
-
-DATA_FOLDER = '/home/pi/water-weight-control'
+import audio
+import barcode
+import calibration
+import devices
+import experiment
+import journal
+import logger
+import metrics
+import pump
+import scale
+import storage
+import store
+import sync
+import tts
+import watcher
+
+# the data folder can be changed to run the station against the simulator
+DATA_FOLDER = os.environ.get ('WATER_WEIGHT_CONTROL_FOLDER', '/home/pi/water-weight-control')
 EXPERIMENT_DATA_FILENAME = DATA_FOLDER + '/experiment-data.csv'
+EXPERIMENT_CACHE_FILENAME = DATA_FOLDER + '/experiment-data.cache'
 CONFIG_FILENAME = DATA_FOLDER + '/config.txt'
 WATERING_FILENAME = DATA_FOLDER + '/watering.csv'
 PUMP_DATA_FILENAME = DATA_FOLDER + '/pump-data.txt'
+CALIBRATION_FILENAME = DATA_FOLDER + '/calibration.txt'
+WATERING_SYNC_FILENAME = DATA_FOLDER + '/watering-sync.txt'
+JOURNAL_FILENAME = DATA_FOLDER + '/watering-journal.txt'
+STORE_FILENAME = DATA_FOLDER + '/watering.sqlite'
+# paths in the remote storage of the data files and of the folder with the segments of the watering file
+REMOTE_PUMP_DATA_PATH = '/pump-data.txt'
+REMOTE_EXPERIMENT_DATA_PATH = '/experiment-data.csv'
+REMOTE_WATERING_FOLDER = '/watering'
+SPEECH_CACHE_FOLDER = DATA_FOLDER + '/speech-cache'
+LOG_FILENAME = '/var/log/interpheno/controlo-peso-planta.log'
+
+# maximum size in bytes of the synthesised sentences kept in the speech cache
+SPEECH_CACHE_SIZE = 64 * 1024 * 1024
+# the hashes of the texts of the sound prompts created by setup.py
+SOUND_PROMPTS_FILENAME = DATA_FOLDER + '/sound-prompts.txt'
+# voice of the speech synthesiser
+VOICE = 'slt'
+
+# text and filename of the sound prompts played by the station, created by setup.py
+SOUND_PROMPTS = [
+    ('Welcome to the plant weight water control system.', 'welcome-message.riff'),
+    ('Uploaded file with plant weight and watering.', 'upload-watering.riff'),
+    ('Attention! Could not upload file with plant weight and watering.', 'no-uploading-watering.riff'),
+    ('Attention! Could not download pump data file.', 'no-download-pump-data.riff'),
+    ('Downloaded file with experiment data', 'download-experiment-data.riff'),
+    ('Attention! Could not download experiment data file.', 'no-download-experiment-data.riff'),
+    ('Attention! Error parsing experiment data file.', 'error-parsing-experiment-data.riff'),
+    ('Connect barcode scanner.', 'connect-barcode-scanner.riff'),
+    ('Connect water pump.', 'connect-water-pump.riff'),
+    ('Connect plant scale.', 'connect-plant-scale.riff'),
+    ('Waiting for plant barcode...', 'waiting-barcode.riff'),
+    ('Waiting for plant weight...', 'waiting-weight.riff'),
+    ('Reseting watering file.', 'reset-watering.riff'),
+    ('Invalid weight, please send a new weight.', 'invalid-weight.riff'),
+    ('New tray, scan the plants.', 'tray-start.riff'),
+    ('Tray scanned, weigh the plants in order.', 'tray-end.riff'),
+]
 
 MOTOR_SPEED = 70
 
@@ -31,49 +83,472 @@ WATER_PER_1_REVOLUTION = 0.85
 
 MAX_INVALID_WEIGHT = 25
 
-
-class Plant:
-    def __init__ (self, csv_row):
-        self.id = csv_row ['id']
-        self.weight = float (csv_row ['weight'])
-        self.description = csv_row ['description']
+# a weight is settled when this many consecutive scale readings agree within the tolerance (in grams)
+SCALE_STABLE_READINGS = 3
+SCALE_TOLERANCE = 0.5
+# seconds between the waiting for weight prompts
+WAITING_WEIGHT_PERIOD = 10
+
+# In closed-loop mode the plant stays on the scale while it is watered, and the pump is stopped or topped
+# up using the scale readings.
+CLOSED_LOOP = False
+# maximum number of pump runs added when the target weight was not reached
+CLOSED_LOOP_MAX_TOP_UPS = 2
+# seconds to wait for the weight to settle after a pump run
+CLOSED_LOOP_SETTLE_TIME = 5
+# running estimate of the water weight per one revolution, updated by the closed-loop runs
+CALIBRATION = None
+
+AUDIO = None
+SPEECH = None
+MONITOR = None
+SYNC = None
+STORAGE = None
+STORAGE_LOCK = threading.Lock ()
+LOG = logger.Logger (LOG_FILENAME)
+JOURNAL = None
+STORE = None
+WATERING_FD = None
+WATERING_LOCK = threading.Lock ()
+# bytes at the end of the watering file searched for the rows of interrupted pump runs
+WATERING_TAIL_SIZE = 64 * 1024
+
+# the configuration and the plant registry, reloaded when their files change
+CONFIG = None
+PLANT_REGISTRY = None
+WATCHER = None
+# validated configuration changes waiting to be applied between two plants
+STAGED_CONFIG = {}
+STAGED_CONFIG_LOCK = threading.Lock ()
+
+RESET_WATERING_CODE = '9999999999'
+STOP_CODE = '8888888888'
+# the plants scanned between these codes are weighed in the order they were scanned
+TRAY_START_CODE = '7777777777'
+TRAY_END_CODE = '6666666666'
+
+# seconds the operator has to move the plant from the scale to the pump
+PUMP_PLACEMENT_DELAY = 5
+# in a tray, seconds the operator has to move the plant to the pump after it is removed from the scale
+TRAY_PLACEMENT_DELAY = 1
+# maximum seconds to wait for a pump run to finish
+PUMP_RUN_TIMEOUT = 120
+
+# seconds between the prompts asking to connect a device
+DEVICE_PROMPT_PERIOD = 30
+# seconds to wait before reconnecting the devices of a station after one of them failed
+RECONNECT_DELAY = 1
+# errors raised when a device is disconnected, other errors such as the failure to write a data file stop the
+# station
+DEVICE_ERRORS = (EOFError, serial.SerialException, pump.PumpError, barcode.BarcodeError)
+
+# address of the metrics HTTP server, an empty host listens on all the interfaces
+METRICS_ADDRESS = ('', 9108)
+# file read by the textfile collector of the node exporter, and seconds between two writes
+METRICS_FILENAME = DATA_FOLDER + '/metrics.prom'
+METRICS_PERIOD = 15
+METRICS = metrics.Registry (prefix='water_station_')
+METRICS_TEXTFILE = None
+BARCODES_READ = METRICS.counter ('barcodes_read_total', 'Barcodes read from the scanners.')
+BARCODE_WAIT = METRICS.histogram ('barcode_wait_seconds', 'Seconds a decoded barcode waited to be read.')
+SCALE_SETTLE = METRICS.histogram ('scale_settle_seconds', 'Seconds until the scale returned a settled weight.')
+INVALID_WEIGHTS = METRICS.counter ('scale_invalid_weights_total', 'Settled weights rejected as invalid.')
+SCALE_READING_AGE = METRICS.gauge ('scale_reading_age_seconds', 'Seconds since the last scale reading.')
+SPEECH_TIME = METRICS.histogram ('speech_seconds', 'Seconds to get a synthesised sentence from the speech cache.')
+SOUND_WAIT = METRICS.histogram ('sound_wait_seconds', 'Seconds a sound prompt waited to be played.')
+PUMP_COMMAND = METRICS.histogram ('pump_command_seconds', 'Seconds of a pump command round trip.')
+PUMP_REVOLUTIONS = METRICS.counter ('pump_revolutions_total', 'Pump revolutions recorded in the watering file.')
+RECORD_WRITE = METRICS.histogram ('record_write_seconds', 'Seconds to write a watering record to disk.')
+PLANTS = METRICS.counter ('plants_total', 'Plants processed by a station.')
+PLANT_CYCLE = METRICS.histogram ('plant_cycle_seconds', 'Seconds between two plants processed by a station.')
+DEVICES_LOST = METRICS.counter ('devices_lost_total', 'Device failures that made a station reconnect its devices.')
+STORAGE_TRANSFER = METRICS.histogram ('storage_transfer_seconds', 'Seconds of a transfer with the remote storage.')
+STORAGE_BYTES = METRICS.counter ('storage_bytes_total', 'Bytes transferred with the remote storage.')
 
 
 def main ():
-    time.sleep (10)
+    timer = PhaseTimer ()
+    start_device_monitor ()
+    start_metrics ()
+    start_audio ()
+    start_speech_cache ()
     play_sound ('welcome-message.riff')
     write_to_log ('Welcome to plant water system')
+    timer.phase ('audio')
+    open_watering_store ()
+    recover_watering ()
+    timer.phase ('recovery')
+    global CONFIG
+    global PLANT_REGISTRY
     cfg = read_config ()
-    download_pump_data_file (cfg ['token'])
+    with concurrent.futures.ThreadPoolExecutor (max_workers=3) as executor:
+        executor.submit (download_pump_data_file, cfg)
+        executor.submit (download_experiment_data_file, cfg)
+        executor.submit (upload_watering, cfg)
+    timer.phase ('storage')
     setup_pump ()
-    download_experiment_data_file (cfg ['token'])
-    upload_watering (cfg ['token'])
     dict_plants = read_experiment_data_file ()
-    barcode = detect_barcode_scanner ()
-    pump = detect_pump ()
+    SPEECH.prefetch (plant_code_text (code, plant) for code, plant in dict_plants.items ())
+    CONFIG = cfg
+    PLANT_REGISTRY = dict_plants
+    start_config_watcher ()
+    timer.phase ('experiment data')
+    for name, device in devices.connected_devices ():
+        write_to_log ('found device {} at {}'.format (name, device))
     try:
-        scale = detect_scale ()
-        go = True
-        while go:
-            plant_id = get_plant_code_reading (barcode)
-            if plant_id == '9999999999':
-                reset_watering_file ()
-            elif plant_id == '8888888888':
-                go = False
-            elif report_plant_code (plant_id, dict_plants):
-                plant_weight = get_scale_reading (scale)
-                time.sleep (5) # wait at least 5 seconds to give time to put plant in pump
-                water_plant (plant_id, plant_weight, dict_plants [plant_id].weight, pump)
+        manager = StationManager (devices.station_devices (cfg), dict_plants)
+        manager.run ()
     except BaseException as ex:
-        write_to_log ('erro [{}]'.format (ex))
+        write_to_log ('erro [{}]'.format (ex), logger.ERROR)
         raise ex
-    finally:
-        pump.halt ()
-        pump.cancel ()
+    write_to_log ('Uploading watering file...')
+    if SYNC is not None:
+        SYNC.stop ()
+    AUDIO.wait ()
     write_to_log ('Synchronising file to disk...')
+    JOURNAL.close ()
+    STORE.close ()
+    METRICS_TEXTFILE.stop ()
+    LOG.flush ()
     subprocess.call ("sync", shell=True)
     write_to_log ('Shuting down...')
-    subprocess.call ("sudo shutdown -h now", shell=True)
+    LOG.close ()
+    if CONFIG.get ('shutdown', True):
+        subprocess.call ("sudo shutdown -h now", shell=True)
+
+
+class PhaseTimer:
+    """
+    Log the duration of the startup phases.
+    """
+    def __init__ (self):
+        self.start = time.time ()
+        self.last = self.start
+
+    def phase (self, name):
+        now = time.time ()
+        write_to_log ('startup phase {} took {:.3f}s, {:.3f}s since start'.format (
+            name, now - self.last, now - self.start),
+            stage='startup', phase=name, duration='{:.3f}'.format (now - self.last))
+        self.last = now
+
+
+class Throughput:
+    """
+    Count the plants processed by a station and compute the plants per hour rate.
+    """
+    def __init__ (self):
+        self.start = time.time ()
+        self.last = self.start
+        self.plants = 0
+
+    def plant_done (self):
+        """
+        :return: the seconds since the previous plant, or since the start for the first plant.
+        """
+        now = time.time ()
+        result = now - self.last
+        self.last = now
+        self.plants += 1
+        return result
+
+    def plants_per_hour (self):
+        elapsed = time.time () - self.start
+        if elapsed <= 0:
+            return 0.0
+        return self.plants * 3600.0 / elapsed
+
+
+class StationManager:
+    """
+    Run several watering stations on one controller.
+
+    Each station has its own barcode scanner, scale and pump, and runs in its own thread.  The stations
+    share the plant registry, the log, the watering file and the sync worker.  When a device of a station
+    is disconnected, the station waits for its devices to be connected again.  A station stops when its
+    stop code is read or it fails, and the manager returns when all stations have stopped.
+    """
+    def __init__ (self, stations, plants):
+        """
+        :param stations: the list of `devices.StationDevices`.
+        """
+        self.stations = stations
+        self.plants = plants
+        self.errors = []
+
+    def run (self):
+        """
+        Run the stations until they all stop.
+
+        :raise: the error of the first station that failed.
+        """
+        workers = []
+        for station_devices in self.stations:
+            worker = threading.Thread (target=self.run_station, args=(station_devices,), name=station_devices.name)
+            worker.daemon = True
+            worker.start ()
+            workers.append (worker)
+        for worker in workers:
+            worker.join ()
+        if self.errors:
+            raise self.errors [0]
+        return None
+
+    def run_station (self, station_devices):
+        """
+        Run a station until its stop code is read, reconnecting its devices when one is disconnected.
+        """
+        name = station_devices.name
+        while True:
+            try:
+                self.run_devices (station_devices)
+            except DEVICE_ERRORS as ex:
+                write_to_log ('station {} lost a device [{}], reconnecting'.format (name, ex), logger.WARNING, station=name)
+                DEVICES_LOST.inc (station=name)
+                time.sleep (RECONNECT_DELAY)
+                continue
+            except BaseException as ex:
+                write_to_log ('station {} stopped with an error [{}]'.format (name, ex), logger.ERROR, station=name)
+                self.errors.append (ex)
+                return None
+            write_to_log ('station {} stopped'.format (name), station=name)
+            return None
+
+    def run_devices (self, station_devices):
+        name = station_devices.name
+        start = time.time ()
+        scanner = station_pump = plant_scale = None
+        try:
+            scanner = detect_barcode_scanner (station_devices.scanner)
+            station_pump = detect_pump (station_devices.pump)
+            plant_scale = detect_scale (station_devices.scale)
+            SCALE_READING_AGE.set_function (lambda: scale_reading_age (plant_scale), station=name)
+            write_to_log ('station {} is ready'.format (name), stage='startup', station=name,
+                          duration='{:.3f}'.format (time.time () - start))
+            Station (scanner, plant_scale, station_pump, self.plants, name).run ()
+            # let the last plant be watered
+            try:
+                station_pump.wait_halted (timeout=PUMP_RUN_TIMEOUT)
+            except pump.PumpError as ex:
+                write_to_log ('could not wait for the last pump run of station {} [{}]'.format (name, ex), logger.WARNING, station=name)
+        finally:
+            if station_pump is not None:
+                try:
+                    station_pump.halt ()
+                except DEVICE_ERRORS as ex:
+                    write_to_log ('could not halt the pump of station {} [{}]'.format (name, ex), logger.WARNING, station=name)
+                station_pump.cancel ()
+            if plant_scale is not None:
+                plant_scale.close ()
+            if scanner is not None:
+                scanner.close ()
+        return None
+
+
+class Station:
+    """
+    Event-driven plant watering station.
+
+    The stages of a plant cycle run concurrently.  The barcode reader accepts barcodes as soon as they
+    are scanned, a speech thread synthesises the plant descriptions, and a pump thread waters the plant
+    weighed last while the operator scans and weighs the next one.  The main thread takes the barcodes
+    from the queue, handles the control codes and reads the scale.  Sound prompts are played by the
+    audio engine without blocking any stage.
+
+    The plants scanned between `TRAY_START_CODE` and `TRAY_END_CODE` form a tray, whose plants are then
+    weighed in the order they were scanned.
+    """
+    def __init__ (self, barcode, scale, pump, plants, name='station'):
+        self.barcode = barcode
+        self.scale = scale
+        self.pump = pump
+        self.plants = plants
+        self.name = name
+        self.speech = queue.Queue ()
+        self.pumping = queue.Queue (maxsize=1)
+        self.throughput = Throughput ()
+        self.error = None
+
+    def run (self):
+        """
+        Process plants until the stop code is read or a stage fails.
+        """
+        for target, name in [
+                (self.speak, 'speech'),
+                (self.pump_plants, 'pump')]:
+            worker = threading.Thread (target=target, name='{}-{}'.format (self.name, name))
+            worker.daemon = True
+            worker.start ()
+        try:
+            self.process_codes ()
+            self.pumping.join ()
+        finally:
+            self.speech.put (None)
+        if self.error is not None:
+            raise self.error
+        return None
+
+    def say (self, function, *args):
+        """
+        Queue a prompt in the speech thread.  The function returns immediately.
+        """
+        self.speech.put ((function, args))
+
+    def process_codes (self):
+        # the plants of the tray being scanned, or `None` outside a tray
+        tray = None
+        while True:
+            plant_id = self.next_code ()
+            if plant_id is None:
+                return
+            self.reload ()
+            if plant_id == RESET_WATERING_CODE:
+                self.pumping.join ()
+                reset_watering_file ()
+            elif plant_id == TRAY_START_CODE:
+                if tray:
+                    write_to_log ('station {} discarded a tray of {} plants that was not ended'.format (
+                        self.name, len (tray)), logger.WARNING, stage='tray', station=self.name)
+                tray = []
+                play_sound ('tray-start.riff')
+            elif tray is not None and plant_id in (TRAY_END_CODE, STOP_CODE):
+                self.process_tray (tray)
+                tray = None
+                if plant_id == STOP_CODE:
+                    return
+            elif plant_id == STOP_CODE:
+                return
+            elif plant_id == TRAY_END_CODE:
+                write_to_log ('station {} read the tray end code outside a tray'.format (self.name),
+                              logger.WARNING, stage='tray', station=self.name)
+            elif plant_id in self.plants and tray is not None:
+                tray.append (plant_id)
+                write_to_log ('plant {} is number {} in the tray'.format (plant_id, len (tray)),
+                              plant=plant_id, stage='tray', station=self.name)
+            elif plant_id in self.plants:
+                self.say (report_plant_code, plant_id, self.plants)
+                report_plant_history (plant_id)
+                plant_weight = get_scale_reading (self.scale)
+                if CLOSED_LOOP:
+                    self.pumping.join ()
+                    water_plant_closed_loop (plant_id, plant_weight, self.plants [plant_id].weight, self.pump, self.scale)
+                    self.plant_done ()
+                else:
+                    self.pumping.put ((plant_id, plant_weight, self.plants [plant_id].weight, time.time () + PUMP_PLACEMENT_DELAY))
+            else:
+                self.say (report_plant_code, plant_id, self.plants)
+
+    def reload (self):
+        """
+        Apply the configuration changes, this is done between two plants.
+        """
+        apply_staged_config ()
+        if PLANT_REGISTRY is not None:
+            self.plants = PLANT_REGISTRY
+        return None
+
+    def process_tray (self, tray):
+        """
+        Weigh the plants of a tray in the order they were scanned.
+
+        The scale confirms when a plant is placed and removed, so the pump is started as soon as the plant
+        has been moved to the pump, while the operator places the next plant on the scale.
+        """
+        write_to_log ('station {} weighs a tray of {} plants'.format (self.name, len (tray)), stage='tray', station=self.name)
+        play_sound ('tray-end.riff')
+        start = time.time ()
+        done = 0
+        for plant_id in tray:
+            self.reload ()
+            if plant_id not in self.plants:
+                write_to_log ('plant {} of the tray was removed from the experiment data'.format (plant_id),
+                              logger.WARNING, plant=plant_id, stage='tray', station=self.name)
+                continue
+            self.say (report_plant_code, plant_id, self.plants)
+            report_plant_history (plant_id)
+            if self.wait_scale (lambda weight: weight > MAX_INVALID_WEIGHT) is None:
+                return None
+            plant_weight = get_scale_reading (self.scale)
+            if CLOSED_LOOP:
+                self.pumping.join ()
+                water_plant_closed_loop (plant_id, plant_weight, self.plants [plant_id].weight, self.pump, self.scale)
+                self.plant_done ()
+            removed_at = self.wait_scale (lambda weight: weight <= MAX_INVALID_WEIGHT)
+            if removed_at is None:
+                return None
+            if not CLOSED_LOOP:
+                self.pumping.put ((plant_id, plant_weight, self.plants [plant_id].weight, removed_at + TRAY_PLACEMENT_DELAY))
+            done += 1
+        self.pumping.join ()
+        elapsed = time.time () - start
+        write_to_log ('station {} watered a tray of {} plants in {:.0f}s, {:.1f} plants/hour'.format (
+            self.name, done, elapsed, done * 3600.0 / elapsed if elapsed > 0 else 0.0
+        ), stage='tray', station=self.name, duration='{:.3f}'.format (elapsed))
+        return None
+
+    def wait_scale (self, predicate):
+        """
+        Wait for a scale reading whose weight satisfies the predicate.
+
+        :return: the time of the reading or `None` if the pump thread failed.
+        """
+        since = time.time ()
+        while self.error is None:
+            reading = self.scale.wait_reading (since, timeout=0.5)
+            if reading is None:
+                continue
+            since, weight = reading
+            if predicate (weight):
+                return since
+        return None
+
+    def next_code (self):
+        """
+        Return the next barcode scanned or `None` if the pump thread failed.
+        """
+        if self.barcode.pending () == 0:
+            play_sound ('waiting-barcode.riff', priority=audio.BACKGROUND)
+        while self.error is None:
+            plant_id = get_plant_code_reading (self.barcode, prompt=False, timeout=0.5)
+            if plant_id is not None:
+                return plant_id
+        return None
+
+    def speak (self):
+        while True:
+            item = self.speech.get ()
+            if item is None:
+                return
+            function, args = item
+            try:
+                function (*args)
+            except BaseException as ex:
+                write_to_log ('an error occur while playing a prompt {}'.format (ex), logger.ERROR)
+
+    def pump_plants (self):
+        while True:
+            plant_id, plant_weight, desired_weight, pump_at = self.pumping.get ()
+            try:
+                if self.error is None:
+                    # give time to put plant in pump
+                    delay = pump_at - time.time ()
+                    if delay > 0:
+                        time.sleep (delay)
+                    water_plant (plant_id, plant_weight, desired_weight, self.pump)
+                    self.plant_done ()
+            except BaseException as ex:
+                self.error = ex
+            finally:
+                self.pumping.task_done ()
+
+    def plant_done (self):
+        PLANT_CYCLE.observe (self.throughput.plant_done (), station=self.name)
+        PLANTS.inc (station=self.name)
+        write_to_log ('station {} throughput is {:.1f} plants/hour ({} plants)'.format (
+            self.name,
+            self.throughput.plants_per_hour (),
+            self.throughput.plants
+        ), stage='throughput', station=self.name)
 
 
 def read_config ():
@@ -86,107 +561,322 @@ def read_config ():
     return result
 
 
-def download_pump_data_file (token):
+def remote_storage (cfg):
+    """
+    Return the remote storage shared by all transfers, opening it on the first call.
+
+    :param cfg: the configuration, its `storage` section selects the backend.
+    :raise storage.StorageError: if the storage section is invalid.
+    """
+    global STORAGE
+    with STORAGE_LOCK:
+        if STORAGE is None:
+            STORAGE = storage.open_storage (cfg, log=write_to_log, on_transfer=storage_transfer)
+            write_to_log ('opened {} storage'.format (STORAGE.kind))
+    return STORAGE
+
+
+def storage_transfer (operation, path, size, seconds):
+    """
+    Record the duration and size of a transfer with the remote storage.
+    """
+    STORAGE_TRANSFER.observe (seconds, operation=operation)
+    STORAGE_BYTES.inc (size, operation=operation)
+    write_to_log ('{} {} bytes of {}'.format (operation, size, path), logger.DEBUG, stage='storage',
+                 duration='{:.3f}'.format (seconds))
+    return None
+
+
+def download_pump_data_file (cfg):
     try:
-        dbx = dropbox.Dropbox (token)
-        write_to_log ('connected to dropbox account')
-        dbx.files_download_to_file (PUMP_DATA_FILENAME, '/pump-data.txt')
-        write_to_log ('downloaded pump data file')
+        if sync.download_if_changed (remote_storage (cfg), PUMP_DATA_FILENAME, REMOTE_PUMP_DATA_PATH):
+            write_to_log ('downloaded pump data file')
+        else:
+            write_to_log ('pump data file is up to date')
         result = True
     except BaseException as ex:
-        write_to_log ('an error occur while downloading pump data file {}'.format (ex))
+        write_to_log ('an error occur while downloading pump data file {}'.format (ex), logger.ERROR)
         play_sound ('no-download-pump-data.riff')
         result = False
     return result
 
 
 def setup_pump ():
-        global MOTOR_SPEED
-        global WATER_PER_1_REVOLUTION
-        global MAX_INVALID_WEIGHT
-        with open (PUMP_DATA_FILENAME, 'r') as fd:
-            exp = yaml.safe_load (fd)
-        if exp ['motor_speed'] != MOTOR_SPEED or\
-                exp ['water_per_1_revolution'] != WATER_PER_1_REVOLUTION:
-            write_to_log ('new pump data parameters ')
-            MOTOR_SPEED = exp ['motor_speed']
-            WATER_PER_1_REVOLUTION = exp ['water_per_1_revolution']
-            synthesise_text ('Set the water pump parameters. The motor speed is {}. The water weight per one revolution is {} grams'.format (
-                MOTOR_SPEED,
-                WATER_PER_1_REVOLUTION
+    """
+    Read the pump data file and set the pump parameters.
+    """
+    apply_pump_data (load_pump_data ())
+    return None
+
+
+def load_pump_data ():
+    """
+    Read and validate the pump data file.  Optional parameters missing from the file keep their current
+    value.
+
+    :return: a dictionary with the pump parameters.
+    :raise ValueError: if a parameter is missing or invalid.
+    """
+    with open (PUMP_DATA_FILENAME, 'r') as fd:
+        exp = yaml.safe_load (fd)
+    if not isinstance (exp, dict):
+        raise ValueError ('the pump data file has no parameters')
+    result = {
+        'motor_speed': exp.get ('motor_speed'),
+        'water_per_1_revolution': exp.get ('water_per_1_revolution'),
+        'max_invalid_weight': exp.get ('max_invalid_weight', MAX_INVALID_WEIGHT),
+        'scale_stable_readings': exp.get ('scale_stable_readings', SCALE_STABLE_READINGS),
+        'scale_tolerance': exp.get ('scale_tolerance', SCALE_TOLERANCE),
+        'closed_loop': exp.get ('closed_loop', CLOSED_LOOP),
+    }
+    for name, minimum in [
+            ('motor_speed', 0),
+            ('water_per_1_revolution', 0),
+            ('scale_tolerance', 0),
+            ('max_invalid_weight', -1),
+            ('scale_stable_readings', 0)]:
+        value = result [name]
+        if not isinstance (value, (int, float)) or isinstance (value, bool) or value <= minimum:
+            raise ValueError ('invalid {} [{}] in the pump data file'.format (name, value))
+    if not isinstance (result ['scale_stable_readings'], int):
+        raise ValueError ('invalid scale_stable_readings [{}] in the pump data file'.format (result ['scale_stable_readings']))
+    if not isinstance (result ['closed_loop'], bool):
+        raise ValueError ('invalid closed_loop [{}] in the pump data file'.format (result ['closed_loop']))
+    return result
+
+
+def apply_pump_data (data):
+    """
+    Set the pump parameters that changed.
+
+    :param data: the pump parameters returned by `load_pump_data`.
+    """
+    global MOTOR_SPEED
+    global WATER_PER_1_REVOLUTION
+    global MAX_INVALID_WEIGHT
+    global SCALE_STABLE_READINGS
+    global SCALE_TOLERANCE
+    global CLOSED_LOOP
+    global CALIBRATION
+    if data ['motor_speed'] != MOTOR_SPEED or\
+            data ['water_per_1_revolution'] != WATER_PER_1_REVOLUTION:
+        write_to_log ('new pump data parameters ')
+        MOTOR_SPEED = data ['motor_speed']
+        WATER_PER_1_REVOLUTION = data ['water_per_1_revolution']
+        synthesise_text ('Set the water pump parameters. The motor speed is {}. The water weight per one revolution is {} grams'.format (
+            MOTOR_SPEED,
+            WATER_PER_1_REVOLUTION
+        ))
+    if data ['max_invalid_weight'] != MAX_INVALID_WEIGHT:
+        MAX_INVALID_WEIGHT = data ['max_invalid_weight']
+        synthesise_text ('The maximum invalid weight is {}.'.format (
+            MAX_INVALID_WEIGHT
             ))
-        if 'max_invalid_weight' in exp:
-            MAX_INVALID_WEIGHT = exp ['max_invalid_weight']
-            synthesise_text ('The maximum invalid weight is {}.'.format (
-                MAX_INVALID_WEIGHT
-                ))
+    if data ['scale_stable_readings'] != SCALE_STABLE_READINGS or data ['scale_tolerance'] != SCALE_TOLERANCE:
+        SCALE_STABLE_READINGS = data ['scale_stable_readings']
+        SCALE_TOLERANCE = data ['scale_tolerance']
+        write_to_log ('a weight is settled after {} readings within {} grams'.format (SCALE_STABLE_READINGS, SCALE_TOLERANCE))
+    changed_loop = data ['closed_loop'] != CLOSED_LOOP
+    CLOSED_LOOP = data ['closed_loop']
+    if CALIBRATION is None or CALIBRATION.base != WATER_PER_1_REVOLUTION:
+        CALIBRATION = calibration.Calibration (CALIBRATION_FILENAME, WATER_PER_1_REVOLUTION)
+    elif not changed_loop:
+        return None
+    if CLOSED_LOOP:
+        write_to_log ('closed-loop watering with {} grams per one revolution after {} runs'.format (
+            CALIBRATION.estimate,
+            CALIBRATION.runs
+        ))
+    elif changed_loop:
+        write_to_log ('open-loop watering')
+    return None
+
+
+def start_config_watcher ():
+    """
+    Start watching the pump data, configuration and experiment data files.  Their changes are validated
+    and staged by the watcher thread, and applied by `apply_staged_config`.
+    """
+    global WATCHER
+    WATCHER = watcher.FileWatcher (
+        [PUMP_DATA_FILENAME, CONFIG_FILENAME, EXPERIMENT_DATA_FILENAME],
+        reload_config_file,
+        log=write_to_log,
+    )
+    WATCHER.start ()
+    return None
+
+
+def reload_config_file (filename):
+    """
+    Validate a changed configuration file and stage its new contents.  Invalid files are reported and
+    ignored, the station keeps the current configuration.
+    """
+    try:
+        if filename == os.path.abspath (PUMP_DATA_FILENAME):
+            stage_config ('pump data', load_pump_data ())
+        elif filename == os.path.abspath (CONFIG_FILENAME):
+            cfg = read_config ()
+            if not isinstance (cfg, dict) or ('token' not in cfg and 'storage' not in cfg):
+                raise ValueError ('the configuration file has no token nor storage')
+            devices.station_devices (cfg)
+            stage_config ('configuration', cfg)
+        elif filename == os.path.abspath (EXPERIMENT_DATA_FILENAME):
+            plants = experiment.load (EXPERIMENT_DATA_FILENAME, EXPERIMENT_CACHE_FILENAME, log=write_to_log)
+            if len (plants) == 0:
+                raise ValueError ('the experiment data file has no plants')
+            if PLANT_REGISTRY is not None:
+                log_plant_changes (PLANT_REGISTRY, plants)
+            # the sentences of the other plants were prefetched when they were loaded
+            SPEECH.prefetch (
+                plant_code_text (code, plant)
+                for code, plant in plants.items ()
+                if PLANT_REGISTRY is None or code not in PLANT_REGISTRY or
+                PLANT_REGISTRY [code].description != plant.description
+            )
+            stage_config ('experiment data', plants)
+    except (IOError, ValueError, yaml.YAMLError, devices.DeviceConfigError, experiment.ExperimentDataError) as ex:
+        write_to_log ('ignored the changes of {}: {}'.format (filename, ex), logger.ERROR, stage='config')
+    return None
+
+
+def log_plant_changes (old, new):
+    added = sum (1 for code in new if code not in old)
+    removed = sum (1 for code in old if code not in new)
+    changed = 0
+    for code in new:
+        if code in old:
+            old_plant = old [code]
+            new_plant = new [code]
+            if old_plant.weight != new_plant.weight or old_plant.description != new_plant.description:
+                changed += 1
+    write_to_log ('the experiment data file has {} new plants, {} removed plants and {} changed plants'.format (
+        added, removed, changed), stage='config')
+    return None
+
+
+def stage_config (kind, value):
+    with STAGED_CONFIG_LOCK:
+        STAGED_CONFIG [kind] = value
+    write_to_log ('the changes of the {} will be applied before the next plant'.format (kind), stage='config')
+    return None
+
+
+def apply_staged_config ():
+    """
+    Apply the staged configuration changes.  Called by the stations between two plants, the plants being
+    watered keep the parameters they started with.
+    """
+    global CONFIG
+    global PLANT_REGISTRY
+    with STAGED_CONFIG_LOCK:
+        if not STAGED_CONFIG:
+            return None
+        staged = dict (STAGED_CONFIG)
+        STAGED_CONFIG.clear ()
+    if 'pump data' in staged:
+        apply_pump_data (staged ['pump data'])
+    if 'configuration' in staged:
+        cfg = staged ['configuration']
+        if CONFIG is not None and \
+                (cfg.get ('token') != CONFIG.get ('token') or cfg.get ('storage') != CONFIG.get ('storage') or
+                 cfg.get ('stations') != CONFIG.get ('stations')):
+            write_to_log ('the token, the storage and the stations of the configuration file are used after a restart',
+                          logger.WARNING, stage='config')
+        CONFIG = cfg
+    if 'experiment data' in staged:
+        PLANT_REGISTRY = staged ['experiment data']
+    write_to_log ('applied the changes of the {}'.format (', '.join (sorted (staged))), stage='config')
+    return None
 
 
-def detect_barcode_scanner ():
+def detect_barcode_scanner (device='/dev/hidraw0'):
     """Wait for the barcode scanner to be connected to the raspberry pi.
 
     Per the `dmesg` command, the barcode scanner is assigned the device filename
 
         /dev/input/by-id/usb-SHANG_CHEN_DIAN_ZI_SHANG_CHEN_HID_SC-32-event-kbd
 
-    We don't check for this file, instead we check for '/dev/hidraw0' which
-    is the only input device that will be connected to the raspberry pi.
+    We don't check for this file, instead we check for the `hidraw` device,
+    by default '/dev/hidraw0' which is the only input device connected to a
+    raspberry pi with one station.
+
+    :param device: the scanner device as given in the configuration, see `devices.resolve`.
+    :return: a started barcode reader.
     """
-    device = '/dev/hidraw0'
-    while not os.path.exists (device):
-        write_to_log ('waiting for bar code reader to be connected...')
-        play_sound ('connect-barcode-scanner.riff')
-        wait_for_file (device, 10)
-    write_to_log ('detected bar code reader at device [{}]'.format (device))
-    return device
+    filename = wait_for_device (device, 'scanner', 'bar code reader', 'connect-barcode-scanner.riff')
+    write_to_log ('detected bar code reader at device [{}]'.format (filename))
+    result = barcode.BarcodeReader (filename, log=write_to_log)
+    result.start ()
+    return result
 
 
-def detect_pump ():
+def detect_pump (device='/dev/ttyUSB0'):
     """
     Search for the serial connection where the pump is connected to.
-    :return: an instance of Masterflex
+    :param device: the pump device as given in the configuration, see `devices.resolve`.
+    :return: a started pump driver.
     """
     # noinspection SpellCheckingInspection
-    device = '/dev/ttyUSB0'
-    while not os.path.exists (device):
-        write_to_log ('waiting for pump to be connected...')
-        play_sound ('connect-water-pump.riff')
-        time.sleep (10)
-    result = masterflex.MasterflexSerial (1, device)
-    write_to_log ('detected pump at device [{}]'.format (device))
+    filename = wait_for_device (device, 'pump', 'pump', 'connect-water-pump.riff')
+    port = serial.Serial (
+        filename,
+        4800,
+        parity=serial.PARITY_ODD,
+        stopbits=serial.STOPBITS_ONE,
+        bytesize=serial.SEVENBITS,
+        timeout=0.1,
+    )
+    result = pump.Pump (port, 1, log=write_to_log)
+    result.start ()
+    write_to_log ('detected pump at device [{}]'.format (filename))
     return result
 
 
-def detect_scale ():
+def detect_scale (device='/dev/ttyUSB1'):
     """
     Get a serial connection to the scale.
-    :return: an instance of Serial.
-    """
-    device = '/dev/ttyUSB1'
-    while not os.path.exists (device):
-        write_to_log ('waiting for scale to be connected...')
-        play_sound ('connect-plant-scale.riff')
-        time.sleep (10)
-    result = serial.Serial (device, 9600, timeout=0)
-    write_to_log ('detected scale at device [{}]'.format (device))
+    :param device: the scale device as given in the configuration, see `devices.resolve`.
+    :return: a started scale reader.
+    """
+    filename = wait_for_device (device, 'scale', 'scale', 'connect-plant-scale.riff')
+    port = serial.Serial (filename, 9600, timeout=0.1)
+    write_to_log ('detected scale at device [{}]'.format (filename))
+    result = scale.ScaleReader (port, log=write_to_log)
+    result.start ()
     return result
 
 
-def download_experiment_data_file (token):
+def wait_for_device (device, kind, description, sound):
+    """
+    Wait for a device to be connected, asking the user to connect it every `DEVICE_PROMPT_PERIOD` seconds.
+
+    :return: the device file.
+    """
+    while True:
+        filename = MONITOR.wait_for (device, kind, timeout=DEVICE_PROMPT_PERIOD)
+        if filename is not None:
+            return filename
+        write_to_log ('waiting for {} {} to be connected...'.format (description, device))
+        play_sound (sound)
+
+
+def download_experiment_data_file (cfg):
     """
-    Download the plant data file from the dropbox folder associated with the given token.
+    Download the plant data file from the remote storage given in the configuration.
     The file is saved in the location given by variable `EXPERIMENT_DATA_FILENAME`.
-    :param: token: the dropbox token.
+    The file is not downloaded if the local copy has the same content hash.
+    :param: cfg: the configuration.
     """
     try:
-        dbx = dropbox.Dropbox (token)
-        write_to_log ('connected to dropbox account')
-        dbx.files_download_to_file (EXPERIMENT_DATA_FILENAME, '/experiment-data.csv')
-        write_to_log ('downloaded experiment data file')
-        play_sound ('download-experiment-data.riff')
+        if sync.download_if_changed (remote_storage (cfg), EXPERIMENT_DATA_FILENAME, REMOTE_EXPERIMENT_DATA_PATH):
+            write_to_log ('downloaded experiment data file')
+            play_sound ('download-experiment-data.riff')
+        else:
+            write_to_log ('experiment data file is up to date')
         result = True
     except BaseException as ex:
-        write_to_log ('an error occur while downloading experiment data file {}'.format (ex))
+        write_to_log ('an error occur while downloading experiment data file {}'.format (ex), logger.ERROR)
         play_sound ('no-download-experiment-data.riff')
         result = False
     return result
@@ -195,117 +885,79 @@ def download_experiment_data_file (token):
 def read_experiment_data_file ():
     """
     Read the experiment data file containing information about wich plants should be watered
-    and return a dictionary with id's associated with plant data.
+    and return a plant registry, a mapping of id's to plant data.
+
+    Malformed rows are reported in the log and skipped.  If the file cannot be parsed, the
+    registry is empty.
     """
     try:
-        with open (EXPERIMENT_DATA_FILENAME, 'r') as fd:
-            reader = csv.DictReader (
-                fd,
-                quoting=csv.QUOTE_NONNUMERIC,
-                delimiter=',',
-            )
-            result = {
-                row ['id']: Plant (row)
-                for row in reader
-            }
-    except BaseException:
-        try:
-            with open (EXPERIMENT_DATA_FILENAME, 'r') as fd:
-                reader = csv.DictReader (
-                    fd,
-                    quoting=csv.QUOTE_NONNUMERIC,
-                    delimiter=';',
-                )
-                result = {
-                    row ['id']: Plant (row)
-                    for row in reader
-                }
-        except BaseException:
-            try:
-                with open (EXPERIMENT_DATA_FILENAME, 'r') as fd:
-                    reader = csv.DictReader (
-                        fd,
-                        delimiter=';',
-                    )
-                    result = {
-                        row ['id']: Plant (row)
-                        for row in reader
-                    }
-            except BaseException:
-                play_sound ('error-parsing-experiment-data.riff')
-    print (result)
+        result = experiment.load (EXPERIMENT_DATA_FILENAME, EXPERIMENT_CACHE_FILENAME, log=write_to_log)
+    except (IOError, experiment.ExperimentDataError) as ex:
+        write_to_log ('an error occur while parsing experiment data file {}'.format (ex), logger.ERROR)
+        play_sound ('error-parsing-experiment-data.riff')
+        result = experiment.PlantRegistry ()
     return result
 
 
-hid = {
-    4: 'a', 5: 'b', 6: 'c', 7: 'd', 8: 'e', 9: 'f', 10: 'g', 11: 'h', 12: 'i', 13: 'j', 14: 'k', 15: 'l', 16: 'm',
-    17: 'n', 18: 'o', 19: 'p', 20: 'q', 21: 'r', 22: 's', 23: 't', 24: 'u', 25: 'v', 26: 'w', 27: 'x', 28: 'y', 29: 'z',
-    30: '1', 31: '2', 32: '3', 33: '4', 34: '5', 35: '6', 36: '7', 37: '8', 38: '9', 39: '0', 44: ' ', 45: '-', 46: '=',
-    47: '[', 48: ']', 49: '\\', 51: ';', 52: '\'', 53: '~', 54: ',', 55: '.', 56: '/'
-}
-
-hid2 = {
-    4: 'A', 5: 'B', 6: 'C', 7: 'D', 8: 'E', 9: 'F', 10: 'G', 11: 'H', 12: 'I', 13: 'J', 14: 'K', 15: 'L', 16: 'M',
-    17: 'N', 18: 'O', 19: 'P', 20: 'Q', 21: 'R', 22: 'S', 23: 'T', 24: 'U', 25: 'V', 26: 'W', 27: 'X', 28: 'Y', 29: 'Z',
-    30: '!', 31: '@', 32: '#', 33: '$', 34: '%', 35: '^', 36: '&', 37: '*', 38: '(', 39: ')', 44: ' ', 45: '_', 46: '+',
-    47: '{', 48: '}', 49: '|', 51: ':', 52: '"', 53: '~', 54: '<', 55: '>', 56: '?'
-}
-
-
-def get_plant_code_reading (barcode_scanner_device):
+def get_plant_code_reading (barcode_scanner, prompt=True, timeout=None):
     """
     Get a plant code using the barcode scanner.
 
-    The code of this function was taken from `https://github.com/rgrokett/TalkingBarcodeReader`.
-    :return: a long number.
-    """
-    play_sound ('waiting-barcode.riff')
-    fd = open (barcode_scanner_device, 'rb')
-    ss = ''
-    shift = False
-    done = False
-    while not done:
-        # Get the character from the HID
-        buffer = fd.read (8)
-        for c in buffer:
-            if ord (c) > 0:
-                # 40 is carriage return which signifies
-                # we are done looking for characters
-                if int (ord (c)) == 40:
-                    done = True
-                    break
-                # If we are shifted then we have to
-                # use the hid2 characters.
-                if shift:
-                    # If it is a '2' then it is the shift key
-                    if int (ord (c)) == 2:
-                        shift = True
-                    # if not a 2 then lookup the mapping
-                    else:
-                        ss += hid2[int (ord (c))]
-                        shift = False
-                # If we are not shifted then use
-                # the hid characters
-                else:
-                    # If it is a '2' then it is the shift key
-                    if int (ord (c)) == 2:
-                        shift = True
-                    # if not a 2 then lookup the mapping
-                    else:
-                        ss += hid[int (ord (c))]
-    fd.close ()
-    result = ss
-    write_to_log ('read plant code {}'.format (result))
+    :param barcode_scanner: the barcode reader returned by `detect_barcode_scanner`.
+    :param prompt: whether to play the waiting for barcode prompt.
+    :param timeout: how many seconds to wait for a barcode, by default wait forever.
+    :return: a long number or `None` if no barcode was scanned before the timeout.
+    """
+    if prompt:
+        play_sound ('waiting-barcode.riff')
+    result = barcode_scanner.read (timeout)
+    if result is not None:
+        BARCODES_READ.inc ()
+        BARCODE_WAIT.observe (barcode_scanner.waited)
+        write_to_log ('read plant code {}'.format (result), plant=result, stage='barcode')
     return result
 
 
 def reset_watering_file ():
+    """
+    Archive the watering file and start a new one.
+
+    The rows not uploaded yet are uploaded first, they would be lost once the upload starts a new
+    generation.  Then the watering file is renamed with the current timestamp, and a new session is
+    started in the watering store.
+    """
+    global WATERING_FD
     play_sound ('reset-watering.riff')
-    with open (WATERING_FILENAME, 'wt') as fd:
-        fd.write (
-            '"timestamp",\"plant id","plant current weight","plant desired weight","watered","motor speed",'
-            '"revolutions","water per 1 revolution"\n')
-    write_to_log ('reset watering file')
+    now = datetime.datetime.now ()
+    prefix = '{}-{}'.format (os.path.splitext (WATERING_FILENAME) [0], now.strftime ('%Y%m%d-%H%M%S'))
+    archive = prefix + '.csv'
+    index = 1
+    while os.path.exists (archive):
+        index += 1
+        archive = '{}-{}.csv'.format (prefix, index)
+    with WATERING_LOCK:
+        if SYNC is not None:
+            try:
+                SYNC.sync ()
+            except BaseException as ex:
+                write_to_log ('could not upload the watering file before the reset {}'.format (ex), logger.ERROR)
+        if WATERING_FD is not None:
+            WATERING_FD.close ()
+            WATERING_FD = None
+        if os.path.exists (WATERING_FILENAME):
+            os.rename (WATERING_FILENAME, archive)
+        else:
+            archive = None
+        fd = watering_file ()
+        fd.write (store.CSV_HEADER)
+        fd.flush ()
+        os.fsync (fd.fileno ())
+        if STORE is not None:
+            STORE.new_session (now.isoformat (), archive)
+    if archive is None:
+        write_to_log ('reset watering file')
+    else:
+        write_to_log ('reset watering file, archived it to {}'.format (archive))
 
 
 def report_plant_code (code, plants):
@@ -319,79 +971,297 @@ def report_plant_code (code, plants):
     """
     ok = code in plants
     if ok:
-        synthesise_text ('Read plant code {}. The description is {}.'.format (
-            ' '.join (str (code)),
-            plants [code].description,
-        ))
+        synthesise_text (plant_code_text (code, plants [code]))
     else:
         write_to_log ('non existing plant code {}'.format (
             code
-        ))
+        ), logger.WARNING, plant=code, stage='barcode')
         synthesise_text ('Warning! Unknown plant code {}.'.format (
             ' '.join (str (code)),
         ))
     return ok
 
 
-def get_scale_reading (scale):
+def plant_code_text (code, plant):
+    """
+    Return the sentence that confirms the plant code read by the barcode scanner.
+    """
+    return 'Read plant code {}. The description is {}.'.format (
+        ' '.join (str (code)),
+        plant.description,
+    )
+
+
+def report_plant_history (plant_id):
+    """
+    Log the last weight of the plant and the water it was given in the current session.
     """
-    Get a scale reading.
+    history = STORE.history (plant_id) if STORE is not None else None
+    if history is None:
+        write_to_log ('plant id {} was not weighed in this session'.format (plant_id), plant=plant_id, stage='history')
+    else:
+        write_to_log ('plant id {} weighed {}g at {} and was given {:.1f}g of water in {} waterings'.format (
+            plant_id,
+            history.last_weight,
+            history.last_timestamp,
+            history.total_water,
+            history.waterings,
+        ), plant=plant_id, stage='history')
+    return None
+
+
+def get_scale_reading (scale_reader):
     """
-    write_to_log ('waiting for scale to return a reading')
+    Get a settled scale reading.
+
+    Only the readings that arrive after this function is called are considered.  The scale reads about
+    0 g while it is empty, so the function first waits for a weight above `MAX_INVALID_WEIGHT`, repeating
+    the waiting for weight prompt every `WAITING_WEIGHT_PERIOD` seconds, and then waits for the weight to
+    settle.  A settled weight not above `MAX_INVALID_WEIGHT`, such as the plant removed before it
+    settled, is rejected.
+    """
+    write_to_log ('waiting for scale to return a reading', stage='scale')
     play_sound ('waiting-weight.riff')
-    ko = True
-    while ko:
-        reading = scale.readline ()
-        if len (reading) == 0:
+    start = time.time ()
+    since = start
+    prompted = start
+    while True:
+        reading = scale_reader.wait_reading (since, timeout=WAITING_WEIGHT_PERIOD)
+        if time.time () - prompted >= WAITING_WEIGHT_PERIOD:
             play_sound ('waiting-weight.riff')
-            time.sleep (5)
-        else:
-            ko = False
-    write_to_log ('scale returned the reading [{}]'.format (reading))
-    weight = reading [1:9]
-    try:
-        result = float (weight)
-    except ValueError:
-        result = get_scale_reading (scale)
-    if result <= MAX_INVALID_WEIGHT:
-        play_sound ('invalid-weight.riff')
-        write_to_log ('invalid weight {} <= {}'.format (result, MAX_INVALID_WEIGHT))
-        result = get_scale_reading (scale)
-    return result
+            prompted = time.time ()
+        if reading is None:
+            continue
+        since, weight = reading
+        if weight <= MAX_INVALID_WEIGHT:
+            continue
+        result = scale_reader.settled_weight (
+            SCALE_STABLE_READINGS,
+            SCALE_TOLERANCE,
+            since=start,
+            timeout=WAITING_WEIGHT_PERIOD,
+        )
+        if result is None:
+            continue
+        stop_sound ('waiting-weight.riff')
+        duration = time.time () - start
+        SCALE_SETTLE.observe (duration)
+        write_to_log ('scale returned the weight {} after {:.0f} ms'.format (result, duration * 1000),
+                      stage='scale', duration='{:.3f}'.format (duration))
+        if result > MAX_INVALID_WEIGHT:
+            return result
+        INVALID_WEIGHTS.inc ()
+        play_sound ('invalid-weight.riff', priority=audio.URGENT, interrupt=True)
+        write_to_log ('invalid weight {} <= {}'.format (result, MAX_INVALID_WEIGHT), logger.WARNING, stage='scale')
+        start = time.time ()
+        since = start
+        prompted = start
 
 
 def water_plant (plant_id, plant_current_weight, plant_desired_weight, pump):
+    # the pump parameters may be reloaded while the plant is watered
+    motor_speed = MOTOR_SPEED
+    water_per_1_revolution = WATER_PER_1_REVOLUTION
     delta_weight = plant_desired_weight - plant_current_weight
     if delta_weight > 0:
-        write_to_log ('plant id {} needs {}g of water'.format (plant_id, delta_weight))
-        revolutions = '{:.2f}'.format (delta_weight / WATER_PER_1_REVOLUTION)
-        pump.setMotorSpeed (MOTOR_SPEED)
-        pump.setRevolutions (revolutions)
-        pump.go ()
-        write_to_log ('set the pump speed to {} and pump revolutions to {}'.format (MOTOR_SPEED, revolutions))
-        record_watering (plant_id, plant_current_weight, plant_desired_weight, MOTOR_SPEED, revolutions)
+        write_to_log ('plant id {} needs {}g of water'.format (plant_id, delta_weight), plant=plant_id, stage='pump')
+        revolutions = '{:.2f}'.format (delta_weight / water_per_1_revolution)
+        wait_previous_pump_run (pump)
+        intent = begin_pump_run (
+            plant_id, plant_current_weight, plant_desired_weight, revolutions, water_per_1_revolution, motor_speed)
+        with PUMP_COMMAND.time (command='run'):
+            pump.run_revolutions (motor_speed, revolutions)
+        write_to_log ('set the pump speed to {} and pump revolutions to {}'.format (motor_speed, revolutions),
+                      plant=plant_id, stage='pump', water_per_1_revolution=water_per_1_revolution)
+        record_watering (
+            plant_id, plant_current_weight, plant_desired_weight, motor_speed, revolutions, water_per_1_revolution)
+        end_pump_run (intent)
     else:
-        write_to_log ('plant id {} has excess water, {}g'.format (plant_id, -delta_weight))
+        write_to_log ('plant id {} has excess water, {}g'.format (plant_id, -delta_weight), plant=plant_id, stage='pump')
+        record_weight (plant_id, plant_current_weight, plant_desired_weight)
+    return None
+
+
+def water_plant_closed_loop (plant_id, plant_current_weight, plant_desired_weight, pump, scale_reader):
+    """
+    Water a plant that stays on the scale.
+
+    The pump runs the revolutions given by the calibration estimate while the scale readings are streamed.
+    It is halted as soon as the target weight is reached, and topped up if the settled weight is still
+    below the target.  The weight gain measured by the scale updates the calibration estimate.
+    """
+    delta_weight = plant_desired_weight - plant_current_weight
+    if delta_weight <= 0:
+        write_to_log ('plant id {} has excess water, {}g'.format (plant_id, -delta_weight), plant=plant_id, stage='pump')
         record_weight (plant_id, plant_current_weight, plant_desired_weight)
+        return None
+    write_to_log ('plant id {} needs {}g of water'.format (plant_id, delta_weight), plant=plant_id, stage='pump')
+    # the pump parameters may be reloaded while the plant is watered
+    motor_speed = MOTOR_SPEED
+    stable_readings = SCALE_STABLE_READINGS
+    tolerance = SCALE_TOLERANCE
+    max_invalid_weight = MAX_INVALID_WEIGHT
+    plant_calibration = CALIBRATION
+    water_per_1_revolution = plant_calibration.estimate
+    weight = plant_current_weight
+    total_revolutions = 0.0
+    wait_previous_pump_run (pump)
+    intent = begin_pump_run (
+        plant_id, plant_current_weight, plant_desired_weight,
+        '{:.2f}'.format (delta_weight / water_per_1_revolution), water_per_1_revolution, motor_speed)
+    for run in range (CLOSED_LOOP_MAX_TOP_UPS + 1):
+        deficit = plant_desired_weight - weight
+        if deficit <= tolerance:
+            break
+        revolutions = deficit / water_per_1_revolution
+        with PUMP_COMMAND.time (command='run'):
+            pump.run_revolutions (motor_speed, '{:.2f}'.format (revolutions))
+        start = time.time ()
+        write_to_log ('set the pump speed to {} and pump revolutions to {:.2f}'.format (motor_speed, revolutions),
+                      plant=plant_id, stage='pump', water_per_1_revolution=water_per_1_revolution)
+        # the motor speed is in revolutions per minute
+        duration = revolutions * 60.0 / motor_speed
+        since = start
+        while time.time () - start < duration + CLOSED_LOOP_SETTLE_TIME:
+            reading = scale_reader.wait_reading (since, timeout=0.5)
+            if reading is None:
+                continue
+            since, weight = reading
+            if weight >= plant_desired_weight - tolerance:
+                with PUMP_COMMAND.time (command='halt'):
+                    pump.halt ()
+                write_to_log ('plant id {} reached {}g, halted the pump'.format (plant_id, weight),
+                              plant=plant_id, stage='pump', duration='{:.3f}'.format (time.time () - start))
+                break
+        status = pump.wait_halted (timeout=CLOSED_LOOP_SETTLE_TIME)
+        if status is not None and status.remaining is not None:
+            total_revolutions += revolutions - status.remaining
+        else:
+            total_revolutions += min (revolutions, (time.time () - start) * motor_speed / 60.0)
+        settled = scale_reader.settled_weight (
+            stable_readings,
+            tolerance,
+            since=time.time (),
+            timeout=CLOSED_LOOP_SETTLE_TIME,
+        )
+        if settled is not None and settled <= max_invalid_weight:
+            write_to_log ('plant id {} was removed from the scale while it was watered'.format (plant_id),
+                          logger.WARNING, plant=plant_id, stage='pump')
+            break
+        if settled is not None:
+            weight = settled
+    if plant_calibration.update (weight - plant_current_weight, total_revolutions):
+        write_to_log ('water per one revolution estimate is {} grams'.format (plant_calibration.estimate))
+    record_watering (
+        plant_id, plant_current_weight, plant_desired_weight, motor_speed,
+        '{:.2f}'.format (total_revolutions), water_per_1_revolution)
+    end_pump_run (intent)
+    return None
+
+
+def wait_previous_pump_run (station_pump):
+    """
+    Wait until the pump run of the previous plant has finished.  This is done before the intent of the
+    next run is journaled, so that a power cut while waiting does not record a run that never started.
+
+    :raise pump.PumpError: if the previous run does not finish in `PUMP_RUN_TIMEOUT` seconds.
+    """
+    if station_pump.wait_halted (timeout=PUMP_RUN_TIMEOUT) is None:
+        raise pump.PumpError ('the previous pump run did not finish in {} seconds'.format (PUMP_RUN_TIMEOUT))
     return None
 
 
-def record_watering (plant_id, plant_current_weight, plant_desired_weight, motor_speed, revolutions):
+def begin_pump_run (plant_id, plant_current_weight, plant_desired_weight, revolutions, water_per_1_revolution,
+                    motor_speed):
+    """
+    Append the intent of a pump run to the journal and wait until it is on disk.
+
+    :return: the journal intent or `None` if there is no journal.
     """
-    Record a watering event.
+    if JOURNAL is None:
+        return None
+    return JOURNAL.begin (
+        plant_id,
+        current_weight=plant_current_weight,
+        desired_weight=plant_desired_weight,
+        motor_speed=motor_speed,
+        revolutions=revolutions,
+        water_per_1_revolution=water_per_1_revolution,
+    )
+
+
+def end_pump_run (intent):
+    if intent is not None:
+        JOURNAL.commit (intent)
+    return None
+
+
+def recover_watering ():
+    """
+    Reconcile the pump runs interrupted by a power cut and start the journal.
+
+    A torn last row of the watering file is removed.  An interrupted pump run may have watered the plant,
+    so if its row is not in the watering file, it is recorded, preventing the plant from being watered
+    twice.
+    """
+    global JOURNAL
+    JOURNAL = journal.Journal (JOURNAL_FILENAME, log=write_to_log)
+    intents = JOURNAL.recover ()
+    if os.path.exists (WATERING_FILENAME):
+        with open (WATERING_FILENAME, 'rb+') as fd:
+            fd.seek (0, os.SEEK_END)
+            size = fd.tell ()
+            fd.seek (max (0, size - WATERING_TAIL_SIZE))
+            tail = fd.read ()
+            if tail and not tail.endswith (b'\n'):
+                fd.truncate (size - len (tail) + tail.rfind (b'\n') + 1)
+                write_to_log ('removed torn row at the end of the watering file', logger.WARNING)
+        rows = [line.split (b',') for line in tail.splitlines ()]
+    else:
+        rows = []
+    for intent in intents:
+        started = datetime.datetime.fromtimestamp (intent ['time']).isoformat ().encode ()
+        recorded = any (
+            len (row) > 1 and row [1] == str (intent ['plant']).encode () and row [0].strip (b'"') >= started
+            for row in rows
+        )
+        if not recorded:
+            record_watering (
+                intent ['plant'], intent ['current_weight'], intent ['desired_weight'],
+                intent ['motor_speed'], intent ['revolutions'], intent ['water_per_1_revolution'])
+        write_to_log ('recovered interrupted pump run of plant id {}{}'.format (
+            intent ['plant'], '' if recorded else ', recorded it as watered'),
+            logger.WARNING, plant=intent ['plant'], stage='recovery')
+    JOURNAL.start ()
+    return None
+
+
+def record_watering (plant_id, plant_current_weight, plant_desired_weight, motor_speed, revolutions,
+                     water_per_1_revolution=None):
+    """
+    Record a watering event in the watering store and the watering file.
+
+    :param water_per_1_revolution: the calibration used, by default `WATER_PER_1_REVOLUTION`.
     """
+    if water_per_1_revolution is None:
+        water_per_1_revolution = WATER_PER_1_REVOLUTION
     now = datetime.datetime.now ()
-    with open (WATERING_FILENAME, 'at') as fd:
-        fd.write ('"{}",{},{},{},1,{},{},{}\n'.format (
+    with RECORD_WRITE.time ():
+        if STORE is not None:
+            STORE.record (
+                now.isoformat (), plant_id, plant_current_weight, plant_desired_weight,
+                motor_speed, revolutions, water_per_1_revolution)
+        append_watering_row ('"{}",{},{},{},1,{},{},{}\n'.format (
             now.isoformat (),
             plant_id,
             plant_current_weight,
             plant_desired_weight,
             motor_speed,
             revolutions,
-            WATER_PER_1_REVOLUTION
+            water_per_1_revolution
             )
         )
+    PUMP_REVOLUTIONS.inc (float (revolutions))
 
 
 def record_weight (plant_id, plant_current_weight, plant_desired_weight):
@@ -400,8 +1270,10 @@ def record_weight (plant_id, plant_current_weight, plant_desired_weight):
     Used when there is no watering.
     """
     now = datetime.datetime.now ()
-    with open (WATERING_FILENAME, 'at') as fd:
-        fd.write ('"{}",{},{},{},0,,,\n'.format (
+    with RECORD_WRITE.time ():
+        if STORE is not None:
+            STORE.record (now.isoformat (), plant_id, plant_current_weight, plant_desired_weight)
+        append_watering_row ('"{}",{},{},{},0,,,\n'.format (
             now.isoformat (),
             plant_id,
             plant_current_weight,
@@ -410,41 +1282,138 @@ def record_weight (plant_id, plant_current_weight, plant_desired_weight):
         )
 
 
-def upload_watering (token):
+def open_watering_store ():
+    """
+    Open the indexed watering store.  The watering file is kept as the exported copy of the current session.
+    """
+    global STORE
+    STORE = store.WateringStore (STORE_FILENAME)
+    return None
+
+
+def watering_file ():
+    """
+    Return the watering file, opened for appending on the first call.  Must be called with
+    `WATERING_LOCK` held.
+    """
+    global WATERING_FD
+    if WATERING_FD is None:
+        WATERING_FD = open (WATERING_FILENAME, 'at')
+    return WATERING_FD
+
+
+def append_watering_row (row):
+    """
+    Append a row to the watering file and wait until it is on disk.
+    """
+    with WATERING_LOCK:
+        fd = watering_file ()
+        fd.write (row)
+        fd.flush ()
+        os.fsync (fd.fileno ())
+    return None
+
+
+def upload_watering (cfg):
+    """
+    Upload the rows of the watering file added since the last upload, and start the background thread
+    that uploads the new rows during the session.
+    """
+    global SYNC
     try:
-        dbx = dropbox.Dropbox (token)
-        write_to_log ('connected to dropbox account')
-        # read the content
-        with open (WATERING_FILENAME, 'r') as fd:
-            content = ''
-            for line in fd:
-                content += line
-            content = bytes (content)
-        dbx.files_upload (
-            content,
-            '/watering.csv',
-            mode=dropbox.files.WriteMode.overwrite,
-        )
-        write_to_log ('uploaded watering file')
+        if SYNC is None:
+            SYNC = sync.WateringSync (
+                remote_storage (cfg),
+                WATERING_FILENAME,
+                WATERING_SYNC_FILENAME,
+                REMOTE_WATERING_FOLDER,
+                log=write_to_log,
+            )
+        size = SYNC.sync ()
+        write_to_log ('uploaded {} bytes of the watering file'.format (size))
         play_sound ('upload-watering.riff')
         result = True
     except BaseException as ex:
-        write_to_log ('an error occur while uploading watering file {}'.format (ex))
+        write_to_log ('an error occur while uploading watering file {}'.format (ex), logger.ERROR)
         play_sound ('no-uploading-watering.riff')
         result = False
+    if SYNC is not None and SYNC.worker is None:
+        SYNC.start ()
     return result
 
 
-def play_sound (sound):
+def start_device_monitor ():
+    """
+    Start the monitor of the device files.
+    """
+    global MONITOR
+    MONITOR = devices.DeviceMonitor (log=write_to_log)
+    MONITOR.start ()
+    return None
+
+
+def start_metrics ():
+    """
+    Start the metrics HTTP server on `METRICS_ADDRESS` and the writer of the metrics file.  The station
+    runs without the HTTP server if its port cannot be opened.
+    """
+    global METRICS_TEXTFILE
+    try:
+        server = metrics.MetricsServer (METRICS, METRICS_ADDRESS)
+        server.start ()
+        write_to_log ('serving the metrics on port {}'.format (METRICS_ADDRESS [1]))
+    except OSError as ex:
+        write_to_log ('could not serve the metrics on port {}: {}'.format (METRICS_ADDRESS [1], ex), logger.WARNING)
+    METRICS_TEXTFILE = metrics.TextfileWriter (METRICS, METRICS_FILENAME, METRICS_PERIOD, log=write_to_log)
+    METRICS_TEXTFILE.start ()
+    return None
+
+
+def scale_reading_age (scale_reader):
+    """
+    Return the seconds since the last reading of the scale, or `None` if it has sent none.
+    """
+    reading = scale_reader.latest ()
+    if reading is None:
+        return None
+    return time.time () - reading [0]
+
+
+def start_audio ():
+    """
+    Start the audio engine that plays the sound prompts in the folder `DATA_FOLDER`.
+    """
+    global AUDIO
+    AUDIO = audio.AudioEngine (DATA_FOLDER, log=write_to_log, on_play=lambda sound, waited: SOUND_WAIT.observe (waited))
+    AUDIO.start ()
+    return None
+
+
+def start_speech_cache ():
+    """
+    Open the cache of synthesised sentences in the folder `SPEECH_CACHE_FOLDER`.
+    """
+    global SPEECH
+    SPEECH = tts.SpeechCache (SPEECH_CACHE_FOLDER, SPEECH_CACHE_SIZE, voice=VOICE, log=write_to_log)
+    return None
+
+
+def play_sound (sound, priority=audio.NORMAL, interrupt=False):
     """
     Play the sound in the given filename.
 
     Sound files are located in the folder `/home/pi/water-weight-control`.
 
-    The function returns after the sound has been played.
+    If the audio engine is running, the sound is queued and the function returns immediately.  Otherwise,
+    the function returns after the sound has been played.
 
     :param sound: the sound filename.
+    :param priority: the priority of the sound in the audio engine queue.
+    :param interrupt: whether the sound cuts off the sound being played.
     """
+    if AUDIO is not None:
+        AUDIO.play (sound, priority=priority, interrupt=interrupt)
+        return None
     command = [
         '/usr/bin/omxplayer',
         '--no-osd',
@@ -458,17 +1427,32 @@ def play_sound (sound):
     return None
 
 
+def stop_sound (sound):
+    """
+    Stop the given sound if it is queued or being played by the audio engine.
+    """
+    if AUDIO is not None:
+        AUDIO.cancel (sound)
+    return None
+
+
 def synthesise_text (text):
     """
     Use the speech synthesizer to play the given text.
 
-    The function returns after the text has been spoken.
+    If the speech cache is open, the text is synthesised only if it is not in the cache, and then played
+    with `play_sound`.  Otherwise, the function returns after the text has been spoken.
 
     :param text: the text to be spoken.
     """
+    if SPEECH is not None:
+        with SPEECH_TIME.time (cache='hit' if SPEECH.contains (text) else 'miss'):
+            filename = SPEECH.get (text)
+        play_sound (filename)
+        return None
     command = [
         '/usr/bin/flite',
-        '-voice', 'slt',
+        '-voice', VOICE,
         '-t', text
     ]
     process = subprocess.Popen (
@@ -478,34 +1462,30 @@ def synthesise_text (text):
     return None
 
 
-def wait_for_file (filename, timeout, check_time = 1):
+def wait_for_file (filename, timeout):
     """Waits for the given filename to appear in the file system.
 
     This function is used by the application to wait for devices to be
     connected to the raspberry pi.  The function waits at most `timeout`
-    seconds and checks the existence of the file every `check_time`
-    seconds.
+    seconds and is woken up by the device monitor when the device files
+    change.
 
     :param filename: the device filename to wait for.
     :param timeout: how many seconds to wait for.
-    :param check_time: the filename existence period (in seconds).
 
     :return: `True` if the device filename exists.
     """
-    elapsed = 0
-    while not os.path.exists (filename) and elapsed < timeout:
-        time.sleep (check_time)
-        elapsed += check_time
-    return os.path.exists (filename)
+    return MONITOR.wait_until (lambda: os.path.exists (filename), timeout)
 
 
-def write_to_log (message):
-    print (message)
-    with open ('/var/log/interpheno/controlo-peso-planta.log', 'at') as fd:
-        fd.write ('{}: {}\n'.format (
-            datetime.datetime.now ().isoformat (),
-            message
-            ))
+def write_to_log (message, level=logger.INFO, **fields):
+    """
+    Log a message with the buffered logger.  The function returns before the message is written.
+
+    :param level: the message level.
+    :param fields: structured fields, such as `plant`, `stage` and `duration`.
+    """
+    LOG.log (level, message, **fields)
     return None
 
 
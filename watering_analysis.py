@@ -0,0 +1,269 @@
+#!/usr/bin/python3
+"""
+Analyse the watering file and fit the water weight per one pump revolution.
+
+The watering file is read in chunks of rows that are converted to NumPy arrays, so memory use depends on
+the chunk size and on the number of plants, not on the number of rows.  For each plant the tool computes
+the water used and the trend of its weight.  The water weight per one revolution is fitted by comparing
+each watering with the next weighing of the same plant: the weight gain is regressed on the revolutions,
+and the intercept absorbs the water lost between the two weighings.
+
+The fitted value can be written back to the pump data file read by `water_plant.setup_pump`.
+"""
+
+import argparse
+import csv
+import math
+import os
+import yaml
+
+import numpy
+
+import water_plant
+
+# z value of the 95% confidence interval
+Z_95 = 1.959964
+# minimum number of watering and weighing pairs to fit the water weight per one revolution
+MIN_PAIRS = 10
+
+
+class Analysis:
+    """
+    Accumulate the per-plant statistics and the regression sums chunk by chunk.
+    """
+    def __init__ (self):
+        self.plant_codes = {}
+        self.plant_ids = []
+        # per plant columns, indexed by plant code
+        self.weighings = numpy.zeros (0)
+        self.waterings = numpy.zeros (0)
+        self.water = numpy.zeros (0)
+        self.first_weight = numpy.zeros (0)
+        self.last_weight = numpy.zeros (0)
+        self.time_sums = numpy.zeros ((0, 4))
+        # last row of each plant, carried to the next chunk: code, time, weight, watered, revolutions
+        self.carry = numpy.zeros ((0, 5))
+        # regression sums of the weight gain on the revolutions: n, x, y, xx, xy, yy
+        self.sums = numpy.zeros (6)
+        # time of the first row, the weight trend is fitted on the days since this time
+        self.origin = None
+        self.rows = 0
+        self.malformed = 0
+
+    def codes (self, plant_ids):
+        result = numpy.empty (len (plant_ids), dtype=numpy.int64)
+        for index, plant_id in enumerate (plant_ids):
+            code = self.plant_codes.get (plant_id)
+            if code is None:
+                code = len (self.plant_ids)
+                self.plant_codes [plant_id] = code
+                self.plant_ids.append (plant_id)
+            result [index] = code
+        grow = len (self.plant_ids) - len (self.weighings)
+        if grow > 0:
+            self.weighings = numpy.concatenate ((self.weighings, numpy.zeros (grow)))
+            self.waterings = numpy.concatenate ((self.waterings, numpy.zeros (grow)))
+            self.water = numpy.concatenate ((self.water, numpy.zeros (grow)))
+            self.first_weight = numpy.concatenate ((self.first_weight, numpy.full (grow, numpy.nan)))
+            self.last_weight = numpy.concatenate ((self.last_weight, numpy.full (grow, numpy.nan)))
+            self.time_sums = numpy.concatenate ((self.time_sums, numpy.zeros ((grow, 4))))
+        return result
+
+    def add_chunk (self, rows):
+        """
+        Add a chunk of rows of the watering file, in file order.
+        """
+        plant_ids = []
+        columns = []
+        for row in rows:
+            try:
+                watered = row [4] == '1'
+                columns.append ((
+                    numpy.datetime64 (row [0], 'us').astype (numpy.int64) / 1e6,
+                    float (row [2]),
+                    1.0 if watered else 0.0,
+                    float (row [6]) if watered else 0.0,
+                    float (row [7]) if watered else 0.0,
+                ))
+                plant_ids.append (row [1])
+            except (ValueError, IndexError):
+                self.malformed += 1
+        if not columns:
+            return None
+        self.rows += len (columns)
+        data = numpy.array (columns)
+        code = self.codes (plant_ids)
+        seconds, weight, watered, revolutions, water_per_1_revolution = data.T
+        count = len (self.plant_ids)
+        self.weighings += numpy.bincount (code, minlength=count)
+        self.waterings += numpy.bincount (code, weights=watered, minlength=count)
+        self.water += numpy.bincount (code, weights=revolutions * water_per_1_revolution, minlength=count)
+        # the rows are in time order, so the last assignment of a plant is its last row
+        first = numpy.isnan (self.first_weight)
+        unseen = first [code]
+        self.first_weight [code [unseen] [::-1]] = weight [unseen] [::-1]
+        self.last_weight [code] = weight
+        if self.origin is None:
+            self.origin = seconds [0]
+        days = (seconds - self.origin) / 86400.0
+        self.time_sums += numpy.stack ((
+            numpy.bincount (code, weights=days, minlength=count),
+            numpy.bincount (code, weights=weight, minlength=count),
+            numpy.bincount (code, weights=days * days, minlength=count),
+            numpy.bincount (code, weights=days * weight, minlength=count),
+        ), axis=1)
+        self.pair_waterings (numpy.column_stack ((code, seconds, weight, watered, revolutions)))
+        return None
+
+    def pair_waterings (self, events):
+        """
+        Pair each watering with the next weighing of the same plant and update the regression sums.
+        """
+        events = numpy.concatenate ((self.carry, events))
+        order = numpy.argsort (events [:, 0], kind='stable')
+        events = events [order]
+        same_plant = events [1:, 0] == events [:-1, 0]
+        pairs = same_plant & (events [:-1, 3] == 1.0)
+        x = events [:-1, 4] [pairs]
+        y = events [1:, 2] [pairs] - events [:-1, 2] [pairs]
+        self.sums += (len (x), x.sum (), y.sum (), (x * x).sum (), (x * y).sum (), (y * y).sum ())
+        last = numpy.append (~same_plant, True)
+        self.carry = events [last]
+        return None
+
+    def fit (self):
+        """
+        Return the fitted water weight per one revolution, its 95% confidence half width and the number of
+        pairs, or `None` if there are not enough pairs.
+        """
+        n, sx, sy, sxx, sxy, syy = self.sums
+        if n < MIN_PAIRS:
+            return None
+        var_x = sxx - sx * sx / n
+        if var_x <= 0:
+            return None
+        cov_xy = sxy - sx * sy / n
+        slope = cov_xy / var_x
+        residual = max (0.0, syy - sy * sy / n - slope * cov_xy)
+        standard_error = math.sqrt (residual / (n - 2) / var_x)
+        return float (slope), float (Z_95 * standard_error), int (n)
+
+    def plant_rows (self):
+        """
+        Yield the per-plant statistics: id, weighings, waterings, water, first weight, last weight and the
+        weight trend in grams per day.
+        """
+        n = self.weighings
+        sx, sy, sxx, sxy = self.time_sums.T
+        with numpy.errstate (divide='ignore', invalid='ignore'):
+            var_x = sxx - sx * sx / n
+            trend = numpy.where (var_x > 1e-9, (sxy - sx * sy / n) / var_x, numpy.nan)
+        for code, plant_id in enumerate (self.plant_ids):
+            yield (plant_id, int (n [code]), int (self.waterings [code]), self.water [code],
+                   self.first_weight [code], self.last_weight [code], trend [code])
+
+
+def read_chunks (filename, chunk_size):
+    """
+    Yield lists of at most `chunk_size` rows of the watering file, without the header rows.
+    """
+    with open (filename, 'r', newline='') as fd:
+        chunk = []
+        for row in csv.reader (fd):
+            if not row or row [0] == 'timestamp':
+                continue
+            chunk.append (row)
+            if len (chunk) == chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+
+def write_pump_data (filename, water_per_1_revolution):
+    """
+    Update the water weight per one revolution in the pump data file, keeping the other parameters.
+    """
+    exp = {}
+    if os.path.exists (filename):
+        with open (filename, 'r') as fd:
+            exp = yaml.safe_load (fd) or {}
+    exp.setdefault ('motor_speed', water_plant.MOTOR_SPEED)
+    exp ['water_per_1_revolution'] = round (water_per_1_revolution, 6)
+    temporary = filename + '.tmp'
+    with open (temporary, 'wt') as fd:
+        yaml.safe_dump (exp, fd, default_flow_style=False)
+    os.rename (temporary, filename)
+    return None
+
+
+def main ():
+    args = process_arguments ()
+    analysis = Analysis ()
+    for filename in args.watering:
+        for chunk in read_chunks (filename, args.chunk_size):
+            analysis.add_chunk (chunk)
+    print ('{} rows of {} plants, {} malformed rows'.format (analysis.rows, len (analysis.plant_ids), analysis.malformed))
+    if args.plants is not None:
+        with open (args.plants, 'wt', newline='') as fd:
+            writer = csv.writer (fd)
+            writer.writerow (['plant id', 'weighings', 'waterings', 'water', 'first weight', 'last weight', 'weight trend per day'])
+            writer.writerows (analysis.plant_rows ())
+    result = analysis.fit ()
+    if result is None:
+        print ('not enough waterings followed by a weighing to fit the water weight per one revolution')
+        return None
+    water_per_1_revolution, half_width, pairs = result
+    print ('water weight per one revolution is {:.4f} +/- {:.4f} grams (95% confidence, {} waterings)'.format (
+        water_per_1_revolution, half_width, pairs))
+    if args.write:
+        write_pump_data (args.pump_data, water_per_1_revolution)
+        print ('updated {}'.format (args.pump_data))
+    return None
+
+
+def process_arguments ():
+    parser = argparse.ArgumentParser (
+        description='Analyse the plant weights and waterings and fit the water weight per one pump revolution'
+    )
+    parser.add_argument (
+        'watering',
+        nargs='*',
+        default=[water_plant.WATERING_FILENAME],
+        help='watering files, in chronological order',
+        metavar='FILE'
+        )
+    parser.add_argument (
+        '-c',
+        '--chunk-size',
+        type=int,
+        default=100000,
+        help='number of rows processed at once',
+        metavar='N'
+        )
+    parser.add_argument (
+        '-p',
+        '--plants',
+        type=str,
+        default=None,
+        help='write the per-plant water use and weight trend to this CSV file',
+        metavar='FILE'
+        )
+    parser.add_argument (
+        '-w',
+        '--write',
+        action='store_true',
+        help='write the fitted value to the pump data file'
+        )
+    parser.add_argument (
+        '--pump-data',
+        type=str,
+        default=water_plant.PUMP_DATA_FILENAME,
+        help='pump data file updated with --write',
+        metavar='FILE'
+        )
+    return parser.parse_args ()
+
+
+if __name__ == '__main__':
+    main ()